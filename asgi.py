@@ -0,0 +1,450 @@
+# asgi.py
+#
+# Modo ASGI (assíncrono) do bot, com as mesmas rotas do app Flask:
+#   /webhook/cartpanda, /webhook/zapi/inbound, /webhook/zapi/status, /delivery/{phone}, /broadcast, /health, /ready, /metrics, /
+#
+# Redis via redis.asyncio e Z-API via httpx.AsyncClient, ambos com pool de conexões,
+# então um processo segura milhares de webhooks simultâneos sem prender uma thread por
+# requisição. As regras de atendimento são as mesmas (flows.py); a configuração e os
+# objetos sem I/O por requisição (catálogo, LLM, regras de upsell) vêm de main.py.
+#
+# Execução:
+#   web: uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 2
+#   worker: python dispatcher.py
+#   reminders: python reminders.py (lembretes de carrinho/PIX)
+#   broadcast: python broadcast.py (campanhas)
+#
+import os
+import time
+import asyncio
+import functools
+import contextlib
+
+import httpx
+import redis.asyncio as aioredis
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import keyschema
+import main
+import metrics
+from body import BodyTooLarge, read_async
+from copys import COPY_RATE_LIMITED
+from debounce import AsyncDebouncer
+from delivery import AsyncDeliveryStore, parse_status
+from flows import (
+    ORDER_EVENTS, ABANDONED_EVENTS, now, saudacao, normalize_phone,
+    event_id, cart_row, abandoned_info, order_plan, parse_inbound, inbound_reply, fallback_text,
+)
+from outbox import AsyncRedisOutbox, make_job
+from plans import AsyncPlanRunner, text_step
+from ratelimit import AsyncRateLimiter
+from reminders import AsyncReminderStore
+from rules import HISTORY_FIELD, apply_order
+from templates import render
+from userctx import AsyncUserContext
+from zapi_pool import error_result
+
+ASGI_REDIS_POOL = int(os.getenv("ASGI_REDIS_POOL", "200"))
+
+main.check_config()  # o pool do redis.asyncio também só conecta no primeiro comando
+ar = aioredis.Redis.from_url(main.REDIS_URL, decode_responses=True, max_connections=ASGI_REDIS_POOL)
+outbox = AsyncRedisOutbox(ar)
+delivery = AsyncDeliveryStore(ar)
+reminders = AsyncReminderStore(ar)
+debouncer = AsyncDebouncer(ar)
+limiter = AsyncRateLimiter(ar, main.RL_PER_MIN, main.RL_PER_HOUR)
+zapi = httpx.AsyncClient(
+    headers=main._ZAPI_HEADERS,
+    timeout=httpx.Timeout(main.ZAPI_READ_TIMEOUT, connect=main.ZAPI_CONNECT_TIMEOUT),
+    limits=httpx.Limits(max_connections=main.ZAPI_POOL_SIZE, max_keepalive_connections=main.ZAPI_POOL_SIZE),
+    transport=httpx.AsyncHTTPTransport(retries=main.ZAPI_RETRIES),  # só falhas de conexão
+)
+
+
+async def _read_body(request, secret: str = ""):
+    """WebhookBody (body.py) ou None se passar de MAX_BODY_BYTES."""
+    try:
+        return await read_async(request.stream(), secret, request.headers.get("content-length"))
+    except BodyTooLarge:
+        return None
+
+def _too_large():
+    return JSONResponse({"error": "payload too large"}, 413)
+
+
+def _timed_route(route: str):
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(request):
+            t0 = time.perf_counter()
+            try:
+                return await fn(request)
+            finally:
+                metrics.observe_handler(route, time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+
+def _token_ok(request) -> bool:
+    token = request.query_params.get("t") or request.headers.get("X-Webhook-Token", "")
+    return token == main.WEBHOOK_VERIFY_TOKEN
+
+
+# -------------------------
+# Redis / Z-API
+# -------------------------
+async def rate_limit_ok(phone: str) -> bool:
+    try:
+        return await limiter.allow(phone)
+    except Exception:
+        return True  # Redis fora não deve calar o atendimento
+
+async def idempotent_event_seen(evt_id: str) -> bool:
+    if not evt_id:
+        return False
+    p = ar.pipeline(transaction=False)
+    keyschema.queue_event_seen(p, evt_id)
+    return keyschema.event_seen(await p.execute())
+
+async def user_context(phone: str, guards=(), load: bool = True) -> AsyncUserContext:
+    return await AsyncUserContext.load(ar, phone, guards=guards, guard_ttl_min=main.SENT_TTL_MIN, load=load,
+                                       upsell_cooldown_hours=main.UPSELL_COOLDOWN_HOURS)
+
+async def zapi_send_text(phone: str, text: str) -> dict:
+    t0 = time.perf_counter()
+    res = await _zapi_post(phone, "send-text", {"phone": phone, "message": text})
+    metrics.observe_zapi("text", res, time.perf_counter() - t0)
+    return res
+
+async def zapi_send_image(phone: str, image_url: str, caption: str = "") -> dict:
+    if not (image_url or "").lower().startswith("http"):
+        return {"ok": False, "error": "invalid_image_url"}
+    t0 = time.perf_counter()
+    res = await _zapi_post(phone, "send-image", {"phone": phone, "image": image_url, "caption": caption})
+    metrics.observe_zapi("image", res, time.perf_counter() - t0)
+    return res
+
+async def zapi_send_file(phone: str, file_url: str, caption: str = "") -> dict:
+    if not (file_url or "").lower().startswith("http"):
+        return {"ok": False, "error": "invalid_file_url"}
+    t0 = time.perf_counter()
+    res = await _zapi_post(phone, "send-file", {"phone": phone, "file": file_url, "caption": caption})
+    metrics.observe_zapi("file", res, time.perf_counter() - t0)
+    return res
+
+async def _zapi_post(phone: str, path: str, payload: dict) -> dict:
+    async def post(inst):
+        try:
+            resp = await zapi.post(f"{inst.base}/{path}", headers=inst.headers, json=payload)
+            try:
+                data = resp.json()
+            except Exception:
+                data = {"status_code": resp.status_code, "text": resp.text}
+            return {"ok": resp.status_code < 300, "status": resp.status_code, "data": data}
+        except Exception as e:
+            # sem conexão (ou sem vaga no pool do httpx) o POST não saiu; o resto é entrega incerta
+            return error_result(e, isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)))
+    return await main.zapi_pool.asend(phone, post)
+
+async def _send_inline(phone: str, text: str, key: str = "") -> dict:
+    res = await zapi_send_text(phone, text)
+    message_id = (res.get("data") or {}).get("messageId") if res.get("ok") else None
+    if message_id:
+        try:
+            await delivery.record_sent(phone, message_id, key=key)
+        except Exception:
+            pass
+    return res
+
+async def send_text(phone: str, text: str, key: str = "") -> dict:
+    if not main.OUTBOUND_QUEUE:
+        return await _send_inline(phone, text, key)
+    try:
+        return {"ok": True, "queued": await outbox.push(make_job("text", phone, text=text, key=key))}
+    except Exception as e:
+        return await _send_inline(phone, text, key) | {"queue_error": str(e)}
+
+async def _record_sent(job: dict, res: dict):
+    message_id = (res.get("data") or {}).get("messageId")
+    if message_id:
+        await delivery.record_sent(job["phone"], message_id, key=(job.get("payload") or {}).get("key", ""),
+                                   job_id=job["id"], kind=job["kind"])
+
+plan_runner = AsyncPlanRunner({"text": zapi_send_text, "image": zapi_send_image, "file": zapi_send_file},
+                              on_sent=_record_sent)
+
+async def send_plan(phone: str, steps) -> dict:
+    """main.send_plan para o ASGI: job "plan" no outbox ou uma task por telefone (AsyncPlanRunner)."""
+    steps = [s for s in steps if s]
+    if not steps:
+        return {"ok": True, "steps": 0}
+    if len(steps) == 1 and steps[0]["kind"] == "text":
+        return await send_text(phone, steps[0]["text"], key=steps[0].get("key", ""))
+    if not main.OUTBOUND_QUEUE:
+        return {"ok": True, "plan": plan_runner.submit(phone, steps)}
+    try:
+        return {"ok": True, "queued": await outbox.push(make_job("plan", phone, steps=steps))}
+    except Exception as e:
+        return {"ok": True, "plan": plan_runner.submit(phone, steps), "queue_error": str(e)}
+
+async def ingest_abandoned_carts(carts, batch_size: int = main.ABANDONED_BATCH_SIZE) -> dict:
+    count = 0
+    batch_ms = []
+    p = ar.pipeline(transaction=False)
+    pending = 0
+    t0 = time.perf_counter()
+    for c in carts:
+        row = cart_row(c)
+        if row is None:
+            continue
+        phone, name, cart_url = row
+        keyschema.queue_profile(p, phone, {"name": name, "last_cart": cart_url})
+        count += 1
+        pending += 1
+        if pending >= batch_size:
+            await p.execute()
+            batch_ms.append(round((time.perf_counter() - t0) * 1000, 1))
+            pending = 0
+            t0 = time.perf_counter()
+    if pending:
+        await p.execute()
+        batch_ms.append(round((time.perf_counter() - t0) * 1000, 1))
+    return {"count": count, "batches": len(batch_ms), "batch_ms": batch_ms}
+
+
+# -------------------------
+# Cartpanda Webhook
+# -------------------------
+@_timed_route("/webhook/cartpanda")
+async def webhook_cartpanda(request):
+    body = await _read_body(request, main.CARTPANDA_HMAC_SECRET)
+    if body is None:
+        return _too_large()
+    if not body.hmac_ok(request.headers.get(main.CARTPANDA_SIG_HEADER, "")):
+        return JSONResponse({"error": "unauthorized"}, 401)
+    raw = body.raw
+
+    if (main.ABANDONED_STREAM and main.ijson and len(raw) >= main.ABANDONED_STREAM_MIN_BYTES
+            and b'"abandoned_carts"' in raw[:4096]):
+        if await idempotent_event_seen(body.sha256[:40]):
+            metrics.count_duplicate("cartpanda")
+            return JSONResponse({"ok": True, "dup": True})
+        res = await ingest_abandoned_carts(main.ijson.items(raw, "abandoned_carts.data.item"))
+        return JSONResponse({"ok": True, "mode": "abandoned_list", "stream": True, **res})
+
+    data = body.json()
+    event = data.get("event") or data.get("type") or ""
+    if await idempotent_event_seen(event_id(data, body.sha256)):
+        metrics.count_duplicate("cartpanda")
+        return JSONResponse({"ok": True, "dup": True})
+
+    if isinstance((data.get("abandoned_carts") or {}).get("data"), list):
+        res = await ingest_abandoned_carts(data["abandoned_carts"]["data"])
+        return JSONResponse({"ok": True, "mode": "abandoned_list", **res})
+
+    if event in ORDER_EVENTS:
+        ruleset = await main.rules.acurrent(ar)
+        plan = order_plan(data, event, ruleset)
+        phone, kind, key = plan["phone"], plan["kind"], plan["key"]
+        ctx = await user_context(phone, guards=[key] if kind else (), load=kind == "paid")
+        ctx.set(name=plan["name"])
+        if kind and phone:
+            ctx.set(**plan["profile"])
+            steps = []
+            if not await rate_limit_ok(phone):
+                metrics.count_rate_limited("cartpanda")
+            elif ctx.guard(key) and not await delivery.already_delivered(phone, key):
+                if kind == "pix":
+                    await send_text(phone, plan["message"], key=key)
+                    await reminders.schedule_pix(phone, key.split(":", 1)[1], plan["name"],
+                                                 plan["profile"]["last_pix_link"], plan["profile"]["last_pix_code"])
+                else:
+                    steps += plan["steps"]
+            offer = None
+            if kind == "paid":
+                await reminders.cancel(phone)
+                offer, bought = apply_order(ruleset, plan["items"], ctx.user)
+                ctx.set(**{HISTORY_FIELD: bought})
+            if offer and ctx.upsell_allowed:
+                ctx.block_upsell()
+                steps.append(text_step(render("COPY_UPSELL", oferta=offer["text"])))
+            await send_plan(phone, steps)
+        await ctx.flush()
+        if kind:
+            return JSONResponse({"ok": True})
+
+    elif event in ABANDONED_EVENTS:
+        phone, name, cart_url = abandoned_info(data)
+        if phone:
+            ctx = AsyncUserContext(ar, phone, load=False)
+            ctx.set(name=name, last_cart=cart_url)
+            await ctx.flush()
+            await reminders.schedule_cart(phone, name, cart_url)
+        return JSONResponse({"ok": True})
+
+    return JSONResponse({"ignored": True})
+
+
+# -------------------------
+# Z-API inbound / status
+# -------------------------
+@_timed_route("/webhook/zapi/inbound")
+async def webhook_zapi_inbound(request):
+    if not _token_ok(request):
+        return JSONResponse({"error": "forbidden"}, 403)
+    body = await _read_body(request)
+    if body is None:
+        return _too_large()
+    phone, text = parse_inbound(body.json())
+    if not phone or not text:
+        return JSONResponse({"ok": True, "note": "sem phone/text"})
+
+    if debouncer.enabled:
+        await debouncer.push(phone, text)
+        return JSONResponse({"ok": True, "debounced": True})
+    return JSONResponse(await answer_inbound(phone, text))
+
+async def answer_inbound(phone: str, text: str) -> dict:
+    if not await rate_limit_ok(phone):
+        metrics.count_rate_limited("inbound")
+        res = await send_text(phone, COPY_RATE_LIMITED)
+        return {"ok": bool(res.get("ok")), "rate_limited": True}
+
+    ctx = await user_context(phone)
+    reply = inbound_reply(ctx.user, text, main.catalog)
+    metrics.count_intent(reply["intent"])
+    if reply["block_upsell"]:
+        ctx.block_upsell()
+    msg = reply["text"]
+    if msg is None and main.llm.enabled:
+        msg = await run_in_threadpool(main.llm.answer, text, saudacao(), reply["name"])
+    res = await send_text(phone, msg or fallback_text(reply["name"]))
+    await ctx.flush()
+    if reply.get("sku"):
+        return {"ok": bool(res.get("ok")), "sku": reply["sku"]}
+    return {"ok": bool(res.get("ok"))}
+
+@_timed_route("/webhook/zapi/status")
+async def webhook_zapi_status(request):
+    if not _token_ok(request):
+        return JSONResponse({"error": "forbidden"}, 403)
+    body = await _read_body(request)
+    if body is None:
+        return _too_large()
+    events = parse_status(body.json(), normalize_phone)
+    metrics.observe_delivery(await delivery.record_statuses(events))
+    return JSONResponse({"ok": True, "updated": len(events)})
+
+async def delivery_state(request):
+    if not main.admin_token_ok(request.headers.get("authorization", ""), request.headers.get("x-admin-token", "")):
+        return JSONResponse({"error": "forbidden"}, 403)
+    try:
+        limit = min(int(request.query_params.get("limit") or 20), 100)
+    except ValueError:
+        limit = 20
+    return JSONResponse(await delivery.phone_state(normalize_phone(request.path_params["phone"]), limit))
+
+# Campanhas: API de baixo volume; usa o BroadcastStore síncrono do main.py numa thread
+def _broadcast_ok(request) -> bool:
+    return main.broadcast_token_ok(request.headers.get("authorization", ""), request.headers.get("x-broadcast-token", ""))
+
+async def broadcast_create(request):
+    if not _broadcast_ok(request):
+        return JSONResponse({"error": "forbidden"}, 403)
+    body = await _read_body(request)
+    if body is None:
+        return _too_large()
+    data = body.json()
+    try:
+        c = await run_in_threadpool(
+            main.broadcasts.create, data.get("template") or "", data.get("filters"), data.get("vars"),
+            data.get("rate") or main.BROADCAST_RATE_PER_SECOND, data.get("name") or "",
+            data.get("skip_blocked", True) is not False)
+    except (TypeError, ValueError) as e:
+        return JSONResponse({"ok": False, "error": str(e)}, 400)
+    return JSONResponse({"ok": True, "campaign": c}, 201)
+
+async def broadcast_list(request):
+    if not _broadcast_ok(request):
+        return JSONResponse({"error": "forbidden"}, 403)
+    try:
+        limit = min(int(request.query_params.get("limit") or 50), 200)
+    except ValueError:
+        limit = 50
+    return JSONResponse({"campaigns": await run_in_threadpool(main.broadcasts.list, limit)})
+
+async def broadcast_get(request):
+    if not _broadcast_ok(request):
+        return JSONResponse({"error": "forbidden"}, 403)
+    c = await run_in_threadpool(main.broadcasts.get, request.path_params["cid"])
+    if c is None:
+        return JSONResponse({"ok": False, "error": "campanha não encontrada"}, 404)
+    return JSONResponse({"ok": True, "campaign": c})
+
+async def broadcast_action(request):
+    if not _broadcast_ok(request):
+        return JSONResponse({"error": "forbidden"}, 403)
+    res = await run_in_threadpool(main.broadcasts.apply, request.path_params["cid"], request.path_params["action"])
+    return JSONResponse(res, 200 if res["ok"] else (404 if "error" in res else 409))
+
+
+# -------------------------
+# Health e root
+# -------------------------
+async def health(request):
+    return JSONResponse({"ok": True, "time": now().isoformat()})
+
+async def ready(request):
+    try:
+        await ar.ping()
+    except Exception as e:
+        return JSONResponse({"ok": False, "error": f"redis: {e}"}, 503)
+    n = len(main.catalog.products())
+    if not n:
+        return JSONResponse({"ok": False, "error": "catálogo vazio"}, 503)
+    return JSONResponse({"ok": True, "products": n})
+
+async def metrics_endpoint(request):
+    body, ctype = metrics.render()
+    return Response(body, media_type=ctype)
+
+async def index(request):
+    return JSONResponse({"service": "paginatto-agent",
+                         "docs": ["/health", "/ready", "/metrics", "/webhook/cartpanda", "/webhook/zapi/inbound", "/webhook/zapi/status",
+                                  "/delivery/{phone}", "/broadcast"]})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    main.warm_up()  # valida a config e aquece catálogo/prompt (o app Flask e seus pollers não são usados)
+    stopping = []
+    poller = asyncio.ensure_future(debouncer.run(answer_inbound, stop=lambda: bool(stopping))) if debouncer.enabled else None
+    yield
+    stopping.append(1)
+    if poller is not None:
+        await poller
+    await plan_runner.join()  # planos sem fila ainda em envio
+    await zapi.aclose()
+    await ar.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route("/webhook/cartpanda", webhook_cartpanda, methods=["POST"]),
+        Route("/webhook/zapi/inbound", webhook_zapi_inbound, methods=["POST"]),
+        Route("/webhook/zapi/status", webhook_zapi_status, methods=["POST"]),
+        Route("/delivery/{phone}", delivery_state, methods=["GET"]),
+        Route("/broadcast", broadcast_create, methods=["POST"]),
+        Route("/broadcast", broadcast_list, methods=["GET"]),
+        Route("/broadcast/{cid}", broadcast_get, methods=["GET"]),
+        Route("/broadcast/{cid}/{action}", broadcast_action, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/ready", ready, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+        Route("/", index, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
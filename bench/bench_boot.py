@@ -0,0 +1,90 @@
+# bench_boot.py
+#
+# Tempo de boot do app Flask, cada rodada num processo Python novo (cold start):
+#   import    import main
+#   factory   create_app() (valida config, aquece catálogo/prompt)
+#   1ª req    primeira requisição ao /health pelo test client
+# e se o boot abriu conexão com o Redis ou importou o SDK da OpenAI (devem ficar para o 1º uso).
+# Com --importtime lista os módulos mais caros (python -X importtime, tempo acumulado).
+#
+#   python bench/bench_boot.py --rounds 10
+#   python bench/bench_boot.py --importtime --top 15
+#
+# O Redis não precisa estar de pé: o boot não deve tocar nele.
+#
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+_PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+app = main.create_app()
+t2 = time.perf_counter()
+resp = app.test_client().get("/health")
+t3 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "factory_ms": (t2 - t1) * 1000, "first_req_ms": (t3 - t2) * 1000,
+                  "status": resp.status_code, "redis_created": main.r.created, "openai_loaded": "openai" in sys.modules}))
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault("REDIS_URL", "redis://localhost:6379/15")
+    env.setdefault("OPENAI_API_KEY", "sk-bench")  # LLM ligado: o SDK ainda não deve ser importado no boot
+    return env
+
+
+def probe() -> dict:
+    out = subprocess.run([sys.executable, "-c", _PROBE], cwd=ROOT, env=_env(), capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def importtime(top: int):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=_env(),
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cum_us), int(self_us), name.rstrip()))
+    print(f"{'acumulado':>10} {'próprio':>9}  módulo")
+    for cum, own, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cum / 1000:>8.1f}ms {own / 1000:>7.1f}ms  {name}")
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=7)
+    ap.add_argument("--importtime", action="store_true")
+    ap.add_argument("--top", type=int, default=12)
+    a = ap.parse_args()
+
+    runs = [probe() for _ in range(a.rounds)]
+    for k in ("import_ms", "factory_ms", "first_req_ms"):
+        vals = [x[k] for x in runs]
+        print(f"{k:<13} mediana {median(vals):>8.1f}ms  min {min(vals):>8.1f}ms  max {max(vals):>8.1f}ms")
+    total = [x["import_ms"] + x["factory_ms"] + x["first_req_ms"] for x in runs]
+    print(f"{'boot total':<13} mediana {median(total):>8.1f}ms")
+    last = runs[-1]
+    print(f"/health={last['status']}  redis conectado no boot={last['redis_created']}  "
+          f"openai importado no boot={last['openai_loaded']}")
+    if a.importtime:
+        print()
+        importtime(a.top)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,84 @@
+# bench_intents.py
+#
+# Micro-benchmark do classificador de intenções:
+# cadeia antiga de any(k in low for k in [...]) + regex x intents.classify.
+#
+#   python bench/bench_intents.py --rounds 2000
+#
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from intents import classify  # noqa: E402
+
+CORPUS = [
+    "oi", "Oii boa tarde", "Bom dia!", "boa noite, tudo bem?", "olá",
+    "quero retomar minha compra", "como faço pra finalizar?", "não desisti não kkk",
+    "me manda o pix de novo", "o pagamento ficou pendente", "onde pago?",
+    "não quero, obrigado", "agora não", "não recebi o ebook", "o produto não chegou no meu email",
+    "não consigo acesso", "qual o prazo de entrega?", "tem frete?", "chega pelos correios?",
+    "isso é golpe?", "é seguro comprar?", "tenho medo de fraude", "travou no cartão",
+    "não consegui pagar com boleto", "vi seu post no instagram", "já comentei, meu @ é @maria",
+    "meu pedido é #73644", "pedido 81230", "quero o tabib 2", "quanto custa o volume 3?",
+    "vcs tem o kids?", "obrigada!!", "👍", "ok", "consegui! muito obrigada",
+    "Olá, comprei ontem e não chegou nada no e-mail, pedido #71234",
+    "boa noite, queria saber se o livro é físico ou digital",
+    "Tenho interesse no Tabib volume 1, ainda está com desconto?",
+]
+
+
+def classify_old(text):
+    low = text.lower()
+    if any(k in low for k in ["retomar", "continuar", "não desisti", "nao desisti", "seguir", "finalizar"]):
+        return "retomar"
+    if any(k in low for k in ["pix", "pagar", "pendente"]):
+        return "pix"
+    if any(k in low for k in ["não quero", "nao quero", "agora não", "agora nao"]):
+        return "nao_quero"
+    if any(k in low for k in ["não recebi", "nao recebi", "não chegou", "nao chegou", "ebook", "produto", "acesso"]):
+        return "nao_recebi"
+    if any(k in low for k in ["frete", "entrega", "prazo", "rastreio", "rastreamento", "correio", "correios", "endereço", "endereco"]):
+        return "entrega"
+    if any(k in low for k in ["segurança", "seguranca", "golpe", "fraude", "medo"]):
+        return "seguranca"
+    if any(k in low for k in ["travou", "não consegui pagar", "nao consegui pagar", "erro no pagamento", "cartão", "cartao", "boleto"]):
+        return "pagamento_travou"
+    if any(k in low for k in ["instagram", "comentar", "comentário", "comentario", "seguir", "post", "@"]):
+        return "instagram"
+    if re.search(r"#?\s*(\d{3,})", low):
+        return "pedido"
+    if any(k in low for k in ["oi", "olá", "ola", "bom dia", "boa tarde", "boa noite", "oie", "oii"]):
+        return "saudacao"
+    return None
+
+
+def bench(label, fn, rounds):
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for t in CORPUS:
+            fn(t)
+    dt = time.perf_counter() - t0
+    n = rounds * len(CORPUS)
+    print(f"{label:<8} {n / dt:>10.0f} msgs/s  {dt / n * 1e6:6.2f} µs/msg")
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=2000)
+    ap.add_argument("--diff", action="store_true", help="lista mensagens classificadas de forma diferente")
+    a = ap.parse_args()
+    bench("antigo", classify_old, a.rounds)
+    bench("novo", lambda t: classify(t)[0], a.rounds)
+    if a.diff:
+        for t in CORPUS:
+            old, new = classify_old(t), classify(t)[0]
+            if old != new:
+                print(f"  {t!r}: {old} -> {new}")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,54 @@
+# bench_rules.py
+#
+# Custo da escolha do upsell (rules.py, com parse/gravação do histórico) conforme cresce o número
+# de regras: com o índice por SKU/handle o tempo acompanha os itens do pedido e as regras que citam
+# esses itens, não o tamanho do conjunto (2000 SKUs: 100000 regras = ~100 regras por SKU).
+#
+#   python bench/bench_rules.py --n 100000
+#
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from rules import RuleSet, apply_order  # noqa: E402
+
+
+def ruleset(n_rules: int, n_skus: int) -> RuleSet:
+    rnd = random.Random(n_rules)
+    specs = []
+    for i in range(n_rules):
+        when = rnd.sample(range(n_skus), rnd.choice((1, 1, 2, 3)))
+        spec = {"id": f"r{i}", "when": [f"SKU{k}" for k in when], "offer": f"SKU{rnd.randrange(n_skus)}",
+                "priority": rnd.randrange(3), "text": f"oferta {i}"}
+        if i % 5 == 0:
+            spec.update(after=[f"SKU{rnd.randrange(n_skus)}"], within_days=30)
+        specs.append(spec)
+    return RuleSet({"upsell": specs})
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100_000)
+    ap.add_argument("--items", type=int, default=3)
+    a = ap.parse_args()
+    n_skus = 2000
+    rnd = random.Random(1)
+    orders = [[(f"sku{rnd.randrange(n_skus)}",) for _ in range(a.items)] for _ in range(1000)]
+    profile = {"bought": "|".join(f"sku{rnd.randrange(n_skus)}:{int(time.time()) - 86400 * d}" for d in range(10))}
+    for n_rules in (10, 1000, 100_000):
+        rs = ruleset(n_rules, n_skus)
+        hit = 0
+        t0 = time.perf_counter()
+        for i in range(a.n):
+            offer, _ = apply_order(rs, orders[i % len(orders)], profile)
+            hit += offer is not None
+        dt = time.perf_counter() - t0
+        print(f"{n_rules:>7} regras  {a.n / dt:>10.0f} pedidos/s  ({dt * 1e6 / a.n:.2f} µs/pedido, oferta em {hit / a.n:.0%})")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,199 @@
+# bench_suite.py
+#
+# Benchmark dos caminhos quentes, tudo local:
+#   app     Flask em processo (test client), sem servidor HTTP no meio
+#   Redis   fakeredis (padrão) ou um redis-server de verdade (--redis URL, use um db descartável)
+#   Z-API   bench/zapi_stub.py, com latência/erros injetáveis
+#
+# Reproduz os payloads gravados (bench/payloads.jsonl ou --payloads) a uma taxa fixa, um payload por
+# fase, e reporta por payload: req/s, p50/p95/p99, round trips Redis por requisição (cabeçalho
+# X-Redis-Round-Trips; comando avulso = 1, pipeline = 1) e chamadas à Z-API por requisição.
+# Nos payloads, {phone} e {n} viram valores únicos por requisição (senão idempotência/guards
+# transformariam tudo em "dup").
+#
+#   python bench/bench_suite.py --n 2000 --rate 500 -c 16
+#   python bench/bench_suite.py --only inbound_pix,order_paid --zapi-latency-ms 30 --zapi-error-rate 0.05
+#   python bench/bench_suite.py --save bench/baseline.json
+#   python bench/bench_suite.py --baseline bench/baseline.json   # sai com 1 se algo piorou
+#
+# A latência é medida a partir do instante agendado (carga em malha aberta), então fila
+# acumulada por lentidão aparece no p99 em vez de sumir.
+# Com --queue os webhooks só enfileiram e o dispatcher (em threads) drena ao fim de cada fase;
+# as chamadas à Z-API por requisição continuam contadas.
+#
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def load_payloads(path, only=None):
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                p = json.loads(line)
+                if not only or p["name"] in only:
+                    out.append((p["name"], p["route"], json.dumps(p["body"], ensure_ascii=False)))
+    return out
+
+
+def setup(a):
+    """Configura o ambiente antes de importar main; devolve (main, stub)."""
+    import zapi_stub
+
+    stub = zapi_stub.start(latency_ms=a.zapi_latency_ms, error_rate=a.zapi_error_rate)
+    os.environ["REDIS_URL"] = a.redis or "redis://fakeredis"
+    os.environ["ZAPI_BASE_URL"] = stub.url + "/instances/bench/token/bench"
+    os.environ["WEBHOOK_VERIFY_TOKEN"] = "bench"
+    os.environ["CARTPANDA_HMAC_SECRET"] = ""
+    os.environ["OUTBOUND_QUEUE"] = "true" if a.queue else "false"
+    os.environ["OPENAI_API_KEY"] = ""
+    os.environ.setdefault("RL_PER_MIN", "1000000")
+    os.environ.setdefault("RL_PER_HOUR", "1000000")
+
+    import main
+
+    if not a.redis:
+        import redis
+        import fakeredis
+        from userctx import CountingRedis
+
+        fr = CountingRedis(connection_pool=redis.ConnectionPool(
+            connection_class=fakeredis.FakeConnection, server=fakeredis.FakeServer(), decode_responses=True))
+        # main.r é um LazyRedis: trocar o cliente por trás dele vale para todo mundo que o recebeu
+        # no import (limiter, outbox, delivery, reminders, debouncer, rules, llm, broadcasts...)
+        main.r._client = fr
+    return main, stub
+
+
+def drain(main, threads):
+    import dispatcher
+
+    senders = dispatcher.default_senders()
+    on_sent = dispatcher.delivery_recorder(main.delivery)
+
+    def worker():
+        while dispatcher.process_one(main.outbox, senders, timeout=1, on_sent=on_sent):
+            pass
+
+    with ThreadPoolExecutor(threads) as ex:
+        for _ in range(threads):
+            ex.submit(worker)
+
+
+def run_phase(main, stub, name, route, body, a, seq):
+    client = main.app.test_client()
+    lat, rts, errors = [], [], 0
+    lock = threading.Lock()
+    counter = iter(range(a.n))
+    calls0 = stub.requests
+    t0 = time.perf_counter() + 0.05
+
+    def worker():
+        nonlocal errors
+        c = main.app.test_client()
+        for i in counter:
+            due = t0 + i / a.rate if a.rate else time.perf_counter()
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            n = seq + i
+            data = body.replace("{n}", str(n)).replace("{phone}", f"55119{n % 100000000:08d}")
+            resp = c.post(route, query_string={"t": "bench"}, data=data, content_type="application/json")
+            ms = (time.perf_counter() - due) * 1000
+            with lock:
+                lat.append(ms)
+                rts.append(int(resp.headers.get("X-Redis-Round-Trips") or 0))
+                if resp.status_code >= 300:
+                    errors += 1
+
+    client.get("/health")  # aquece rotas/conexões
+    with ThreadPoolExecutor(a.concurrency) as ex:
+        for _ in range(a.concurrency):
+            ex.submit(worker)
+    dt = time.perf_counter() - t0
+    if a.queue:
+        drain(main, a.concurrency)
+    else:
+        main.plan_runner.join()  # planos (order.paid) sem fila saem em background
+    calls = stub.requests - calls0
+    return {
+        "n": a.n,
+        "rps": round(a.n / dt, 1),
+        "p50_ms": round(pct(lat, 50), 2),
+        "p95_ms": round(pct(lat, 95), 2),
+        "p99_ms": round(pct(lat, 99), 2),
+        "errors": errors,
+        "redis_rt_per_req": round(sum(rts) / max(1, len(rts)), 2),
+        "zapi_per_req": round(calls / a.n, 2),
+    }
+
+
+def regressions(results, baseline, tol):
+    out = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if res["p95_ms"] > base["p95_ms"] * (1 + tol) and res["p95_ms"] - base["p95_ms"] > 1:
+            out.append(f"{name}: p95 {base['p95_ms']} → {res['p95_ms']} ms")
+        for k in ("redis_rt_per_req", "zapi_per_req"):
+            if res[k] > base[k] + 0.1:
+                out.append(f"{name}: {k} {base[k]} → {res[k]}")
+    return out
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--payloads", default=os.path.join(HERE, "payloads.jsonl"))
+    ap.add_argument("--only", default="", help="nomes separados por vírgula")
+    ap.add_argument("--n", type=int, default=1000, help="requisições por payload")
+    ap.add_argument("--rate", type=float, default=0, help="req/s agendadas (0 = o mais rápido possível)")
+    ap.add_argument("-c", "--concurrency", type=int, default=8)
+    ap.add_argument("--redis", default="", help="URL de um Redis real (padrão: fakeredis)")
+    ap.add_argument("--zapi-latency-ms", type=float, default=0.0)
+    ap.add_argument("--zapi-error-rate", type=float, default=0.0)
+    ap.add_argument("--queue", action="store_true", help="OUTBOUND_QUEUE=true + dispatcher ao fim da fase")
+    ap.add_argument("--save", default="", help="grava os resultados (json) para usar como baseline")
+    ap.add_argument("--baseline", default="", help="compara com um --save anterior")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="piora aceita no p95 (fração)")
+    a = ap.parse_args()
+
+    payloads = load_payloads(a.payloads, set(filter(None, a.only.split(","))))
+    main, stub = setup(a)
+    print(f"{'payload':<20} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5} {'redis/req':>9} {'zapi/req':>8}")
+    results = {}
+    for k, (name, route, body) in enumerate(payloads):
+        res = results[name] = run_phase(main, stub, name, route, body, a, seq=(k + 1) * 10_000_000)
+        print(f"{name:<20} {res['rps']:>8.1f} {res['p50_ms']:>7.2f}ms {res['p95_ms']:>7.2f}ms {res['p99_ms']:>7.2f}ms "
+              f"{res['errors']:>5} {res['redis_rt_per_req']:>9.2f} {res['zapi_per_req']:>8.2f}")
+    stub.shutdown()
+
+    if a.save:
+        with open(a.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if a.baseline:
+        with open(a.baseline, encoding="utf-8") as f:
+            bad = regressions(results, json.load(f), a.tolerance)
+        for line in bad:
+            print("REGRESSÃO", line)
+        sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,61 @@
+# bench_templates.py
+#
+# Micro-benchmark do render das copys:
+# str.format + saudação calculada por mensagem (antes) x Template + saudação cacheada por hora
+# x render_many (lote de campanha).
+#
+#   python bench/bench_templates.py --n 100000
+#
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import flows  # noqa: E402
+from copys import COPY_LEMBRETE_PIX  # noqa: E402
+from templates import render  # noqa: E402
+
+
+def _saudacao_antiga():
+    return flows._saudacao(flows.now().hour)
+
+
+def run(label, fn, n, repeat=5):
+    dt = float("inf")
+    for _ in range(repeat):  # melhor de N: tira o ruído de GC/CPU vizinha
+        t0 = time.perf_counter()
+        fn()
+        dt = min(dt, time.perf_counter() - t0)
+    print(f"{label:<14} {n / dt:>12.0f} msgs/s  ({dt * 1e6 / n:.2f} µs/msg)")
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100_000)
+    a = ap.parse_args()
+    rows = [{"nome": f"Cliente {i} Silva", "link": f"https://loja/c/{i}", "pix_code": f"000201{i:010d}"}
+            for i in range(a.n)]
+
+    def old():
+        for row in rows:
+            COPY_LEMBRETE_PIX.format(saud=_saudacao_antiga(), nome=row["nome"].split()[0], link=row["link"],
+                                     pix_code=row["pix_code"])
+
+    def new():
+        for row in rows:
+            render("COPY_LEMBRETE_PIX", saud=flows.saudacao(), nome=flows.first_name(row["nome"]), link=row["link"],
+                   pix_code=row["pix_code"])
+
+    assert flows.render_many("COPY_LEMBRETE_PIX", rows[:50]) == [
+        COPY_LEMBRETE_PIX.format(saud=_saudacao_antiga(), nome=r["nome"].split()[0], link=r["link"], pix_code=r["pix_code"])
+        for r in rows[:50]
+    ]
+    run("str.format", old, a.n)
+    run("template", new, a.n)
+    run("render_many", lambda: flows.render_many("COPY_LEMBRETE_PIX", rows), a.n)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,53 @@
+# bench_zapi_pool.py
+#
+# Compara envios/segundo: requests.post por chamada (antes) x sessão com pool (http_session).
+#
+#   python bench/bench_zapi_pool.py --n 2000 --threads 8 --latency-ms 0
+#
+# Obs.: o stub é HTTP puro; em produção (TLS para api.z-api.io) o ganho do keep-alive é maior,
+# pois cada conexão nova também paga o handshake TLS.
+#
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+
+import requests  # noqa: E402
+
+import main  # noqa: E402
+import zapi_stub  # noqa: E402
+
+
+def run(label, post, url, n, threads):
+    payload = {"phone": "5511999999999", "message": "bench"}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        list(ex.map(lambda _: post(url, payload), range(n)))
+    dt = time.perf_counter() - t0
+    print(f"{label:<10} {n / dt:>9.1f} envios/s  ({dt:.2f}s)")
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    a = ap.parse_args()
+
+    srv = zapi_stub.start(latency_ms=a.latency_ms)
+    url = f"{srv.url}/send-text"
+
+    c0 = srv.connections
+    run("antes", lambda u, p: requests.post(u, headers=main._ZAPI_HEADERS, json=p, timeout=20), url, a.n, a.threads)
+    c1 = srv.connections
+    run("pool", lambda u, p: main.retry_post(u, json_body=p), url, a.n, a.threads)
+    c2 = srv.connections
+    print(f"conexões TCP: antes={c1 - c0} pool={c2 - c1}")
+
+
+if __name__ == "__main__":
+    main_()
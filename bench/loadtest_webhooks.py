@@ -0,0 +1,82 @@
+# loadtest_webhooks.py
+#
+# Carga nos webhooks: requisições/s e latência p50/p99 por alvo (Flask x ASGI).
+#
+#   gunicorn main:app -w 4 --threads 8 -b 127.0.0.1:8000
+#   uvicorn asgi:app --workers 4 --port 8001
+#   python bench/loadtest_webhooks.py --target flask=http://127.0.0.1:8000 \
+#       --target asgi=http://127.0.0.1:8001 --n 5000 -c 200 --kind inbound
+#
+# Os dois apps devem apontar para o mesmo REDIS_URL e, para medir só o webhook,
+# rodar com OUTBOUND_QUEUE=true (o envio fica com o dispatcher).
+#
+import time
+import random
+import asyncio
+import argparse
+
+import httpx
+
+TEXTS = ["oi", "quero retomar", "me manda o pix", "não recebi o ebook", "tem frete?",
+         "quero o tabib 2", "meu pedido é #73644", "boa noite"]
+
+
+def payload(kind: str, i: int):
+    phone = f"55119{random.randint(10000000, 99999999)}"
+    if kind == "inbound":
+        return "/webhook/zapi/inbound", {"phone": phone, "text": random.choice(TEXTS)}
+    if kind == "status":
+        return "/webhook/zapi/status", {"status": "READ", "ids": [f"m{i}"], "phone": phone}
+    return "/webhook/cartpanda", {
+        "event": "order.paid", "id": f"lt-{time.time_ns()}-{i}",
+        "order": {"id": i, "order_number": i, "phone": phone, "customer": {"first_name": "Teste"},
+                  "line_items": [{"title": "*Tabib - Volume 1"}], "digital_attachment": "https://exemplo/x"},
+    }
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run(label, base, n, conc, kind, token):
+    sem = asyncio.Semaphore(conc)
+    lat, errors = [], 0
+    limits = httpx.Limits(max_connections=conc, max_keepalive_connections=conc)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as c:
+        async def one(i):
+            nonlocal errors
+            path, body = payload(kind, i)
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    resp = await c.post(path, params={"t": token}, json=body)
+                    if resp.status_code >= 300:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                lat.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(n)))
+        dt = time.perf_counter() - t0
+    print(f"{label:<8} {n / dt:>8.1f} req/s  p50={pct(lat, 50):7.1f}ms  p99={pct(lat, 99):7.1f}ms  erros={errors}")
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--target", action="append", required=True, help="rótulo=url (repetível)")
+    ap.add_argument("--n", type=int, default=2000)
+    ap.add_argument("-c", "--concurrency", type=int, default=100)
+    ap.add_argument("--kind", choices=["inbound", "paid", "status"], default="inbound")
+    ap.add_argument("--token", default="changeme", help="WEBHOOK_VERIFY_TOKEN")
+    a = ap.parse_args()
+    for t in a.target:
+        label, _, url = t.partition("=")
+        asyncio.run(run(label, url, a.n, a.concurrency, a.kind, a.token))
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,81 @@
+# zapi_stub.py
+#
+# Servidor HTTP local que imita a Z-API para benchmarks.
+# Responde 200 {"zaapId": ..., "messageId": ...} a qualquer POST, com keep-alive (HTTP/1.1).
+#
+#   python bench/zapi_stub.py --port 8765 --latency-ms 20 --error-rate 0.05
+#
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubZapi(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, latency_ms=0.0, error_rate=0.0):
+        super().__init__(addr, _Handler)
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1  # cabeçalho + corpo num único write (evita atraso de Nagle/delayed ACK)
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server._lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(n)
+        with self.server._lock:
+            self.server.requests += 1
+        if self.server.latency_ms:
+            time.sleep(self.server.latency_ms / 1000.0)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            status, body = 503, {"error": "stub_unavailable"}
+        else:
+            mid = uuid.uuid4().hex.upper()
+            status, body = 200, {"zaapId": mid, "messageId": mid, "id": mid}
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+
+def start(port=0, latency_ms=0.0, error_rate=0.0) -> StubZapi:
+    srv = StubZapi(("127.0.0.1", port), latency_ms, error_rate)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    a = ap.parse_args()
+    srv = StubZapi(("127.0.0.1", a.port), a.latency_ms, a.error_rate)
+    print(f"stub Z-API em {srv.url}")
+    srv.serve_forever()
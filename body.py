@@ -0,0 +1,111 @@
+# body.py
+#
+# Leitura única do corpo dos webhooks.
+# - Lê o stream em blocos, atualizando HMAC (assinatura Cartpanda) e sha256 (id de evento
+#   de fallback / idempotência) a cada bloco: os bytes são percorridos uma vez só
+# - Rejeita cedo corpos acima de MAX_BODY_BYTES (Content-Length ou contagem durante a leitura)
+# - JSON parseado uma vez, com orjson se instalado
+#
+import os
+import hmac
+import json
+import hashlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(16 * 1024 * 1024)))
+BODY_CHUNK_BYTES = 64 * 1024
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def loads(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def json_dict(raw: bytes) -> dict:
+    """Objeto JSON do corpo; {} se vazio, inválido ou não for objeto."""
+    try:
+        data = loads(raw) if raw else {}
+    except ValueError:  # orjson.JSONDecodeError também é ValueError
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class WebhookBody:
+    """Acumula o corpo bloco a bloco: feed(chunk) ... e depois raw/sha256/hmac_ok/json()."""
+
+    def __init__(self, secret: str = "", content_length=None, max_bytes: int = MAX_BODY_BYTES):
+        if content_length is not None and int(content_length) > max_bytes:
+            raise BodyTooLarge(content_length)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._chunks = []
+        self._sha = hashlib.sha256()
+        self._mac = hmac.new(secret.encode(), digestmod=hashlib.sha256) if secret else None
+        self._raw = None
+        self._data = None
+
+    def feed(self, chunk: bytes):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise BodyTooLarge(self.size)
+        self._chunks.append(chunk)
+        self._sha.update(chunk)
+        if self._mac is not None:
+            self._mac.update(chunk)
+
+    @property
+    def raw(self) -> bytes:
+        if self._raw is None:
+            self._raw = self._chunks[0] if len(self._chunks) == 1 else b"".join(self._chunks)
+            self._chunks = [self._raw]
+        return self._raw
+
+    @property
+    def sha256(self) -> str:
+        return self._sha.hexdigest()
+
+    def hmac_ok(self, signature: str) -> bool:
+        """HMAC-SHA256 hex do corpo (header da Cartpanda); sem segredo configurado, aceita."""
+        if self._mac is None:
+            return True
+        if not signature:
+            return False
+        mac = self._mac.hexdigest()
+        try:
+            return hmac.compare_digest(mac, signature)
+        except TypeError:
+            return mac == signature
+
+    def json(self) -> dict:
+        if self._data is None:
+            self._data = json_dict(self.raw)
+        return self._data
+
+
+def read_stream(stream, secret: str = "", content_length=None, max_bytes: int = MAX_BODY_BYTES) -> WebhookBody:
+    """Lê um stream síncrono (ex.: request.stream do Flask) numa passada."""
+    body = WebhookBody(secret, content_length, max_bytes)
+    while True:
+        chunk = stream.read(BODY_CHUNK_BYTES)
+        if not chunk:
+            return body
+        body.feed(chunk)
+
+
+async def read_async(chunks, secret: str = "", content_length=None, max_bytes: int = MAX_BODY_BYTES) -> WebhookBody:
+    """Mesma leitura para um iterador assíncrono de blocos (ex.: request.stream() do Starlette)."""
+    body = WebhookBody(secret, content_length, max_bytes)
+    async for chunk in chunks:
+        body.feed(chunk)
+    return body
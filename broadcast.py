@@ -0,0 +1,370 @@
+# broadcast.py
+#
+# Campanhas: uma copy para um segmento de clientes (ex.: last_products contém "Tabib - Volume 1").
+# Criadas/pausadas pela API autenticada do web (/broadcast, BROADCAST_TOKEN) e enviadas por um
+# processo separado (como dispatcher e reminders):
+#
+#   broadcast: python broadcast.py
+#
+# Chaves Redis:
+#   bc:ids           zset  id da campanha → epoch de criação
+#   bc:running       set   campanhas em andamento (o que o worker varre)
+#   bc:c:{id}        hash  copy, filtros, variáveis, teto, status, cursor do SCAN e contadores
+#   bc:lease:{id}    dono da campanha (um worker por campanha; expira se o worker morrer)
+#
+# - Destinatários saem de um SCAN sobre v2:u:* em lotes de BROADCAST_SCAN_COUNT (HGETALL em
+#   pipeline): nunca há mais de um lote em memória. O cursor é gravado ao fim de cada lote, então
+#   pausar/retomar (ou reiniciar o worker) continua de onde parou
+# - Envio direto à Z-API (sem outbox, que fica para as mensagens transacionais) por um pool de
+#   BROADCAST_CONCURRENCY threads, com no máximo 2x isso em voo, no ritmo do teto da campanha
+#   ("rate" envios/s, token bucket)
+# - Guard por cliente e campanha (g:bc:{id}): um lote relido após pausa não reenvia. Envio que
+#   falha desfaz o guard, então a retomada (ou relançar a campanha) tenta aquele cliente de novo
+# - Filtros: {"campo": "trecho"} (todos precisam casar, sem diferenciar maiúsculas;
+#   "" = campo preenchido; obrigatórios: a base toda é {"name": ""}). Por padrão pula quem pediu
+#   para não receber ofertas (upsell bloqueado)
+# - A copy é validada na criação (campos nomeados, render de teste); campanha que quebrar mesmo
+#   assim no envio fica "failed" (com o erro no hash) e o worker segue com as outras
+# - Não envia no horário de silêncio dos lembretes (REMINDER_QUIET_START/END)
+#
+import os
+import json
+import time
+import uuid
+import signal
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from redis.exceptions import RedisError
+
+import keyschema
+import metrics
+from flows import render_many
+from reminders import in_quiet_hours
+from templates import Template
+from zapi_pool import TokenBucket
+
+BROADCAST_TOKEN = os.getenv("BROADCAST_TOKEN", "").strip()  # vazio = API desligada
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "5"))  # padrão por campanha
+BROADCAST_MAX_RATE = float(os.getenv("BROADCAST_MAX_RATE", "50"))
+BROADCAST_SCAN_COUNT = int(os.getenv("BROADCAST_SCAN_COUNT", "500"))
+BROADCAST_GUARD_HOURS = int(os.getenv("BROADCAST_GUARD_HOURS", "72"))
+BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", "60"))
+BROADCAST_PREFIX = "bc"
+
+_ACTIONS = {  # ação → (status de origem aceitos, novo status)
+    "pause": (("running",), "paused"),
+    "resume": (("paused",), "running"),
+    "cancel": (("running", "paused"), "cancelled"),
+}
+_COUNTERS = ("scanned", "matched", "sent", "failed", "dup", "skipped")
+_RESERVED_VARS = ("tpl", "rows", "common")  # parâmetros do render_many
+
+# KEYS[1] = bc:c:{id}, KEYS[2] = bc:running; ARGV: id, novo status, agora, status de origem aceitos...
+_SET_STATUS = """
+local cur = redis.call('HGET', KEYS[1], 'status')
+if not cur then return {0, ''} end
+for i = 4, #ARGV do
+  if cur == ARGV[i] then
+    redis.call('HSET', KEYS[1], 'status', ARGV[2], 'updated', ARGV[3])
+    if ARGV[2] == 'running' then
+      redis.call('SADD', KEYS[2], ARGV[1])
+    else
+      redis.call('SREM', KEYS[2], ARGV[1])
+    end
+    return {1, ARGV[2]}
+  end
+end
+return {0, cur}
+"""
+
+
+def _campaign_key(cid: str) -> str:
+    return f"{BROADCAST_PREFIX}:c:{cid}"
+
+
+def matches(profile: dict, filters: dict) -> bool:
+    for field, needle in filters.items():
+        value = profile.get(field) or ""
+        if not value or needle.lower() not in value.lower():
+            return False
+    return True
+
+
+def iter_profiles(r, cursor=0, count: int = BROADCAST_SCAN_COUNT):
+    """(cursor seguinte, [(phone, hash)]) por lote de SCAN sobre os perfis; cursor 0 = fim."""
+    prefix = keyschema.user_key("")
+    while True:
+        cursor, keys = r.scan(cursor, match=prefix + "*", count=count)
+        hashes = []
+        if keys:
+            p = r.pipeline(transaction=False)
+            for k in keys:
+                p.hgetall(k)
+            hashes = p.execute()
+        yield int(cursor), [(k[len(prefix):], h) for k, h in zip(keys, hashes) if h]
+        if int(cursor) == 0:
+            return
+
+
+def _parse(h: dict) -> dict:
+    c = dict(h)
+    c["filters"] = json.loads(h.get("filters") or "{}")
+    c["vars"] = json.loads(h.get("vars") or "{}")
+    c["rate"] = float(h.get("rate") or BROADCAST_RATE_PER_SECOND)
+    c["skip_blocked"] = h.get("skip_blocked") == "1"
+    for k in _COUNTERS:
+        c[k] = int(h.get(k) or 0)
+    for k in ("created", "updated", "started", "finished"):
+        c[k] = float(h[k]) if h.get(k) else None
+    if c["started"] and c["sent"]:
+        c["sent_per_second"] = round(c["sent"] / max(1.0, (c["finished"] or time.time()) - c["started"]), 2)
+    return c
+
+
+class BroadcastStore:
+    def __init__(self, r):
+        self.r = r
+        self._set_status = r.register_script(_SET_STATUS)
+
+    def create(self, template: str, filters=None, vars=None, rate: float = BROADCAST_RATE_PER_SECOND,
+               name: str = "", skip_blocked: bool = True) -> dict:
+        """Valida e grava a campanha já como "running" (o worker pega no próximo ciclo). ValueError se inválida."""
+        filters = {} if filters is None else filters
+        vars = {} if vars is None else vars
+        if not isinstance(template, str) or not template.strip():
+            raise ValueError("template vazio")
+        if not isinstance(filters, dict) or not all(isinstance(v, str) for v in filters.values()):
+            raise ValueError("filters deve ser {campo: trecho}")
+        if not filters:
+            raise ValueError('filters vazio (para a base toda use {"name": ""})')
+        if not isinstance(vars, dict) or not all(isinstance(v, (str, int, float)) for v in vars.values()):
+            raise ValueError("vars deve ser {nome: valor}")
+        bad = [k for k in vars if not k.isidentifier() or k in _RESERVED_VARS]
+        if bad:
+            raise ValueError(f"vars com nome inválido: {', '.join(bad)}")
+        try:
+            tpl = Template(template)
+            bad = [f for f in tpl.fields if not f.isidentifier()]
+            if bad:
+                raise ValueError(f"use campos nomeados, não {', '.join('{' + f + '}' for f in bad)}")
+            tpl.render_map({**{f: "" for f in tpl.fields}, "saud": "", "nome": "", **vars})
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            raise ValueError(f"template inválido: {e}") from None
+        rate = float(rate)
+        if not 0 < rate <= BROADCAST_MAX_RATE:
+            raise ValueError(f"rate deve estar entre 0 e {BROADCAST_MAX_RATE:g}")
+        cid = uuid.uuid4().hex[:12]
+        now = time.time()
+        p = self.r.pipeline(transaction=False)
+        p.hset(_campaign_key(cid), mapping={
+            "id": cid, "name": name or "", "template": template, "status": "running", "cursor": 0,
+            "filters": json.dumps(filters, ensure_ascii=False), "vars": json.dumps(vars, ensure_ascii=False),
+            "rate": rate, "skip_blocked": 1 if skip_blocked else 0, "created": now, "updated": now,
+        })
+        p.zadd(f"{BROADCAST_PREFIX}:ids", {cid: now})
+        p.sadd(f"{BROADCAST_PREFIX}:running", cid)
+        p.execute()
+        return self.get(cid)
+
+    def get(self, cid: str):
+        h = self.r.hgetall(_campaign_key(cid))
+        return _parse(h) if h else None
+
+    def list(self, limit: int = 50) -> list:
+        ids = self.r.zrevrange(f"{BROADCAST_PREFIX}:ids", 0, limit - 1)
+        p = self.r.pipeline(transaction=False)
+        for cid in ids:
+            p.hgetall(_campaign_key(cid))
+        return [_parse(h) for h in p.execute() if h]
+
+    def status(self, cid: str) -> str:
+        return self.r.hget(_campaign_key(cid), "status") or ""
+
+    def apply(self, cid: str, action: str) -> dict:
+        """pause/resume/cancel; {"ok": False, "status": atual} se a transição não vale."""
+        if action not in _ACTIONS:
+            return {"ok": False, "error": f"ação desconhecida: {action}"}
+        sources, target = _ACTIONS[action]
+        ok, status = self._set_status(keys=[_campaign_key(cid), f"{BROADCAST_PREFIX}:running"],
+                                      args=[cid, target, time.time(), *sources])
+        if not status:
+            return {"ok": False, "error": "campanha não encontrada"}
+        return {"ok": bool(ok), "status": status}
+
+    def running(self) -> list:
+        return sorted(self.r.smembers(f"{BROADCAST_PREFIX}:running"))
+
+    def checkpoint(self, cid: str, cursor, counts: Counter, done: bool = False):
+        k = _campaign_key(cid)
+        now = time.time()
+        p = self.r.pipeline(transaction=False)
+        p.hset(k, mapping={"cursor": cursor, "updated": now})
+        p.hsetnx(k, "started", now)
+        for name, n in counts.items():
+            if n:
+                p.hincrby(k, name, n)
+        if done:
+            p.hset(k, mapping={"status": "done", "finished": now})
+            p.srem(f"{BROADCAST_PREFIX}:running", cid)
+        p.execute()
+
+    def fail(self, cid: str, error: str):
+        """Tira a campanha do ar com o erro que a derrubou (não volta sozinha para "running")."""
+        now = time.time()
+        p = self.r.pipeline(transaction=False)
+        p.hset(_campaign_key(cid), mapping={"status": "failed", "error": error[:500], "updated": now, "finished": now})
+        p.srem(f"{BROADCAST_PREFIX}:running", cid)
+        p.execute()
+
+    def release_guard(self, phone: str, key: str):
+        """Desfaz o guard de um envio que falhou (mesmo campo g:{key} do sent_guard)."""
+        self.r.hdel(keyschema.user_key(phone), keyschema.guard_field(key))
+
+    def acquire(self, cid: str, owner: str) -> bool:
+        return bool(self.r.set(f"{BROADCAST_PREFIX}:lease:{cid}", owner, nx=True, ex=BROADCAST_LEASE_SECONDS))
+
+    def renew(self, cid: str, owner: str) -> bool:
+        k = f"{BROADCAST_PREFIX}:lease:{cid}"
+        if self.r.get(k) != owner:
+            return False
+        self.r.expire(k, BROADCAST_LEASE_SECONDS)
+        return True
+
+    def release(self, cid: str, owner: str):
+        k = f"{BROADCAST_PREFIX}:lease:{cid}"
+        if self.r.get(k) == owner:
+            self.r.delete(k)
+
+
+def _send_one(send, guard, release, phone: str, text: str, key: str) -> str:
+    if not guard(phone, key, BROADCAST_GUARD_HOURS * 60):
+        return "dup"
+    try:
+        ok = bool(send(phone, text, key).get("ok"))
+    except Exception:
+        ok = False
+    if ok:
+        return "sent"
+    try:
+        release(phone, key)  # não enviou: a retomada/relançamento tenta de novo
+    except Exception:
+        pass
+    return "failed"
+
+
+def run_campaign(store, cid: str, send, guard, owner: str = "", stop=lambda: False) -> str:
+    """
+    Envia a campanha a partir do último cursor gravado até acabar, pausar ou perder o lease.
+    send(phone, text, key) → {"ok", ...}; guard(phone, key, ttl_min) → True se ainda não enviou.
+    Retorna o status em que parou ("done", "paused", "cancelled", "quiet", "lost", "stopped").
+    """
+    c = store.get(cid)
+    if not c or c["status"] != "running":
+        return (c or {}).get("status") or "missing"
+    tpl = Template(c["template"])
+    fields = [f for f in tpl.fields if f not in ("saud", "nome") and f not in c["vars"]]
+    key = f"bc:{cid}"
+    bucket = TokenBucket(c["rate"], max(1.0, c["rate"]))
+    inflight = threading.BoundedSemaphore(BROADCAST_CONCURRENCY * 2)
+    pool = ThreadPoolExecutor(BROADCAST_CONCURRENCY, thread_name_prefix=f"bc-{cid}")
+
+    def halted():
+        if stop():
+            return "stopped"
+        if in_quiet_hours():
+            return "quiet"
+        if owner and not store.renew(cid, owner):
+            return "lost"
+        st = store.status(cid)
+        return None if st == "running" else st
+
+    try:
+        for cursor, rows in iter_profiles(store.r, c["cursor"]):
+            why = halted()
+            if why:
+                return why
+            scan = Counter(scanned=len(rows))
+            recipients = []
+            for phone, h in rows:
+                profile, upsell_ok = keyschema.split_user(h)
+                if not matches(profile, c["filters"]):
+                    continue
+                scan["matched"] += 1
+                if c["skip_blocked"] and not upsell_ok:
+                    scan["skipped"] += 1
+                    continue
+                recipients.append((phone, dict({f: profile.get(f, "") for f in fields}, nome=profile.get("name"))))
+            texts = render_many(tpl, [row for _, row in recipients], c["vars"])
+
+            futures, checked, why = [], time.monotonic(), None
+            for (phone, _), text in zip(recipients, texts):
+                if time.monotonic() - checked >= 1:
+                    checked = time.monotonic()
+                    why = halted()
+                    if why:
+                        break
+                wait = bucket.reserve()
+                if wait:
+                    time.sleep(wait)
+                inflight.acquire()
+                f = pool.submit(_send_one, send, guard, store.release_guard, phone, text, key)
+                f.add_done_callback(lambda _: inflight.release())
+                futures.append(f)
+            sent = Counter(f.result() for f in futures)
+            for outcome, n in sent.items():
+                metrics.count_broadcast(outcome, n)
+            if why:
+                # lote interrompido: grava só os envios; o lote é relido na retomada (o guard evita reenvio)
+                store.checkpoint(cid, c["cursor"], sent)
+                return why
+            store.checkpoint(cid, cursor, scan + sent, done=cursor == 0)
+            c["cursor"] = cursor
+        return "done"
+    finally:
+        pool.shutdown(wait=True)
+
+
+def _cycle(store, send, guard, owner: str, stop) -> bool:
+    """Uma passada pelas campanhas em andamento; True se alguma andou."""
+    worked = False
+    for cid in store.running():
+        if stop():
+            break
+        if not store.acquire(cid, owner):
+            continue
+        try:
+            worked = run_campaign(store, cid, send, guard, owner, stop) != "quiet" or worked
+        except RedisError:
+            raise
+        except Exception as e:
+            # copy/variáveis que passaram na criação e quebram no envio: uma campanha ruim
+            # não pode derrubar o worker nem travar as outras a cada restart
+            store.fail(cid, f"{type(e).__name__}: {e}")
+            metrics.count_broadcast("campaign_failed")
+            worked = True
+        finally:
+            store.release(cid, owner)
+    return worked
+
+
+def run(store, send, guard, stop=lambda: False, poll: float = 2.0):
+    owner = f"{os.uname().nodename}:{os.getpid()}"
+    while not stop():
+        try:
+            worked = _cycle(store, send, guard, owner, stop)
+        except RedisError:
+            worked = False  # Redis fora: as campanhas seguem "running" e voltam do cursor gravado
+        if not worked:
+            time.sleep(min(poll * 30, 60) if in_quiet_hours() else poll)
+
+
+if __name__ == "__main__":
+    from main import r, _send_inline, sent_guard
+
+    _stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: _stopping.append(1))
+    signal.signal(signal.SIGINT, lambda *_: _stopping.append(1))
+    run(BroadcastStore(r), _send_inline, sent_guard, stop=lambda: bool(_stopping))
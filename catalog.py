@@ -0,0 +1,114 @@
+# catalog.py
+#
+# Catálogo de produtos (produtos_paginatto.json) com índice em memória.
+# - Carregado uma vez; recarrega sozinho quando o mtime do arquivo muda
+#   (checado no máximo a cada CATALOG_CHECK_SECONDS).
+# - Índices: SKU → produto (dict) e trie de palavras com nomes/aliases/handles
+#   normalizados, para achar o produto citado numa mensagem numa só passada.
+#
+import os
+import re
+import json
+import time
+import threading
+
+from intents import normalize
+
+PRODUCTS_JSON_PATH = os.getenv(
+    "PRODUCTS_JSON_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "produtos_paginatto.json"),
+)
+CATALOG_CHECK_SECONDS = float(os.getenv("CATALOG_CHECK_SECONDS", "5"))
+
+_TOKEN_RE = re.compile(r"\w+")
+_END = ""  # chave de fim de frase na trie
+
+
+def tokens(text: str) -> list:
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def slugify(text: str) -> str:
+    return "-".join(tokens(text))
+
+
+class Catalog:
+    def __init__(self, path: str = PRODUCTS_JSON_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self._state = ([], {}, {}, {})  # produtos, por SKU, por handle, trie
+
+    def _build(self, products: list):
+        by_sku, by_handle, trie = {}, {}, {}
+        for p in products:
+            sku = (p.get("sku") or "").strip()
+            if sku:
+                by_sku[sku.upper()] = p
+            handle = p.get("handle") or slugify(p.get("name", ""))
+            if handle:
+                by_handle[handle] = p
+            phrases = [p.get("name", ""), p.get("name", "").split(":")[0], sku.replace("_", " ")]
+            phrases += p.get("aliases") or []
+            for ph in phrases:
+                toks = tokens(ph)
+                if not toks:
+                    continue
+                node = trie
+                for t in toks:
+                    node = node.setdefault(t, {})
+                node.setdefault(_END, p)  # primeiro produto a declarar a frase fica com ela
+        return products, by_sku, by_handle, trie
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < CATALOG_CHECK_SECONDS and self._mtime is not None:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    products = json.load(f)
+            except (OSError, ValueError):
+                return  # arquivo em edição/corrompido: mantém a versão anterior
+            self._state = self._build([p for p in products if isinstance(p, dict)])
+            self._mtime = mtime
+
+    def products(self) -> list:
+        self._maybe_reload()
+        return self._state[0]
+
+    def by_sku(self, sku: str):
+        self._maybe_reload()
+        return self._state[1].get((sku or "").strip().upper())
+
+    def by_handle(self, handle: str):
+        self._maybe_reload()
+        return self._state[2].get((handle or "").strip().lower())
+
+    def find_in_text(self, text: str):
+        """Produto citado no texto (maior frase que casar) ou None."""
+        return self.match_in_text(text)[0]
+
+    def match_in_text(self, text: str):
+        """(produto, palavras da frase que casou) — (None, ()) quando nada casa."""
+        self._maybe_reload()
+        trie = self._state[3]
+        toks = tokens(text)
+        best, span = None, (0, 0)
+        for i in range(len(toks)):
+            node = trie
+            j = i
+            while j < len(toks) and toks[j] in node:
+                node = node[toks[j]]
+                j += 1
+                if _END in node and j - i > span[1] - span[0]:
+                    best, span = node[_END], (i, j)
+        return best, tuple(toks[span[0]:span[1]])
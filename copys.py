@@ -0,0 +1,32 @@
+# copys.py
+#
+# Textos enviados ao cliente (última versão enviada).
+# Compartilhados pelo app Flask (main.py) e pelo app ASGI (asgi.py).
+#
+COPY_SAUDACAO = "{saud}, {nome}. Como posso te ajudar?"
+COPY_RETOMAR = "{saud}, {nome}! Aqui está seu link para retomar: {link}"
+COPY_PIX = "{saud}, {nome}! Seu PIX ficou pendente. Link: {link}\nCódigo PIX:\n{pix_code}"
+COPY_PIX_NAO_ENCONTRADO = "{saud}, {nome}. Não encontrei PIX pendente. Diga 'retomar' para recuperar o carrinho."
+COPY_ENTREGA = "{saud}, {nome}! Obrigado pela compra {order}. Acesso: {digital}"
+COPY_NAO_RECEBI_ASK = "{saud}, {nome}. Envie o nº do pedido (ex.: #73644) ou um print do e-mail para eu localizar e reenviar."
+COPY_UPSELL = "Oferta única hoje: {oferta}. Quer aproveitar?"
+COPY_UPSELL_NAO_QUERO = "Tudo bem. Promo única só hoje. Se mudar de ideia, estou à disposição."
+COPY_RETORNO = "{saud}, {nome}! Que bom te ver de volta. Segue o link para retomar: {link}"
+COPY_PRODUTO = "{saud}, {nome}! {produto}: {descricao} Checkout: {link}"
+COPY_FALLBACK = "{saud}, {nome}. Posso: retomar carrinho, pagar PIX ou reenviar o ebook. Diga 'retomar', 'PIX' ou mande o nº do pedido."
+COPY_LEMBRETE_CARRINHO = "{saud}, {nome}! Seu carrinho continua guardado. Quer finalizar? {link}"
+COPY_LEMBRETE_PIX = "{saud}, {nome}! Seu PIX ainda está pendente. Link: {link}\nCódigo PIX:\n{pix_code}"
+COPY_RATE_LIMITED = "Recebi muitas mensagens. Vou responder por partes, combinado?"
+
+# Respostas diretas de política (gatilhos)
+COPY_ENTREGA_DIGITAL = "É 100% digital. Você recebe por e-mail/WhatsApp após o pagamento."
+COPY_SEGURANCA = "Checkout HTTPS com PSP oficial. Nunca pedimos senhas/códigos."
+COPY_PAGAMENTO_TRAVOU = "Em que etapa travou? PIX, cartão ou boleto?"
+COPY_INSTAGRAM = "Tem bônus após seguir e comentar 3 posts no Instagram. Qual seu @ para validar?"
+
+POLICY_COPY = {
+    "entrega": COPY_ENTREGA_DIGITAL,
+    "seguranca": COPY_SEGURANCA,
+    "pagamento_travou": COPY_PAGAMENTO_TRAVOU,
+    "instagram": COPY_INSTAGRAM,
+}
@@ -0,0 +1,256 @@
+# debounce.py
+#
+# Agrupa mensagens inbound em rajada ("oi", "quero", "o pix") numa única resposta.
+# Ligado com INBOUND_DEBOUNCE_MS > 0.
+#
+# Chaves Redis:
+#   deb:buf:{phone}        lista dos textos ainda não respondidos
+#   deb:first              hash phone → ms da primeira mensagem da rajada
+#   deb:due                zset phone → ms em que a rajada vence
+#   deb:proc:{phone}|{n}   rajada retirada, aguardando a resposta dar certo
+#   deb:inflight           zset "{phone}|{n}" → ms em que a retirada expira (lease)
+#   deb:tries              hash "{phone}|{n}" → tentativas de resposta
+#
+# Cada mensagem empurra o vencimento para agora + janela, limitado a primeira + INBOUND_DEBOUNCE_MAX_MS
+# (quem manda sem parar ainda recebe resposta). Todo processo web roda um poller que retira as
+# rajadas vencidas com um EVALSHA (a lista vira deb:proc:..., com lease): com vários workers do
+# gunicorn, cada rajada é retirada por exatamente um deles.
+# A rajada só é apagada (ack) depois que o handler responde {"ok": True}. Se ele falhar, levantar
+# exceção ou o processo morrer, o lease (DEBOUNCE_LEASE_MS) vence e a rajada é retirada de novo,
+# até DEBOUNCE_MAX_TRIES tentativas (depois é descartada e contada em debounce_bursts_total).
+# Cada poller tem no máximo DEBOUNCE_WORKERS * 2 rajadas em andamento: não retira mais do que
+# consegue responder.
+#
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+INBOUND_DEBOUNCE_MS = int(os.getenv("INBOUND_DEBOUNCE_MS", "0"))  # 0 = desligado
+INBOUND_DEBOUNCE_MAX_MS = int(os.getenv("INBOUND_DEBOUNCE_MAX_MS", "5000"))
+DEBOUNCE_POLL_MS = int(os.getenv("DEBOUNCE_POLL_MS", "100"))
+DEBOUNCE_WORKERS = int(os.getenv("DEBOUNCE_WORKERS", "4"))
+DEBOUNCE_LEASE_MS = int(os.getenv("DEBOUNCE_LEASE_MS", "60000"))
+DEBOUNCE_MAX_TRIES = int(os.getenv("DEBOUNCE_MAX_TRIES", "3"))
+DEBOUNCE_PREFIX = "deb"
+
+_PUSH = """
+local pfx, phone, text = ARGV[1], ARGV[2], ARGV[3]
+local now, win, max = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+local buf = pfx .. ':buf:' .. phone
+local n = redis.call('RPUSH', buf, text)
+redis.call('PEXPIRE', buf, max * 4)
+local first = tonumber(redis.call('HGET', pfx .. ':first', phone) or '0')
+if first == 0 then
+  first = now
+  redis.call('HSET', pfx .. ':first', phone, now)
+end
+redis.call('ZADD', pfx .. ':due', math.min(now + win, first + max), phone)
+return n
+"""
+
+# ARGV: prefixo, agora (ms), limite, lease (ms), tentativas máximas
+# Retorno: {descartadas, token1, texto1, token2, texto2, ...} (textos da rajada unidos por \\n).
+# Primeiro as rajadas com lease vencido (resposta falhou), depois as que acabaram de vencer.
+_CLAIM = """
+local pfx, now, limit = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local lease, max_tries = tonumber(ARGV[4]), tonumber(ARGV[5])
+local inflight, tries = pfx .. ':inflight', pfx .. ':tries'
+local out, dropped = {0}, 0
+for _, token in ipairs(redis.call('ZRANGEBYSCORE', inflight, '-inf', now, 'LIMIT', 0, limit)) do
+  local proc = pfx .. ':proc:' .. token
+  local texts = redis.call('LRANGE', proc, 0, -1)
+  if #texts == 0 or redis.call('HINCRBY', tries, token, 1) > max_tries then
+    redis.call('DEL', proc)
+    redis.call('ZREM', inflight, token)
+    redis.call('HDEL', tries, token)
+    dropped = dropped + 1
+  else
+    redis.call('ZADD', inflight, now + lease, token)
+    table.insert(out, token)
+    table.insert(out, table.concat(texts, '\\n'))
+  end
+end
+local room = limit - (#out - 1) / 2
+if room > 0 then
+  for _, phone in ipairs(redis.call('ZRANGEBYSCORE', pfx .. ':due', '-inf', now, 'LIMIT', 0, room)) do
+    redis.call('ZREM', pfx .. ':due', phone)
+    redis.call('HDEL', pfx .. ':first', phone)
+    local buf = pfx .. ':buf:' .. phone
+    local texts = redis.call('LRANGE', buf, 0, -1)
+    if #texts > 0 then
+      local token = phone .. '|' .. redis.call('INCR', pfx .. ':seq')
+      local proc = pfx .. ':proc:' .. token
+      redis.call('RENAME', buf, proc)
+      redis.call('PEXPIRE', proc, lease * (max_tries + 2))
+      redis.call('ZADD', inflight, now + lease, token)
+      redis.call('HSET', tries, token, 1)
+      table.insert(out, token)
+      table.insert(out, table.concat(texts, '\\n'))
+    end
+  end
+end
+out[1] = dropped
+return out
+"""
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _claimed(out):
+    """(descartadas, [(token, phone, texto)]) do retorno do _CLAIM."""
+    items = [(out[i], out[i].rsplit("|", 1)[0], out[i + 1]) for i in range(1, len(out), 2)]
+    return int(out[0]), items
+
+
+def _handled(res) -> bool:
+    return isinstance(res, dict) and bool(res.get("ok"))
+
+
+class Debouncer:
+    def __init__(self, r, window_ms: int = INBOUND_DEBOUNCE_MS, max_ms: int = INBOUND_DEBOUNCE_MAX_MS):
+        self.r = r
+        self.window_ms = window_ms
+        self.max_ms = max(max_ms, window_ms)
+        self.capacity = DEBOUNCE_WORKERS * 2
+        self._push = r.register_script(_PUSH)
+        self._claim = r.register_script(_CLAIM)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_ms > 0
+
+    def _push_args(self, phone, text):
+        return [DEBOUNCE_PREFIX, phone, text, _now_ms(), self.window_ms, self.max_ms]
+
+    def _claim_args(self, limit):
+        return [DEBOUNCE_PREFIX, _now_ms(), limit, DEBOUNCE_LEASE_MS, DEBOUNCE_MAX_TRIES]
+
+    def _ack_pipe(self, p, token: str):
+        p.delete(f"{DEBOUNCE_PREFIX}:proc:{token}")
+        p.zrem(f"{DEBOUNCE_PREFIX}:inflight", token)
+        p.hdel(f"{DEBOUNCE_PREFIX}:tries", token)
+
+    def push(self, phone: str, text: str) -> int:
+        """Bufferiza o texto; retorna quantas mensagens a rajada já tem."""
+        return self._push(keys=[], args=self._push_args(phone, text))
+
+    def claim_due(self, limit: int = 50):
+        """[(token, phone, texto concatenado)] das rajadas vencidas (cada uma sai para um único processo)."""
+        dropped, items = _claimed(self._claim(keys=[], args=self._claim_args(limit)))
+        metrics.count_debounce("dropped", dropped)
+        return items
+
+    def ack(self, token: str):
+        """Resposta enviada: apaga a rajada retirada."""
+        p = self.r.pipeline(transaction=False)
+        self._ack_pipe(p, token)
+        p.execute()
+
+    def start(self, handler):
+        """Poller em thread daemon (uma por processo; refeito após fork do gunicorn)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self.run, args=(handler,), name="debounce", daemon=True).start()
+
+    def _done(self, token: str, future):
+        try:
+            ok = _handled(future.result())
+        except Exception:
+            ok = False
+        if not ok:
+            metrics.count_debounce("failed")  # fica em deb:proc; volta quando o lease vencer
+            return
+        try:
+            self.ack(token)
+            metrics.count_debounce("answered")
+        except Exception:
+            pass  # sem ack a rajada é respondida de novo depois do lease
+
+    def run(self, handler, stop=lambda: False):
+        """handler(phone, texto) → {"ok": True} quando a resposta saiu."""
+        pool = ThreadPoolExecutor(DEBOUNCE_WORKERS, thread_name_prefix="debounce")
+        slots = threading.BoundedSemaphore(self.capacity)
+        busy = [0]
+        busy_lock = threading.Lock()
+
+        def release(_):
+            with busy_lock:
+                busy[0] -= 1
+            slots.release()
+
+        while not stop():
+            with busy_lock:
+                room = self.capacity - busy[0]
+            due = []
+            if room > 0:
+                try:
+                    due = self.claim_due(room)
+                except Exception:
+                    due = []
+            for token, phone, text in due:
+                slots.acquire()
+                with busy_lock:
+                    busy[0] += 1
+                f = pool.submit(handler, phone, text)
+                f.add_done_callback(lambda fut, token=token: self._done(token, fut))
+                f.add_done_callback(release)
+            if not due:
+                time.sleep(DEBOUNCE_POLL_MS / 1000)
+
+
+class AsyncDebouncer(Debouncer):
+    """Mesma rajada para redis.asyncio; o poller é uma task do event loop (lifespan do ASGI)."""
+
+    async def push(self, phone: str, text: str) -> int:
+        return await self._push(keys=[], args=self._push_args(phone, text))
+
+    async def claim_due(self, limit: int = 50):
+        dropped, items = _claimed(await self._claim(keys=[], args=self._claim_args(limit)))
+        metrics.count_debounce("dropped", dropped)
+        return items
+
+    async def ack(self, token: str):
+        p = self.r.pipeline(transaction=False)
+        self._ack_pipe(p, token)
+        await p.execute()
+
+    async def _answer(self, handler, token: str, phone: str, text: str):
+        try:
+            ok = _handled(await handler(phone, text))
+        except Exception:
+            ok = False
+        if not ok:
+            metrics.count_debounce("failed")
+            return
+        try:
+            await self.ack(token)
+            metrics.count_debounce("answered")
+        except Exception:
+            pass
+
+    async def run(self, handler, stop=lambda: False):
+        tasks = set()
+        while not stop():
+            room = self.capacity - len(tasks)
+            due = []
+            if room > 0:
+                try:
+                    due = await self.claim_due(room)
+                except Exception:
+                    due = []
+            for token, phone, text in due:
+                t = asyncio.ensure_future(self._answer(handler, token, phone, text))
+                tasks.add(t)
+                t.add_done_callback(tasks.discard)
+            if not due:
+                await asyncio.sleep(DEBOUNCE_POLL_MS / 1000)
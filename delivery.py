@@ -0,0 +1,206 @@
+# delivery.py
+#
+# Rastreamento de entrega das mensagens enviadas (alimentado por /webhook/zapi/status).
+#
+# Chaves Redis (todas com TTL DELIVERY_TTL_HOURS):
+#   dlv:msg:{messageId}   hash  p=phone s=enviado_em(ms) k=guard j=job r=maior status
+#                               t_SENT / t_RECEIVED / t_READ ... = momento de cada status (ms)
+#   dlv:recent:{phone}    zset  últimas DELIVERY_PER_PHONE mensagens (score = ms)
+#   dlv:phone:{phone}     hash  guard (ex.: "paid:123") → maior status já visto
+#
+# O envio (dispatcher ou envio inline) grava dlv:msg com o messageId devolvido pela Z-API.
+# Cada webhook de status vira um único EVALSHA para todos os ids do payload: o script grava
+# só a primeira ocorrência de cada status e sobe o status do guard, então dá para saber se
+# "paid:123" já foi entregue antes de reenviar, sem varrer logs.
+#
+# Obs.: o script acessa chaves montadas dentro do Lua (Redis único, sem cluster).
+#
+import os
+import time
+
+DELIVERY_TTL_HOURS = int(os.getenv("DELIVERY_TTL_HOURS", "72"))
+DELIVERY_PER_PHONE = int(os.getenv("DELIVERY_PER_PHONE", "20"))
+DELIVERY_PREFIX = "dlv"
+
+# ordem dos status da Z-API; o que não estiver aqui é gravado com rank 0
+STATUS_RANK = {"SENT": 1, "RECEIVED": 2, "DELIVERED": 2, "READ": 3, "PLAYED": 4}
+DELIVERED_RANK = 2
+
+_LUA = """
+local pfx = ARGV[1]
+local ttl = tonumber(ARGV[2])
+local keep = tonumber(ARGV[3])
+local out = {}
+local i = 4
+while i <= #ARGV do
+  local id, st, rank, ts, phone = ARGV[i], ARGV[i+1], tonumber(ARGV[i+2]), ARGV[i+3], ARGV[i+4]
+  local k = pfx .. ':msg:' .. id
+  if redis.call('HSETNX', k, 't_' .. st, ts) == 1 then
+    local p = redis.call('HGET', k, 'p')
+    if (not p) and phone ~= '' then
+      p = phone
+      redis.call('HSET', k, 'p', phone)
+    end
+    local cur = tonumber(redis.call('HGET', k, 'r') or '0')
+    if rank > cur then redis.call('HSET', k, 'r', rank) end
+    redis.call('EXPIRE', k, ttl)
+    if p then
+      local rk = pfx .. ':recent:' .. p
+      redis.call('ZADD', rk, 'NX', ts, id)
+      redis.call('ZREMRANGEBYRANK', rk, 0, -keep - 1)
+      redis.call('EXPIRE', rk, ttl)
+      local g = redis.call('HGET', k, 'k')
+      if g and rank > 0 then
+        local pk = pfx .. ':phone:' .. p
+        if rank > tonumber(redis.call('HGET', pk, g) or '0') then redis.call('HSET', pk, g, rank) end
+        redis.call('EXPIRE', pk, ttl)
+      end
+    end
+    table.insert(out, id)
+    table.insert(out, st)
+    table.insert(out, redis.call('HGET', k, 's') or '')
+    table.insert(out, ts)
+  end
+  i = i + 5
+end
+return out
+"""
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def parse_status(body: dict, normalize_phone):
+    """[(messageId, status, ts_ms, phone)] do payload de status da Z-API."""
+    status = str(body.get("status") or "").upper()
+    if not status:
+        return []
+    ids = body.get("ids") or [body.get("messageId") or body.get("id")]
+    if isinstance(ids, str):
+        ids = [ids]  # um id solto, não uma lista de caracteres
+    ts = body.get("momment") or body.get("moment") or now_ms()
+    phone = normalize_phone(str(body.get("phone") or ""))
+    return [(str(i), status, int(ts), phone) for i in ids if i]
+
+
+def _status_args(events):
+    args = [DELIVERY_PREFIX, DELIVERY_TTL_HOURS * 3600, DELIVERY_PER_PHONE]
+    for mid, st, ts, phone in events:
+        args += [mid, st, STATUS_RANK.get(st, 0), ts, phone]
+    return args
+
+
+def _latencies(out):
+    """[(status, segundos desde o envio)] dos status novos que têm envio registrado."""
+    res = []
+    for i in range(0, len(out), 4):
+        _, st, sent, ts = out[i:i + 4]
+        if sent:
+            res.append((st, max(0.0, (int(ts) - int(sent)) / 1000.0)))
+    return res
+
+
+def _queue_sent(p, phone: str, message_id: str, key: str = "", job_id: str = "", kind: str = "text"):
+    ttl = DELIVERY_TTL_HOURS * 3600
+    ts = now_ms()
+    k = f"{DELIVERY_PREFIX}:msg:{message_id}"
+    fields = {"p": phone, "s": ts, "j": job_id, "kind": kind}
+    if key:
+        fields["k"] = key
+    p.hset(k, mapping=fields)
+    p.hsetnx(k, "r", STATUS_RANK["SENT"])
+    p.expire(k, ttl)
+    rk = f"{DELIVERY_PREFIX}:recent:{phone}"
+    p.zadd(rk, {message_id: ts})
+    p.zremrangebyrank(rk, 0, -DELIVERY_PER_PHONE - 1)
+    p.expire(rk, ttl)
+    if key:
+        pk = f"{DELIVERY_PREFIX}:phone:{phone}"
+        p.hsetnx(pk, key, STATUS_RANK["SENT"])
+        p.expire(pk, ttl)
+
+
+def _message_view(mid: str, h: dict) -> dict:
+    statuses = {f[2:]: int(v) for f, v in h.items() if f.startswith("t_")}
+    rank = int(h.get("r") or 0)
+    status = max(statuses, key=lambda s: (STATUS_RANK.get(s, 0), statuses[s])) if statuses else ("SENT" if h.get("s") else "")
+    return {
+        "id": mid,
+        "key": h.get("k", ""),
+        "kind": h.get("kind", ""),
+        "sent_at": int(h["s"]) if h.get("s") else None,
+        "status": status,
+        "delivered": rank >= DELIVERED_RANK,
+        "statuses": statuses,
+    }
+
+
+def _phone_view(phone, ids, res) -> dict:
+    guards = {k: int(v) for k, v in (res[-1] or {}).items()}
+    return {
+        "phone": phone,
+        "messages": [_message_view(mid, h) for mid, h in zip(ids, res[:-1]) if h],
+        "delivered_keys": sorted(k for k, v in guards.items() if v >= DELIVERED_RANK),
+    }
+
+
+class DeliveryStore:
+    def __init__(self, r):
+        self.r = r
+        self._script = r.register_script(_LUA)
+
+    def record_sent(self, phone: str, message_id: str, key: str = "", job_id: str = "", kind: str = "text"):
+        if not (phone and message_id):
+            return
+        p = self.r.pipeline(transaction=False)
+        _queue_sent(p, phone, message_id, key, job_id, kind)
+        p.execute()
+
+    def record_statuses(self, events) -> list:
+        """Grava todos os status num round trip; devolve latências dos status novos."""
+        if not events:
+            return []
+        return _latencies(self._script(keys=[], args=_status_args(events)))
+
+    def already_delivered(self, phone: str, key: str) -> bool:
+        v = self.r.hget(f"{DELIVERY_PREFIX}:phone:{phone}", key)
+        return int(v or 0) >= DELIVERED_RANK
+
+    def phone_state(self, phone: str, limit: int = DELIVERY_PER_PHONE) -> dict:
+        ids = self.r.zrevrange(f"{DELIVERY_PREFIX}:recent:{phone}", 0, limit - 1)
+        p = self.r.pipeline(transaction=False)
+        for mid in ids:
+            p.hgetall(f"{DELIVERY_PREFIX}:msg:{mid}")
+        p.hgetall(f"{DELIVERY_PREFIX}:phone:{phone}")
+        res = p.execute()
+        return _phone_view(phone, ids, res)
+
+
+class AsyncDeliveryStore(DeliveryStore):
+    """Mesma store para redis.asyncio (app ASGI)."""
+
+    async def record_sent(self, phone: str, message_id: str, key: str = "", job_id: str = "", kind: str = "text"):
+        if not (phone and message_id):
+            return
+        p = self.r.pipeline(transaction=False)
+        _queue_sent(p, phone, message_id, key, job_id, kind)
+        await p.execute()
+
+    async def already_delivered(self, phone: str, key: str) -> bool:
+        v = await self.r.hget(f"{DELIVERY_PREFIX}:phone:{phone}", key)
+        return int(v or 0) >= DELIVERED_RANK
+
+    async def record_statuses(self, events) -> list:
+        if not events:
+            return []
+        return _latencies(await self._script(keys=[], args=_status_args(events)))
+
+    async def phone_state(self, phone: str, limit: int = DELIVERY_PER_PHONE) -> dict:
+        ids = await self.r.zrevrange(f"{DELIVERY_PREFIX}:recent:{phone}", 0, limit - 1)
+        p = self.r.pipeline(transaction=False)
+        for mid in ids:
+            p.hgetall(f"{DELIVERY_PREFIX}:msg:{mid}")
+        p.hgetall(f"{DELIVERY_PREFIX}:phone:{phone}")
+        res = await p.execute()
+        return _phone_view(phone, ids, res)
@@ -0,0 +1,255 @@
+# dispatcher.py
+#
+# Worker que drena a fila de envios (outbox.py) e chama a Z-API.
+# Roda como processo separado do web:
+#
+#   worker: python dispatcher.py
+#
+# - Respostas 2xx → ack
+# - Falha de conexão, 429 ou 5xx → retry com backoff exponencial + jitter
+# - Timeout de leitura/conexão caída no meio do POST ("uncertain": a Z-API pode ter enviado)
+#   → dead-letter, sem reenvio (mesma regra do read=0 do adapter HTTP)
+# - Outros 4xx ou tentativas esgotadas → dead-letter
+# - Envio aceito → messageId gravado no rastreamento de entrega (delivery.py)
+# - Job "plan" (plans.py): passos enviados em sequência; retry retoma do passo que falhou, e
+#   as tentativas são contadas por passo
+# - DISPATCHER_THREADS threads de envio: o job vai para a thread do seu telefone (hash), então
+#   as mensagens de um telefone saem na ordem da fila e telefones diferentes saem em paralelo.
+#   Cada thread aceita até DISPATCHER_SHARD_QUEUE jobs; cheia, a leitura da fila espera
+# - Heartbeat a cada OUTBOX_WORKER_TTL/3 s; jobs presos no proc de um worker sem heartbeat
+#   (morto, ou com outro hostname depois de um deploy) voltam à fila pelos workers vivos
+# - Erro ao ler a fila (Redis fora) não derruba o worker: espera 1s, 2s, 4s... até
+#   DISPATCHER_ERROR_BACKOFF_CAP e tenta de novo (inclusive o recover() do início)
+#
+import os
+import zlib
+import time
+import queue
+import random
+import signal
+import socket
+import threading
+
+import metrics
+from outbox import OUTBOX_WORKER_TTL
+
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_CAP = float(os.getenv("OUTBOX_BACKOFF_CAP", "300"))
+DISPATCHER_ID = os.getenv("DISPATCHER_ID", socket.gethostname())
+DISPATCHER_METRICS_PORT = int(os.getenv("DISPATCHER_METRICS_PORT", "0"))  # 0 = sem exporter
+DISPATCHER_THREADS = int(os.getenv("DISPATCHER_THREADS", "8"))
+DISPATCHER_SHARD_QUEUE = int(os.getenv("DISPATCHER_SHARD_QUEUE", "32"))
+DISPATCHER_ERROR_BACKOFF_CAP = float(os.getenv("DISPATCHER_ERROR_BACKOFF_CAP", "30"))
+
+
+def backoff(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF_CAP, OUTBOX_BACKOFF_BASE * (2 ** (attempts - 1))) + random.random()
+
+
+def is_retryable(res: dict) -> bool:
+    if str(res.get("error", "")).startswith("invalid_"):
+        return False  # validação local (ex.: invalid_file_url)
+    if res.get("uncertain"):
+        return False  # o POST pode ter chegado: reenviar pode duplicar a mensagem
+    if "error" in res and "status" not in res:
+        return True  # exceção de rede/timeout
+    st = res.get("status") or 0
+    return st == 429 or st >= 500
+
+
+def _send(senders: dict, job: dict) -> dict:
+    fn = senders.get(job.get("kind"))
+    if fn is None:
+        return {"ok": False, "status": 400, "error": f"unknown_kind:{job.get('kind')}"}
+    p = job.get("payload") or {}
+    try:
+        if job["kind"] == "text":
+            return fn(job["phone"], p.get("text", ""))
+        return fn(job["phone"], p.get("url", ""), p.get("caption", ""))
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+def _process_plan(outbox, senders: dict, raw: str, job: dict, on_sent=None) -> bool:
+    from plans import run_steps, step_job
+
+    p = job.get("payload") or {}
+    steps = p.get("steps") or []
+    start = int(job.get("step", 0))
+    failed = job.setdefault("failed_steps", [])
+
+    def sent(i, step, res):
+        if on_sent is not None:
+            try:
+                on_sent(step_job(job["id"], job["phone"], i, step), res)
+            except Exception:
+                pass
+
+    def fail(i, step, res):
+        failed.append({"step": i, "error": res.get("error") or f"status {res.get('status')}"})
+
+    i, res = run_steps(job["phone"], steps, senders, start, on_sent=sent, on_failed=fail)
+    if i >= len(steps):
+        if failed:
+            # dead-letter só com os passos que falharam (reprocessar não reenvia os que saíram)
+            dead = dict(job, payload=dict(p, steps=[steps[f["step"]] for f in failed]), step=0)
+            outbox.dead_letter(raw, dead, "; ".join(f"{f['step']}: {f['error']}" for f in failed))
+        else:
+            outbox.ack(raw)
+        return True
+    if i > start:
+        job["attempts"] = 0  # avançou: as tentativas contam a partir do passo atual
+    job["step"] = i
+    job["attempts"] = int(job.get("attempts", 0)) + 1
+    if job["attempts"] < OUTBOX_MAX_ATTEMPTS:
+        outbox.schedule_retry(raw, job, backoff(job["attempts"]))
+        metrics.count_retries("dispatcher")
+    else:
+        outbox.dead_letter(raw, job, res.get("error") or f"status {res.get('status')}")
+    return True
+
+
+def process_one(outbox, senders: dict, timeout: int = 1, on_sent=None) -> bool:
+    """Processa um job. Retorna False se a fila estava vazia."""
+    item = outbox.pop(timeout=timeout)
+    if item is None:
+        return False
+    return handle(outbox, senders, *item, on_sent=on_sent)
+
+
+def handle(outbox, senders: dict, raw: str, job: dict, on_sent=None) -> bool:
+    """Envia um job já retirado da fila e faz ack/retry/dead-letter."""
+    if job.get("kind") == "plan":
+        return _process_plan(outbox, senders, raw, job, on_sent)
+    res = _send(senders, job)
+    if res.get("ok"):
+        outbox.ack(raw)
+        if on_sent is not None:
+            try:
+                on_sent(job, res)
+            except Exception:
+                pass  # rastreamento não pode reenviar um job já aceito
+        return True
+    job["attempts"] = int(job.get("attempts", 0)) + 1
+    err = res.get("error") or f"status {res.get('status')}"
+    if is_retryable(res) and job["attempts"] < OUTBOX_MAX_ATTEMPTS:
+        outbox.schedule_retry(raw, job, backoff(job["attempts"]))
+        metrics.count_retries("dispatcher")
+    else:
+        outbox.dead_letter(raw, job, err)
+    return True
+
+
+def shard_of(phone: str, n: int) -> int:
+    return zlib.crc32((phone or "").encode()) % n
+
+
+class ShardedWorkers:
+    """Threads de envio; jobs do mesmo telefone sempre na mesma thread (em ordem)."""
+
+    def __init__(self, outbox, senders: dict, threads: int = DISPATCHER_THREADS, on_sent=None,
+                 queue_size: int = DISPATCHER_SHARD_QUEUE):
+        self.outbox = outbox
+        self.senders = senders
+        self.on_sent = on_sent
+        self._queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(max(1, threads))]
+        self._threads = [threading.Thread(target=self._work, args=(q,), name=f"dispatch-{i}", daemon=True)
+                         for i, q in enumerate(self._queues)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, raw: str, job: dict):
+        """Entrega o job à thread do telefone; bloqueia se ela já tem queue_size na frente."""
+        self._queues[shard_of(job.get("phone", ""), len(self._queues))].put((raw, job))
+
+    def _work(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            try:
+                handle(self.outbox, self.senders, *item, on_sent=self.on_sent)
+            except Exception:
+                pass  # o job continua em proc e volta para a fila no próximo recover()
+
+    def close(self):
+        """Termina os jobs já entregues às threads e para."""
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join()
+
+
+def _pause(seconds: float, stop):
+    end = time.monotonic() + seconds
+    while not stop() and time.monotonic() < end:
+        time.sleep(min(0.5, end - time.monotonic()))
+
+
+def run(outbox, senders: dict, stop=lambda: False, on_sent=None, threads: int = DISPATCHER_THREADS):
+    workers = ShardedWorkers(outbox, senders, threads, on_sent) if threads > 1 else None
+    recovered = False
+    last_promote = last_beat = 0.0
+    errors = 0
+    try:
+        while not stop():
+            try:
+                if not recovered:
+                    outbox.recover()
+                    recovered = True
+                now = time.time()
+                if now - last_beat >= OUTBOX_WORKER_TTL / 3:
+                    outbox.heartbeat()
+                    outbox.recover_orphans()
+                    last_beat = now
+                if now - last_promote >= 1:
+                    outbox.promote_due()
+                    last_promote = now
+                item = outbox.pop(timeout=1)
+                errors = 0
+            except Exception:
+                # Redis fora/instável: o worker não pode morrer; espera com backoff e tenta de novo
+                errors += 1
+                _pause(min(DISPATCHER_ERROR_BACKOFF_CAP, 2 ** (errors - 1)), stop)
+                continue
+            if item is None:
+                continue
+            if workers is None:
+                try:
+                    handle(outbox, senders, *item, on_sent=on_sent)
+                except Exception:
+                    pass  # o job continua em proc e volta para a fila no próximo recover()
+            else:
+                workers.submit(*item)
+    finally:
+        if workers is not None:
+            workers.close()
+
+
+def default_senders() -> dict:
+    from main import zapi_send_text, zapi_send_image, zapi_send_file
+    return {"text": zapi_send_text, "image": zapi_send_image, "file": zapi_send_file}
+
+
+def delivery_recorder(store):
+    """on_sent que liga o job ao messageId devolvido pela Z-API."""
+    def on_sent(job: dict, res: dict):
+        message_id = (res.get("data") or {}).get("messageId")
+        if message_id:
+            store.record_sent(job["phone"], message_id, key=(job.get("payload") or {}).get("key", ""),
+                              job_id=job["id"], kind=job["kind"])
+    return on_sent
+
+
+if __name__ == "__main__":
+    from main import r
+    from delivery import DeliveryStore
+    from outbox import RedisOutbox
+
+    metrics.serve(DISPATCHER_METRICS_PORT)
+    _stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: _stopping.append(1))
+    signal.signal(signal.SIGINT, lambda *_: _stopping.append(1))
+    run(RedisOutbox(r, worker_id=DISPATCHER_ID), default_senders(), stop=lambda: bool(_stopping),
+        on_sent=delivery_recorder(DeliveryStore(r)))
@@ -0,0 +1,257 @@
+# flows.py
+#
+# Regras de atendimento sem I/O: extraem dados dos webhooks e decidem o que responder.
+# Quem faz Redis/Z-API são os apps (main.py em Flask, asgi.py em ASGI), assim os dois
+# modos de execução seguem exatamente as mesmas regras.
+#
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+from intents import classify
+from copys import COPY_UPSELL_NAO_QUERO, POLICY_COPY
+from plans import text_step, file_step
+from templates import Template, render, template, product_template
+
+TZ_OFFSET = int(os.getenv("TZ_OFFSET_MINUTES", "-180"))  # Brazil default -03:00
+TZ = timezone(timedelta(minutes=TZ_OFFSET))
+
+ORDER_EVENTS = ("order.paid", "order.created")
+ABANDONED_EVENTS = ("abandoned.created", "cart.abandoned", "abandoned")
+
+# Link de entrega que aponta para um arquivo → também vai como documento (send-file) após o texto
+DELIVERY_FILE_EXTENSIONS = tuple(
+    "." + e.strip().lower().lstrip(".")
+    for e in os.getenv("DELIVERY_FILE_EXTENSIONS", "pdf,epub,mobi,zip").split(",") if e.strip()
+)
+
+_NON_DIGITS = re.compile(r"\D+")
+
+
+# -------------------------
+# Utilitários
+# -------------------------
+def now():
+    return datetime.now(TZ)
+
+def _saudacao(h: int) -> str:
+    if 5 <= h <= 11:
+        return "Bom dia"
+    if 12 <= h <= 17:
+        return "Boa tarde"
+    return "Boa noite"
+
+_saud = (0.0, "")  # (válida até, epoch; saudação)
+
+def saudacao():
+    """Saudação da hora local; recalculada só na virada da hora."""
+    global _saud
+    if time.time() >= _saud[0]:
+        n = now()
+        nxt = n.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        _saud = (nxt.timestamp(), _saudacao(n.hour))
+    return _saud[1]
+
+def normalize_phone(raw: str) -> str:
+    d = _NON_DIGITS.sub("", raw or "")
+    if d.startswith("55") and len(d) >= 12: return d
+    if len(d) in (10,11): return "55"+d
+    return d
+
+def first_nonempty(*vals):
+    for v in vals:
+        if isinstance(v, str) and v.strip():
+            return v.strip()
+        if v:
+            return v
+    return ""
+
+def first_name(*vals) -> str:
+    return first_nonempty(*vals, "cliente").split()[0]
+
+def is_file_url(url: str) -> bool:
+    return (url or "").lower().startswith("http") and urlsplit(url).path.lower().endswith(DELIVERY_FILE_EXTENSIONS)
+
+
+# -------------------------
+# Cartpanda
+# -------------------------
+def event_id(data: dict, body_sha256: str) -> str:
+    """Id do evento; sem id no payload, o sha256 do corpo (já calculado na leitura, body.py)."""
+    return str(
+        data.get("id")
+        or (data.get("webhook") or {}).get("id")
+        or (data.get("order") or {}).get("id")
+        or body_sha256[:40]
+    )
+
+def cart_row(c: dict):
+    """(phone, name, cart_url) de um item da lista abandoned_carts, ou None se incompleto."""
+    cust = c.get("customer") or {}
+    phone = normalize_phone(first_nonempty(cust.get("phone"), cust.get("phone_ext")))
+    if not phone or not c.get("cart_token"):
+        return None
+    return phone, first_name(cust.get("first_name"), cust.get("full_name")), c.get("cart_url") or ""
+
+def abandoned_info(data: dict):
+    payload = data.get("data", {}) or data
+    cust = first_nonempty(payload.get("customer"), payload.get("customer_info")) or {}
+    phone = normalize_phone(first_nonempty(cust.get("phone"), cust.get("phone_ext")))
+    name = first_nonempty(cust.get("first_name"), (cust.get("full_name") or "cliente").split()[0])
+    return phone, name, payload.get("cart_url") or ""
+
+def order_plan(data: dict, event: str, rules) -> dict:
+    """
+    O que fazer com order.created/order.paid:
+      kind     "pix" (PIX pendente), "paid" (entregar + upsell) ou None (ignorar)
+      key      guard de envio (campo g:{key} do hash do cliente, keyschema.py)
+      profile  campos a gravar no perfil
+      message  texto principal
+      steps    passos da entrega (plans.py): texto e, se o link for um arquivo, o documento
+      items    chaves (SKU/handle) de cada item pago, para o upsell e o histórico (rules.py)
+    rules = RuleSet da versão atual das regras (links de fallback por SKU/handle).
+    """
+    order = data.get("order", {}) or {}
+    cust = order.get("customer") or {}
+    phone = normalize_phone(first_nonempty(order.get("phone"), cust.get("phone")))
+    name = first_name(cust.get("first_name"), cust.get("full_name"))
+    plan = {"phone": phone, "name": name, "kind": None, "key": "", "profile": {}, "message": "", "steps": [],
+            "items": []}
+    status = str(order.get("payment_status"))
+
+    # PIX pendente
+    if event == "order.created" and status in ("1", "pending"):
+        link = order.get("checkout_link") or ""
+        px = (order.get("payment") or {}).get("pix_code") or order.get("pix_code") or ""
+        plan.update(
+            kind="pix",
+            key=f"pix:{order.get('order_number')}",
+            profile={"last_pix_link": link, "last_pix_code": px},
+            message=render("COPY_PIX", saud=saudacao(), nome=name, link=link, pix_code=px or "(código indisponível)"),
+        )
+        return plan
+
+    # Pago → entregar + upsell
+    if event == "order.paid" or status in ("3", "paid"):
+        items = order.get("line_items", []) or []
+        order_no = first_nonempty(order.get("public_id"), f"#{order.get('order_number')}")
+        keys = [rules.item_keys(it) for it in items]
+        # sem anexo: link de fallback cadastrado para o SKU/handle de algum item
+        digital = order.get("digital_attachment") or rules.drive_link(keys)
+        if not digital:
+            digital = order.get("thank_you_page") or order.get("order_status_url") or ""
+        titles = [first_nonempty(it.get("title"), (it.get("variant") or {}).get("title")) for it in items]
+        key = f"paid:{order.get('id')}"
+        message = render("COPY_ENTREGA", saud=saudacao(), nome=name, order=order_no, digital=digital or "(link indisponível)")
+        steps = [text_step(message, key)]
+        if is_file_url(digital):
+            steps.append(file_step(digital, titles[0] if titles else order_no, f"{key}:file"))
+        plan.update(
+            kind="paid",
+            key=key,
+            profile={"last_order": order_no, "last_digital": digital, "last_products": "|".join(titles)},
+            message=message,
+            steps=steps,
+            items=keys,
+        )
+    return plan
+
+
+# -------------------------
+# Z-API inbound
+# -------------------------
+def parse_inbound(body: dict):
+    """(phone, text) das várias formas de payload da Z-API."""
+    phone = normalize_phone(
+        first_nonempty(
+            body.get("phone"),
+            (body.get("message") or {}).get("phone"),
+            ((body.get("data") or {}).get("message") or {}).get("from"),
+            (body.get("sender") or {}).get("phone"),
+            (body.get("payload") or {}).get("phone"),
+        )
+    )
+    text = first_nonempty(
+        body.get("messageText"),
+        (body.get("message") or {}).get("message"),
+        (body.get("message") or {}).get("text"),
+        (body.get("data") or {}).get("text"),
+        body.get("text"),
+        "",
+    ).strip()
+    return phone, text
+
+def inbound_reply(user: dict, text: str, catalog) -> dict:
+    """
+    Resposta para uma mensagem do cliente.
+    text=None significa "sem regra": o app tenta o LLM e cai em fallback_text().
+    """
+    name = first_name(user.get("name"))
+    saud = saudacao()
+    intent, order_no = classify(text)
+    if intent == "pedido" and catalog is not None:
+        # "quero o tabib 2025", "300 receitas": os dígitos são do nome do produto, não nº de pedido
+        _, phrase = catalog.match_in_text(text)
+        if order_no in phrase:
+            intent, order_no = classify(text, not_orders=phrase)
+    out = {"intent": intent, "name": name, "text": None, "block_upsell": False}
+
+    if intent == "retomar":
+        link = first_nonempty(user.get("last_pix_link"), user.get("last_cart"))
+        out["text"] = render("COPY_RETOMAR", saud=saud, nome=name, link=link or "(link não encontrado)")
+    elif intent == "pix":
+        link = user.get("last_pix_link")
+        px = user.get("last_pix_code") or ""
+        if link:
+            out["text"] = render("COPY_PIX", saud=saud, nome=name, link=link, pix_code=px or "(sem código)")
+        else:
+            out["text"] = render("COPY_PIX_NAO_ENCONTRADO", saud=saud, nome=name)
+    elif intent == "nao_quero":
+        out["block_upsell"] = True
+        out["text"] = COPY_UPSELL_NAO_QUERO
+    elif intent in ("nao_recebi", "pedido"):
+        digital = user.get("last_digital")
+        if digital:
+            order = f"#{order_no}" if intent == "pedido" else user.get("last_order", "#?")
+            out["text"] = render("COPY_ENTREGA", saud=saud, nome=name, order=order, digital=digital)
+        else:
+            out["text"] = render("COPY_NAO_RECEBI_ASK", saud=saud, nome=name)
+    elif intent in POLICY_COPY:
+        out["text"] = POLICY_COPY[intent]
+    else:
+        # Produto citado ("quero o tabib 2") → nome, descrição e checkout
+        prod = catalog.find_in_text(text) if catalog is not None else None
+        if prod and prod.get("checkout"):
+            out["sku"] = prod.get("sku")
+            out["text"] = product_template(prod).render(saud=saud, nome=name, produto=prod.get("name", ""),
+                                                        descricao=prod.get("description", ""), link=prod["checkout"])
+        elif intent == "saudacao":
+            out["text"] = render("COPY_SAUDACAO", saud=saud, nome=name)
+    return out
+
+def fallback_text(name: str) -> str:
+    return render("COPY_FALLBACK", saud=saudacao(), nome=name)
+
+def render_many(tpl, rows, common: dict = None) -> list:
+    """
+    A mesma copy (nome de um COPY_*, texto ou Template) para vários destinatários, na ordem de rows.
+    rows: dicts com os campos de cada um; "nome" pode ser o nome completo do perfil (vira o primeiro nome).
+    A saudação e os campos de common (dict) são resolvidos uma vez para o lote todo.
+    """
+    t = tpl if isinstance(tpl, Template) else template(tpl)
+    base = {"saud": saudacao(), **(common or {})}
+    fmt = t.fmt if t.fields else None
+    fill = fmt.__mod__ if fmt is not None else t.render_map
+    if "nome" not in t.fields:
+        return [fill({**base, **row}) for row in rows]
+    default = base.get("nome")
+    return [fill({**base, **row, "nome": _first_word(row.get("nome", default))}) for row in rows]
+
+def _first_word(v) -> str:
+    """first_name(v) sem o strip/split completo no caso comum (nome em texto)."""
+    if isinstance(v, str):
+        words = v.split(None, 1)
+        return words[0] if words else "cliente"
+    return first_name(v)
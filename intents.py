@@ -0,0 +1,92 @@
+# intents.py
+#
+# Classificador de intenções das mensagens inbound.
+# As palavras-chave de todas as intenções são compiladas uma vez numa tabela
+# indexada pela primeira palavra (palavra → [(resto da frase, prioridade)]).
+# O texto é normalizado (minúsculas, sem acento), quebrado em palavras por um
+# único regex e percorrido uma vez: cada palavra custa um lookup no dict.
+#
+# Como a comparação é por palavra inteira, "seguir" não casa em "conseguir",
+# "oi" não casa em "noite" e "post" não casa em "postagem" (plural simples é aceito).
+# Frases sobrepostas são todas vistas ("não consegui pagar" também contém "pagar"),
+# e vence a intenção de maior prioridade, na mesma ordem que o webhook sempre usou.
+# Número solto de 3+ dígitos vira "pedido" só se nada mais casar; quem chama passa em
+# not_orders os números que já pertencem a outra coisa (nome de produto: "tabib 2025").
+#
+import re
+import unicodedata
+
+# (intenção, palavras-chave) em ordem de prioridade
+INTENT_KEYWORDS = [
+    ("retomar", ["retomar", "continuar", "não desisti", "seguir", "finalizar"]),
+    ("pix", ["pix", "pagar", "pendente"]),
+    ("nao_quero", ["não quero", "agora não"]),
+    ("nao_recebi", ["não recebi", "não chegou", "ebook", "e-book", "produto", "acesso"]),
+    ("entrega", ["frete", "entrega", "prazo", "rastreio", "rastreamento", "correio", "endereço"]),
+    ("seguranca", ["segurança", "golpe", "fraude", "medo"]),
+    ("pagamento_travou", ["travou", "não consegui pagar", "erro no pagamento", "cartão", "boleto"]),
+    ("instagram", ["instagram", "comentar", "comentário", "seguir", "post", "@"]),
+    ("pedido", None),  # nº do pedido (#12345), via _ORDER_RE
+    ("saudacao", ["oi", "olá", "oie", "oii", "bom dia", "boa tarde", "boa noite"]),
+]
+
+_TOKEN_RE = re.compile(r"\w+|@")
+_ORDER_RE = re.compile(r"#?\s*(\d{3,})")
+
+
+def normalize(text: str) -> str:
+    """minúsculas + sem acento + espaços colapsados"""
+    text = text or ""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return " ".join(text.lower().split())
+
+
+def _compile():
+    table = {}
+    for prio, (name, kws) in enumerate(INTENT_KEYWORDS):
+        for kw in kws or ():
+            toks = _TOKEN_RE.findall(normalize(kw))
+            variants = [toks]
+            if toks[-1].isalpha() and len(toks[-1]) > 2:
+                variants.append(toks[:-1] + [toks[-1] + "s"])
+            for v in variants:
+                entry = (tuple(v[1:]), prio)
+                lst = table.setdefault(v[0], [])
+                # mesma frase em duas intenções ("seguir"): fica só a de maior prioridade
+                if not any(rest == entry[0] for rest, _ in lst):
+                    lst.append(entry)
+    return table
+
+
+_TABLE = _compile()
+_NAMES = [name for name, _ in INTENT_KEYWORDS]
+_PEDIDO = _NAMES.index("pedido")
+
+
+def classify(text: str, not_orders=()):
+    """
+    Retorna (intenção, nº do pedido) — (None, "") quando nada casa.
+    not_orders: números que não são pedido (ex.: os do nome de um produto citado, "tabib 2025").
+    """
+    norm = normalize(text)
+    toks = _TOKEN_RE.findall(norm)
+    best = len(_NAMES)
+    for i, tok in enumerate(toks):
+        cands = _TABLE.get(tok)
+        if not cands:
+            continue
+        for rest, prio in cands:
+            if prio < best and (not rest or tuple(toks[i + 1:i + 1 + len(rest)]) == rest):
+                best = prio
+        if best == 0:
+            break
+    order_no = ""
+    if best > _PEDIDO:
+        for m in _ORDER_RE.finditer(norm):
+            if m.group(1) not in not_orders:
+                best, order_no = _PEDIDO, m.group(1)
+                break
+    if best == len(_NAMES):
+        return None, ""
+    return _NAMES[best], order_no
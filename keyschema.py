@@ -0,0 +1,296 @@
+# keyschema.py
+#
+# Layout das chaves Redis por cliente (versão "v2").
+#
+#   v2:u:{phone}     hash único por telefone, com TTL (PROFILE_TTL_DAYS, renovado a cada escrita)
+#                    name, last_cart, last_pix_link, last_order, ...   perfil
+#                    ub       = epoch até quando o upsell está bloqueado
+#                    g:{key}  = epoch até quando o guard de envio vale (ex.: g:paid:123)
+#   v2:evt:{bloco}   set com os ids de evento já processados no bloco de IDEMPOTENCY_HOURS/2 horas;
+#                    o membro é o sha1 do id truncado em 16 hex. Um evento é "visto" se está no
+#                    bloco atual ou nos dois anteriores (janela >= IDEMPOTENCY_HOURS)
+#   rl:{phone}       rate limit (ratelimit.py), hash com TTL de 2h
+#
+# Substitui (v1): user:{phone} sem TTL, last_cart_by_phone:{phone} (duplicava last_cart e nunca
+# era lido), upsell_block:{phone}, sent:{phone}:{key} e evt:{id} (uma string com TTL por chave).
+# Os campos com validade (ub, g:*) são checados contra o relógio na leitura e removidos no
+# próximo carregamento completo do perfil (emulação de TTL por campo).
+#
+#   python keyschema.py migrate [--delete] [--dry-run]   # v1 → v2 (SCAN, em pipelines)
+#   python keyschema.py report [--sample 2000]           # memória por tipo de chave e por cliente
+#
+import os
+import sys
+import time
+import hashlib
+import argparse
+
+KEY_VERSION = "v2"
+PROFILE_TTL_DAYS = int(os.getenv("PROFILE_TTL_DAYS", "180"))
+IDEMPOTENCY_HOURS = int(os.getenv("IDEMPOTENCY_HOURS", "24"))
+
+PROFILE_TTL = PROFILE_TTL_DAYS * 24 * 3600
+GUARD_PREFIX = "g:"
+UPSELL_FIELD = "ub"
+_EVT_BUCKET = max(1, IDEMPOTENCY_HOURS * 3600 // 2)
+
+
+def user_key(phone: str) -> str:
+    return f"{KEY_VERSION}:u:{phone}"
+
+
+def guard_field(key: str) -> str:
+    return GUARD_PREFIX + key
+
+
+def _is_timed(field: str) -> bool:
+    return field == UPSELL_FIELD or field.startswith(GUARD_PREFIX)
+
+
+def split_user(h: dict, now: float = None):
+    """(perfil, upsell_permitido) de um HGETALL de v2:u:{phone}."""
+    now = time.time() if now is None else now
+    profile = {f: v for f, v in h.items() if not _is_timed(f)}
+    return profile, float(h.get(UPSELL_FIELD) or 0) <= now
+
+
+# KEYS[1] = v2:u:{phone}
+# ARGV: agora, ttl do guard (s), carregar perfil (1/0), ttl do perfil (s), guard1, guard2, ...
+# Retorno: {ok_guard1, ok_guard2, ..., [hgetall]} (hgetall só se carregar perfil = 1)
+LOAD_LUA = """
+local h = KEYS[1]
+local now = tonumber(ARGV[1])
+local out = {}
+for i = 5, #ARGV do
+  local f = 'g:' .. ARGV[i]
+  if tonumber(redis.call('HGET', h, f) or '0') > now then
+    table.insert(out, 0)
+  else
+    redis.call('HSET', h, f, now + tonumber(ARGV[2]))
+    table.insert(out, 1)
+  end
+end
+if #ARGV >= 5 then redis.call('EXPIRE', h, ARGV[4]) end
+if ARGV[3] == '1' then
+  local all = redis.call('HGETALL', h)
+  local dead = {}
+  for i = 1, #all, 2 do
+    local f = all[i]
+    if (f == 'ub' or string.sub(f, 1, 2) == 'g:') and tonumber(all[i + 1]) <= now then
+      table.insert(dead, f)
+    end
+  end
+  if #dead > 0 then redis.call('HDEL', h, unpack(dead)) end
+  table.insert(out, all)
+end
+return out
+"""
+
+
+def load_args(guards, guard_ttl: int, load: bool, now: float = None):
+    now = int(time.time()) if now is None else int(now)
+    return [now, guard_ttl, 1 if load else 0, PROFILE_TTL, *guards]
+
+
+def parse_load(res, n_guards: int, load: bool):
+    """([ok por guard], hgetall como dict ou None)."""
+    oks = [bool(x) for x in res[:n_guards]]
+    h = None
+    if load:
+        flat = res[n_guards] if len(res) > n_guards else []
+        h = dict(zip(flat[::2], flat[1::2]))
+    return oks, h
+
+
+def queue_profile(p, phone: str, fields: dict):
+    """HSET do perfil + renovação do TTL, num pipeline."""
+    k = user_key(phone)
+    p.hset(k, mapping=fields)
+    p.expire(k, PROFILE_TTL)
+
+
+# -------------------------
+# Idempotência
+# -------------------------
+def evt_member(evt_id: str) -> str:
+    return hashlib.sha1(str(evt_id).encode()).hexdigest()[:16]
+
+
+def evt_keys(now: float = None):
+    b = int((time.time() if now is None else now) // _EVT_BUCKET)
+    return [f"{KEY_VERSION}:evt:{b - i}" for i in range(3)]
+
+
+def queue_event_seen(p, evt_id: str, now: float = None):
+    """SISMEMBER nos dois blocos anteriores + SADD no atual; resultado via event_seen()."""
+    cur, prev, prev2 = evt_keys(now)
+    m = evt_member(evt_id)
+    p.sismember(prev, m)
+    p.sismember(prev2, m)
+    p.sadd(cur, m)
+    p.expire(cur, _EVT_BUCKET * 3 + 3600)
+
+
+def event_seen(res) -> bool:
+    return bool(res[0] or res[1]) or not res[2]
+
+
+# -------------------------
+# Migração v1 → v2
+# -------------------------
+def _scan(r, pattern: str, count: int = 1000):
+    return r.scan_iter(match=pattern, count=count)
+
+
+def migrate(r, delete: bool = False, dry_run: bool = False, batch: int = 500, log=print) -> dict:
+    now = time.time()
+    stats = {"user": 0, "upsell_block": 0, "sent": 0, "evt": 0, "last_cart_by_phone": 0}
+    old_keys = []
+
+    def flush(p):
+        if not dry_run:
+            p.execute()
+        if delete and not dry_run and old_keys:
+            for i in range(0, len(old_keys), batch):
+                r.unlink(*old_keys[i:i + batch])
+        old_keys.clear()
+
+    # perfis: v2 ganha nos campos que já existirem
+    keys = list(_scan(r, "user:*"))
+    for i in range(0, len(keys), batch):
+        chunk = keys[i:i + batch]
+        p = r.pipeline(transaction=False)
+        for k in chunk:
+            p.hgetall(k)
+            p.hgetall(user_key(k.split(":", 1)[1]))
+        res = p.execute()
+        p = r.pipeline(transaction=False)
+        for j, k in enumerate(chunk):
+            old, cur = res[2 * j], res[2 * j + 1]
+            fields = {f: v for f, v in old.items() if f not in cur}
+            if fields:
+                queue_profile(p, k.split(":", 1)[1], fields)
+            old_keys.append(k)
+            stats["user"] += 1
+        flush(p)
+
+    # bloqueios de upsell e guards: validade = agora + TTL restante
+    p = r.pipeline(transaction=False)
+    for pattern, name in (("upsell_block:*", "upsell_block"), ("sent:*", "sent")):
+        for k in _scan(r, pattern):
+            ttl = r.ttl(k)
+            if ttl and ttl > 0:
+                if name == "upsell_block":
+                    phone, field = k.split(":", 1)[1], UPSELL_FIELD
+                else:
+                    _, phone, key = k.split(":", 2)
+                    field = guard_field(key)
+                p.hset(user_key(phone), field, int(now + ttl))
+                p.expire(user_key(phone), PROFILE_TTL)
+            old_keys.append(k)
+            stats[name] += 1
+            if len(old_keys) >= batch:
+                flush(p)
+                p = r.pipeline(transaction=False)
+    flush(p)
+
+    # eventos: no bloco correspondente ao instante em que foram vistos (TTL de 24h)
+    p = r.pipeline(transaction=False)
+    for k in _scan(r, "evt:*"):
+        ttl = r.ttl(k)
+        if ttl and ttl > 0:
+            seen_at = now - max(0, 24 * 3600 - ttl)
+            cur = evt_keys(seen_at)[0]
+            p.sadd(cur, evt_member(k.split(":", 1)[1]))
+            p.expire(cur, _EVT_BUCKET * 3 + 3600)
+        old_keys.append(k)
+        stats["evt"] += 1
+        if len(old_keys) >= batch:
+            flush(p)
+            p = r.pipeline(transaction=False)
+    flush(p)
+
+    # last_cart_by_phone: redundante com last_cart do perfil; só removido
+    for k in _scan(r, "last_cart_by_phone:*"):
+        old_keys.append(k)
+        stats["last_cart_by_phone"] += 1
+        if len(old_keys) >= batch:
+            flush(r.pipeline(transaction=False))
+    flush(r.pipeline(transaction=False))
+
+    log(("[dry-run] " if dry_run else "") + " ".join(f"{k}={v}" for k, v in stats.items())
+        + (" (chaves antigas removidas)" if delete and not dry_run else ""))
+    return stats
+
+
+# -------------------------
+# Relatório de memória
+# -------------------------
+_CLASSES = [
+    ("v2:u:", "perfil v2"), ("v2:evt:", "idempotência v2"), ("rl:", "rate limit"),
+    ("user:", "perfil v1"), ("sent:", "guard v1"), ("upsell_block:", "upsell v1"), ("evt:", "evento v1"),
+    ("last_cart_by_phone:", "carrinho v1"), ("dlv:", "entrega"), ("rem:", "lembretes"), ("deb:", "debounce"),
+    ("llm:", "cache LLM"), ("outbox:", "outbox"),
+]
+_PER_CUSTOMER = {"perfil v2", "rate limit", "perfil v1", "guard v1", "upsell v1", "carrinho v1"}
+
+
+def _classify(k: str) -> str:
+    for prefix, name in _CLASSES:
+        if k.startswith(prefix):
+            return name
+    return "outros"
+
+
+def _usage(r, k: str) -> int:
+    try:
+        return int(r.memory_usage(k, samples=0) or 0)
+    except Exception:
+        pass
+    try:
+        return len(r.dump(k) or b"")  # sem MEMORY USAGE (ex.: fakeredis): tamanho serializado, subestima
+    except Exception:
+        return 0
+
+
+def report(r, sample: int = 2000, log=print) -> dict:
+    """Conta todas as chaves por tipo (SCAN) e mede a memória de uma amostra de cada tipo."""
+    counts, sizes = {}, {}
+    for k in _scan(r, "*"):
+        name = _classify(k)
+        counts[name] = counts.get(name, 0) + 1
+        if len(sizes.setdefault(name, [])) < sample:
+            sizes[name].append(_usage(r, k))
+    out = {}
+    for name, n in sorted(counts.items(), key=lambda kv: -kv[1]):
+        avg = sum(sizes[name]) / max(1, len(sizes[name]))
+        out[name] = {"keys": n, "avg_bytes": round(avg), "total_bytes": round(avg * n)}
+    customers = max(counts.get("perfil v2", 0), counts.get("perfil v1", 0))
+    per_customer = sum(v["total_bytes"] for k, v in out.items() if k in _PER_CUSTOMER) / max(1, customers)
+    for name, v in out.items():
+        log(f"{name:<16} {v['keys']:>10} chaves  {v['avg_bytes']:>7} B/chave  {v['total_bytes'] / 1e6:>9.2f} MB")
+    log(f"clientes={customers}  ~{per_customer:.0f} B por cliente (perfil + guards + rate limit)")
+    return {"classes": out, "customers": customers, "bytes_per_customer": round(per_customer)}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("migrate")
+    m.add_argument("--delete", action="store_true", help="remove as chaves v1 migradas")
+    m.add_argument("--dry-run", action="store_true")
+    m.add_argument("--batch", type=int, default=500)
+    rp = sub.add_parser("report")
+    rp.add_argument("--sample", type=int, default=2000)
+    a = ap.parse_args()
+
+    import redis
+
+    url = os.getenv("REDIS_URL")
+    if not url:
+        sys.exit("REDIS_URL não definido")
+    client = redis.Redis.from_url(url, decode_responses=True)
+    if a.cmd == "migrate":
+        migrate(client, delete=a.delete, dry_run=a.dry_run, batch=a.batch)
+    else:
+        report(client, sample=a.sample)
@@ -0,0 +1,170 @@
+# llm.py
+#
+# Fallback com LLM para mensagens que nenhuma intenção reconheceu.
+# - Cache por pergunta normalizada: LRU em memória (com TTL) + Redis (llm:cache:{hash}, com TTL)
+# - Perguntas idênticas em voo são deduplicadas: só uma chamada, as demais aguardam o mesmo Future
+# - Concorrência limitada por processo (LLM_MAX_CONCURRENCY chamadas simultâneas) e fila limitada
+#   (LLM_MAX_QUEUE esperando vaga). Pool cheio → None na hora, sem enfileirar; chamada que só
+#   conseguiu vaga depois de estourado o orçamento de quem a pediu é descartada sem ir à API
+# - Orçamento de latência: passou de LLM_BUDGET_SECONDS → devolve None e o webhook manda a copy padrão.
+#   A chamada continua em background e o resultado vai para o cache.
+#
+# O cliente pode ser passado pronto ou como fábrica sem argumentos: aí é criado na primeira
+# chamada (o import do SDK da OpenAI sai do boot do processo).
+#
+# As respostas são geradas com os marcadores {saud}/{nome} no lugar da saudação e do nome,
+# então a mesma resposta em cache serve para qualquer cliente e horário.
+#
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from intents import normalize
+
+LLM_FALLBACK = os.getenv("LLM_FALLBACK", "true").strip().lower() in ("1", "true", "yes")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_BUDGET_SECONDS = float(os.getenv("LLM_BUDGET_SECONDS", "6"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_LRU_SIZE = int(os.getenv("LLM_LRU_SIZE", "512"))
+LLM_LRU_TTL = int(os.getenv("LLM_LRU_TTL", "600"))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "160"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "20"))  # teto da chamada em background
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", str(LLM_MAX_CONCURRENCY)))
+
+
+def question_key(text: str) -> str:
+    norm = "".join(ch for ch in normalize(text) if ch.isalnum() or ch in " @#")
+    return hashlib.sha1(" ".join(norm.split()).encode()).hexdigest()
+
+
+class _LRU:
+    def __init__(self, size: int, ttl: int):
+        self.size = size
+        self.ttl = ttl
+        self._d = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, k):
+        with self._lock:
+            v = self._d.get(k)
+            if v is None:
+                return None
+            if v[0] < time.monotonic():
+                del self._d[k]
+                return None
+            self._d.move_to_end(k)
+            return v[1]
+
+    def put(self, k, val):
+        with self._lock:
+            self._d[k] = (time.monotonic() + self.ttl, val)
+            self._d.move_to_end(k)
+            while len(self._d) > self.size:
+                self._d.popitem(last=False)
+
+
+class LLMFallback:
+    def __init__(self, r, client, model: str, system_prompt):
+        self.r = r
+        self._client = client  # cliente, fábrica (callable) ou None = desligado
+        self.model = model
+        self.system_prompt = system_prompt
+        self._lru = _LRU(LLM_LRU_SIZE, LLM_LRU_TTL)
+        self._inflight = {}
+        self._pending = 0  # chamadas submetidas ao pool e ainda não terminadas
+        self._lock = threading.Lock()
+        self._client_lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+
+    @property
+    def enabled(self) -> bool:
+        return LLM_FALLBACK and self._client is not None
+
+    @property
+    def client(self):
+        c = self._client
+        if callable(c):
+            with self._client_lock:
+                if self._client is c:
+                    try:
+                        self._client = c()
+                    except Exception:
+                        self._client = None  # SDK ausente/config inválida: desliga o fallback
+                c = self._client
+        return c
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # o pool de threads limita as chamadas simultâneas; recriado após fork
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+            self._pool_pid = os.getpid()
+            self._inflight = {}
+            self._pending = 0
+        return self._pool
+
+    def _call(self, key: str, question: str, deadline: float) -> str:
+        try:
+            if time.monotonic() >= deadline:
+                return ""  # esperou vaga além do orçamento: ninguém mais aguarda a resposta
+            prompt = self.system_prompt() if callable(self.system_prompt) else self.system_prompt
+            client = self.client
+            if client is None:
+                return ""
+            resp = client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": question},
+                ],
+                max_tokens=LLM_MAX_TOKENS,
+                temperature=0.3,
+                timeout=LLM_CALL_TIMEOUT,
+            )
+            text = (resp.choices[0].message.content or "").strip()
+            if text:
+                self._lru.put(key, text)
+                try:
+                    self.r.set(f"llm:cache:{key}", text, ex=LLM_CACHE_TTL)
+                except Exception:
+                    pass
+            return text
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._pending -= 1
+
+    def answer(self, question: str, saud: str, nome: str):
+        """Resposta pronta para envio, ou None (desligado, erro ou orçamento estourado)."""
+        if not self.enabled or not question:
+            return None
+        t0 = time.monotonic()
+        key = question_key(question)
+        text = self._lru.get(key)
+        if text is None:
+            try:
+                text = self.r.get(f"llm:cache:{key}")
+            except Exception:
+                text = None
+            if text:
+                self._lru.put(key, text)
+        if text is None:
+            with self._lock:
+                fut = self._inflight.get(key)
+                if fut is None:
+                    pool = self._executor()
+                    if self._pending >= LLM_MAX_CONCURRENCY + LLM_MAX_QUEUE:
+                        return None  # pool e fila cheios: a copy padrão sai agora
+                    self._pending += 1
+                    fut = pool.submit(self._call, key, question, t0 + LLM_BUDGET_SECONDS)
+                    self._inflight[key] = fut
+            try:
+                text = fut.result(timeout=max(0.0, LLM_BUDGET_SECONDS - (time.monotonic() - t0)))
+            except (FutureTimeout, Exception):
+                return None
+        if not text:
+            return None
+        return text.replace("{saud}", saud).replace("{nome}", nome)
@@ -3,8 +3,14 @@
 # Bot de atendimento para Cartpanda + Z-API via webhooks.
 # Funções:
 # - Recebe webhooks Cartpanda (order.created PIX pendente, order.paid entrega, abandoned.created, lista abandoned_carts)
+# - Agenda lembretes de carrinho abandonado / PIX pendente (reminders.py), cancelados no order.paid
 # - Recebe mensagens WhatsApp (Z-API inbound) + status webhook
+# - Campanhas para segmentos de clientes (API /broadcast, envio pelo broadcast.py)
 # - Envia texto/imagem/arquivo via Z-API (com retries)
+# - Envios saem por uma fila no Redis (outbox.py) drenada pelo dispatcher.py,
+#   então os webhooks só enfileiram e respondem
+# - order.paid: entrega, arquivo (link direto para PDF/EPUB...) e upsell num plano ordenado (plans.py)
+# - Upsell e links de entrega por SKU/handle em regras recarregáveis sem restart (rules.py)
 #
 # Execução local:
 #   pip install -r requirements.txt
@@ -12,19 +18,44 @@
 #   python agent.py
 #
 # Produção (Render):
-#   web: gunicorn agent:app --bind 0.0.0.0:$PORT --timeout 120
+#   web: gunicorn 'main:create_app()' --bind 0.0.0.0:$PORT --timeout 120
+#   worker: python dispatcher.py
+#   reminders: python reminders.py (lembretes de carrinho/PIX)
+#   broadcast: python broadcast.py (campanhas criadas via /broadcast)
+#
+# Boot: o import não faz I/O. Redis (pool) e cliente OpenAI nascem no primeiro uso, já no
+# worker; create_app() valida a config e aquece catálogo/prompt. /health = processo vivo
+# (sem I/O), /ready = Redis respondendo e catálogo carregado (bench/bench_boot.py mede o boot).
+#
+# Modo assíncrono (mesmas rotas, ver asgi.py):
+#   web: uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 2
 #
 import os
 import hmac
-import hashlib
-import json
-import re
 import time
-import random
-from datetime import datetime, timedelta, timezone
+import functools
 
 import requests
-from flask import Flask, request, jsonify, abort
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from flask import Flask, request, jsonify, abort, g, Response
+
+from body import BodyTooLarge, read_stream
+from broadcast import BROADCAST_TOKEN, BROADCAST_RATE_PER_SECOND, BroadcastStore
+from catalog import Catalog
+from copys import COPY_RATE_LIMITED
+from debounce import Debouncer
+from delivery import DeliveryStore, parse_status
+from flows import (
+    ORDER_EVENTS, ABANDONED_EVENTS, now, saudacao, normalize_phone,
+    event_id, cart_row, abandoned_info, order_plan, parse_inbound, inbound_reply, fallback_text,
+)
+from llm import LLMFallback
+from plans import PlanRunner, text_step
+from reminders import ReminderStore
+from rules import HISTORY_FIELD, RuleStore, apply_order
+from templates import render
+import metrics
+
 app = Flask(__name__)
 
 # -------------------------
@@ -32,7 +63,7 @@ app = Flask(__name__)
 # -------------------------
 PORT = int(os.getenv("PORT", "8000"))
 
-# PROMPT (corrigido sem aspas duplicadas)
+# PROMPT (corrigido sem aspas duplicadas); a base com os marcadores {saud}/{nome} sai pronta no import
 SYSTEM_PROMPT_TEMPLATE = (
     "Você é um assistente comercial curto e objetivo. "
     "Saudação curta: '{greeting}, {name}, tudo bem? Como posso ajudar?' (sem nome: '{greeting}, tudo bem? Como posso ajudar?'). "
@@ -53,48 +84,57 @@ SYSTEM_PROMPT_TEMPLATE = (
 # LLM (opcional, só se OPENAI_API_KEY estiver definido)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-try:
-    if OPENAI_API_KEY:
-        from openai import OpenAI
-        _oai_client = OpenAI(api_key=OPENAI_API_KEY)
-    else:
-        _oai_client = None
-except Exception:
-    _oai_client = None
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "").strip()  # servidor compatível (vLLM, Ollama, fake de teste)
 
-TZ_OFFSET = int(os.getenv("TZ_OFFSET_MINUTES", "-180"))  # Brazil default -03:00
-TZ = timezone(timedelta(minutes=TZ_OFFSET))
+def _openai_client():
+    # chamado pelo LLMFallback na primeira pergunta: o SDK (~0,5s de import) fica fora do boot
+    from openai import OpenAI
+    return OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL or None)
 
 # Z-API (obrigatório)
 ZAPI_INSTANCE = os.getenv("ZAPI_INSTANCE", "").strip()
 ZAPI_TOKEN = os.getenv("ZAPI_TOKEN", "").strip()
 ZAPI_CLIENT_TOKEN = os.getenv("ZAPI_CLIENT_TOKEN", "").strip()
-ZAPI_BASE = f"https://api.z-api.io/instances/{ZAPI_INSTANCE}/token/{ZAPI_TOKEN}".rstrip("/")
+# ZAPI_BASE_URL sobrescreve a URL (ex.: stub local dos benchmarks)
+ZAPI_BASE = (os.getenv("ZAPI_BASE_URL") or f"https://api.z-api.io/instances/{ZAPI_INSTANCE}/token/{ZAPI_TOKEN}").rstrip("/")
 
 # Verificação simples do webhook inbound da Z-API
 WEBHOOK_VERIFY_TOKEN = os.getenv("WEBHOOK_VERIFY_TOKEN", "changeme")
 
+# Consultas administrativas (/delivery/<phone>: histórico do cliente); sem ADMIN_TOKEN ficam desligadas
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()
+
 # Cartpanda HMAC (opcional, recomendado)
 CARTPANDA_SIG_HEADER = os.getenv("CARTPANDA_SIG_HEADER", "X-Cartpanda-Signature")
 CARTPANDA_HMAC_SECRET = os.getenv("CARTPANDA_HMAC_SECRET", "").strip()
 
 # Redis (obrigatório)
-from redis import Redis
+import keyschema
+from userctx import CountingRedis, LazyRedis, UserContext, reset_round_trips, round_trips
 
 REDIS_URL = os.getenv("REDIS_URL", "").strip()
-if not REDIS_URL:
-    raise RuntimeError("REDIS_URL não definido")
 
-r = Redis.from_url(REDIS_URL, decode_responses=True)
 
-@app.route("/health", methods=["GET"])
-def health():
-    try:
-        r.ping()
-        return jsonify(ok=True), 200
-    except Exception as e:
-        return jsonify(ok=False, error=str(e)), 500
+def check_config():
+    if not REDIS_URL:
+        raise RuntimeError("REDIS_URL não definido")
+
+
+def _redis_client():
+    check_config()
+    return CountingRedis.from_url(REDIS_URL, decode_responses=True)
+
 
+r = LazyRedis(_redis_client)
+
+# Fila de envios (true = webhooks enfileiram; false = envio inline, sem dispatcher)
+from outbox import RedisOutbox, make_job
+
+OUTBOUND_QUEUE = os.getenv("OUTBOUND_QUEUE", "true").strip().lower() in ("1", "true", "yes")
+outbox = RedisOutbox(r)
+delivery = DeliveryStore(r)
+reminders = ReminderStore(r)
+broadcasts = BroadcastStore(r)
 
 # Anti-repetição e upsell
 UPSELL_COOLDOWN_HOURS = int(os.getenv("UPSELL_COOLDOWN_HOURS", "24"))
@@ -104,297 +144,363 @@ SENT_TTL_MIN = int(os.getenv("SENT_TTL_MIN", "90"))
 RL_PER_MIN = int(os.getenv("RL_PER_MIN", "40"))
 RL_PER_HOUR = int(os.getenv("RL_PER_HOUR", "600"))
 
-# Upsell simples
-UPSELL_RULES = {
-    "*Tabib - Volume 1": "*Tabib - Volume 2",
-    "*Tabib - Volume 2": "*Tabib - Volume 3",
-    "*Tabib - Volume 3": "*Tabib - Volume 4",
-    "*Tabib - Volume 4": "*TABIB KIDS",
-    "*TABIB KIDS": "*Balsamo - Pomadas naturais",
-}
+from ratelimit import RateLimiter
 
-# Entrega fallback por handle → link
-DRIVE_FALLBACK = json.loads(os.getenv("DRIVE_FALLBACK_JSON", "{}"))
+limiter = RateLimiter(r, RL_PER_MIN, RL_PER_HOUR)
 
-# -------------------------
-# Copys (última versão enviada)
-# -------------------------
-COPY_SAUDACAO = "{saud}, {nome}. Como posso te ajudar?"
-COPY_RETOMAR = "{saud}, {nome}! Aqui está seu link para retomar: {link}"
-COPY_PIX = "{saud}, {nome}! Seu PIX ficou pendente. Link: {link}\nCódigo PIX:\n{pix_code}"
-COPY_ENTREGA = "{saud}, {nome}! Obrigado pela compra {order}. Acesso: {digital}"
-COPY_NAO_RECEBI_ASK = "{saud}, {nome}. Envie o nº do pedido (ex.: #73644) ou um print do e-mail para eu localizar e reenviar."
-COPY_UPSELL = "Oferta única hoje: {oferta}. Quer aproveitar?"
-COPY_UPSELL_NAO_QUERO = "Tudo bem. Promo única só hoje. Se mudar de ideia, estou à disposição."
-COPY_RETORNO = "{saud}, {nome}! Que bom te ver de volta. Segue o link para retomar: {link}"
-COPY_FALLBACK = "{saud}, {nome}. Posso: retomar carrinho, pagar PIX ou reenviar o ebook. Diga 'retomar', 'PIX' ou mande o nº do pedido."
-
-# Respostas diretas de política (gatilhos)
-COPY_ENTREGA_DIGITAL = "É 100% digital. Você recebe por e-mail/WhatsApp após o pagamento."
-COPY_SEGURANCA = "Checkout HTTPS com PSP oficial. Nunca pedimos senhas/códigos."
-COPY_PAGAMENTO_TRAVOU = "Em que etapa travou? PIX, cartão ou boleto?"
-COPY_INSTAGRAM = "Tem bônus após seguir e comentar 3 posts no Instagram. Qual seu @ para validar?"
+# Catálogo (PRODUCTS_JSON_PATH; recarrega quando o arquivo muda)
+catalog = Catalog()
+
+# Regras de upsell e links de entrega por SKU/handle (rules.py; Redis → RULES_JSON_PATH → padrão)
+rules = RuleStore(r, catalog)
+
+# Lista de abandonados: escrita em pipelines de N carrinhos; stream opcional (requer ijson)
+ABANDONED_BATCH_SIZE = int(os.getenv("ABANDONED_BATCH_SIZE", "500"))
+ABANDONED_STREAM = os.getenv("ABANDONED_STREAM", "false").strip().lower() in ("1", "true", "yes")
+ABANDONED_STREAM_MIN_BYTES = int(os.getenv("ABANDONED_STREAM_MIN_BYTES", str(1024 * 1024)))
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 # -------------------------
 # Utilitários
 # -------------------------
-app = Flask(__name__)
-
-def now():
-    return datetime.now(TZ)
-
-def saudacao():
-    h = now().hour
-    if 5 <= h <= 11:
-        return "Bom dia"
-    if 12 <= h <= 17:
-        return "Boa tarde"
-    return "Boa noite"
-
-def normalize_phone(raw: str) -> str:
-    import re
-    d = re.sub(r"\D+", "", raw or "")
-    if d.startswith("55") and len(d) >= 12: return d
-    if len(d) in (10,11): return "55"+d
-    return d
-
-def first_nonempty(*vals):
-    for v in vals:
-        if isinstance(v, str) and v.strip():
-            return v.strip()
-        if v:
-            return v
-    return ""
-
 def sent_guard(phone: str, key: str, ttl_min: int = SENT_TTL_MIN) -> bool:
-    k = f"sent:{phone}:{key}"
-    nx = r.set(k, "1", ex=ttl_min * 60, nx=True)
-    return bool(nx)
+    return UserContext(r, phone, guards=[key], guard_ttl_min=ttl_min, load=False).guard(key)
 
 def set_user(phone: str, **fields):
-    if not phone:
-        return
-    key = f"user:{phone}"
-    if fields:
-        r.hset(key, mapping={k: v for k, v in fields.items() if v is not None})
-
-def get_user(phone: str) -> dict:
-    if not phone:
-        return {}
-    return r.hgetall(f"user:{phone}") or {}
-
-def block_upsell(phone: str):
-    r.setex(f"upsell_block:{phone}", UPSELL_COOLDOWN_HOURS * 3600, "1")
-
-def upsell_allowed(phone: str) -> bool:
-    return r.get(f"upsell_block:{phone}") is None
-
-def find_upsell_for_titles(titles):
-    for t in titles:
-        if t in UPSELL_RULES:
-            return UPSELL_RULES[t]
-    return None
+    fields = {k: v for k, v in fields.items() if v is not None}
+    if phone and fields:
+        p = r.pipeline(transaction=False)
+        keyschema.queue_profile(p, phone, fields)
+        p.execute()
 
 def rate_limit_ok(phone: str) -> bool:
-    m1 = f"rl:1m:{phone}"
-    m60 = f"rl:60m:{phone}"
-    c1 = r.incr(m1)
-    c60 = r.incr(m60)
     try:
-        r.expire(m1, 60)
-        r.expire(m60, 3600)
+        return limiter.allow(phone)
     except Exception:
-        pass
-    return c1 <= RL_PER_MIN and c60 <= RL_PER_HOUR
+        return True  # Redis fora não deve calar o atendimento
 
-def verify_cartpanda_hmac(raw_body: bytes, signature: str) -> bool:
-    if not CARTPANDA_HMAC_SECRET:
-        return True
-    if not signature:
-        return False
-    mac = hmac.new(CARTPANDA_HMAC_SECRET.encode(), msg=raw_body, digestmod=hashlib.sha256).hexdigest()
+def read_body(secret: str = ""):
+    """Corpo lido numa passada (HMAC + sha256 + JSON); 413 acima de MAX_BODY_BYTES."""
     try:
-        return hmac.compare_digest(mac, signature)
-    except Exception:
-        return mac == signature
+        return read_stream(request.stream, secret, request.content_length)
+    except BodyTooLarge:
+        abort(413)
 
 def idempotent_event_seen(evt_id: str) -> bool:
+    """True = já visto (set por bloco de horas, keyschema.py)."""
     if not evt_id:
         return False
-    k = f"evt:{evt_id}"
-    nx = r.set(k, "1", ex=24 * 3600, nx=True)
-    return not bool(nx)  # True = já visto
-
-def retry_post(url, headers=None, json_body=None, tries=3, base=0.4, cap=3.0, timeout=20):
-    last = None
-    for i in range(tries):
-        try:
-            resp = requests.post(url, headers=headers or {}, json=json_body, timeout=timeout)
-            return resp
-        except Exception as e:
-            last = e
-            time.sleep(min(cap, base * (2 ** i)) + random.random() * 0.2)
-    raise last
+    p = r.pipeline(transaction=False)
+    keyschema.queue_event_seen(p, evt_id)
+    return keyschema.event_seen(p.execute())
+
+# Sessão HTTP com pool keep-alive (uma por processo; recriada após fork do gunicorn)
+ZAPI_POOL_SIZE = int(os.getenv("ZAPI_POOL_SIZE", "20"))
+ZAPI_CONNECT_TIMEOUT = float(os.getenv("ZAPI_CONNECT_TIMEOUT", "3"))
+ZAPI_READ_TIMEOUT = float(os.getenv("ZAPI_READ_TIMEOUT", "15"))
+ZAPI_RETRIES = int(os.getenv("ZAPI_RETRIES", "2"))
+ZAPI_RETRY_STATUS = tuple(int(x) for x in os.getenv("ZAPI_RETRY_STATUS", "429,500,502,503,504").split(",") if x.strip())
+
+_http = None
+_http_pid = None
+
+def _build_http():
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # read=0: se a Z-API recebeu o POST e só a resposta se perdeu, não reenviamos (evita mensagem duplicada)
+    retry = Retry(
+        total=ZAPI_RETRIES,
+        connect=ZAPI_RETRIES,
+        read=0,
+        status=ZAPI_RETRIES,
+        backoff_factor=0.4,
+        status_forcelist=ZAPI_RETRY_STATUS,
+        allowed_methods=frozenset(["POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=ZAPI_POOL_SIZE, max_retries=retry)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers.update(_ZAPI_HEADERS)
+    return s
+
+def http_session():
+    global _http, _http_pid
+    if _http is None or _http_pid != os.getpid():
+        _http = _build_http()
+        _http_pid = os.getpid()
+    return _http
+
+def retry_post(url, headers=None, json_body=None, timeout=None):
+    # retries (conexão, 429/5xx com Retry-After) ficam no adapter da sessão
+    resp = http_session().post(
+        url,
+        headers=headers,
+        json=json_body,
+        timeout=timeout or (ZAPI_CONNECT_TIMEOUT, ZAPI_READ_TIMEOUT),
+    )
+    retries = getattr(getattr(resp.raw, "retries", None), "history", None)
+    if retries:
+        metrics.count_retries("http", len(retries))
+    return resp
+
+def _timed(kind):
+    """Mede a latência de um envio à Z-API (metrics.zapi_send_seconds)."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not metrics.ENABLED:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            res = fn(*args, **kwargs)
+            metrics.observe_zapi(kind, res, time.perf_counter() - t0)
+            return res
+        return wrapper
+    return deco
 
 # -------------------------
 # Z-API send
 # -------------------------
-def _zapi_headers():
-    return {
-        "Client-Token": ZAPI_CLIENT_TOKEN,
-        "Content-Type": "application/json",
-    }
+_ZAPI_HEADERS = {
+    "Client-Token": ZAPI_CLIENT_TOKEN,
+    "Content-Type": "application/json",
+}
 
-def zapi_send_text(phone: str, text: str) -> dict:
-    url = f"{ZAPI_BASE}/send-text"
-    payload = {"phone": phone, "message": text}
-    try:
-        resp = retry_post(url, headers=_zapi_headers(), json_body=payload)
+# Várias instâncias (números) com hash consistente por telefone, limite e failover (zapi_pool.py)
+from zapi_pool import ZapiPool, error_result, load_instances
+
+zapi_pool = ZapiPool(load_instances(os.getenv("ZAPI_INSTANCES_JSON", ""), ZAPI_BASE, ZAPI_CLIENT_TOKEN))
+
+def _connect_failed(e: Exception) -> bool:
+    # Só erro na conexão garante que a Z-API não recebeu o POST; ConnectionError do requests também
+    # cobre conexão caída depois do envio (ProtocolError), que fica como entrega incerta
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(e, requests.exceptions.ConnectionError) and e.args:
+        reason = getattr(e.args[0], "reason", e.args[0])
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+    return False
+
+def _zapi_post(phone: str, path: str, payload: dict) -> dict:
+    def post(inst):
         try:
-            data = resp.json()
-        except Exception:
-            data = {"status_code": resp.status_code, "text": resp.text}
-        return {"ok": resp.status_code < 300, "status": resp.status_code, "data": data}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+            resp = retry_post(f"{inst.base}/{path}", headers=inst.headers, json_body=payload)
+            try:
+                data = resp.json()
+            except Exception:
+                data = {"status_code": resp.status_code, "text": resp.text}
+            return {"ok": resp.status_code < 300, "status": resp.status_code, "data": data}
+        except Exception as e:
+            return error_result(e, _connect_failed(e))
+    return zapi_pool.send(phone, post)
 
+@_timed("text")
+def zapi_send_text(phone: str, text: str) -> dict:
+    return _zapi_post(phone, "send-text", {"phone": phone, "message": text})
+
+@_timed("image")
 def zapi_send_image(phone: str, image_url: str, caption: str = "") -> dict:
     if not (image_url or "").lower().startswith("http"):
         return {"ok": False, "error": "invalid_image_url"}
-    url = f"{ZAPI_BASE}/send-image"
-    payload = {"phone": phone, "image": image_url, "caption": caption}
-    try:
-        resp = retry_post(url, headers=_zapi_headers(), json_body=payload)
-        data = resp.json() if "application/json" in resp.headers.get("content-type", "") else {"text": resp.text}
-        return {"ok": resp.status_code < 300, "status": resp.status_code, "data": data}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+    return _zapi_post(phone, "send-image", {"phone": phone, "image": image_url, "caption": caption})
 
+@_timed("file")
 def zapi_send_file(phone: str, file_url: str, caption: str = "") -> dict:
     if not (file_url or "").lower().startswith("http"):
         return {"ok": False, "error": "invalid_file_url"}
-    url = f"{ZAPI_BASE}/send-file"
-    payload = {"phone": phone, "file": file_url, "caption": caption}
+    return _zapi_post(phone, "send-file", {"phone": phone, "file": file_url, "caption": caption})
+
+def _send_inline(phone: str, text: str, key: str = "") -> dict:
+    res = zapi_send_text(phone, text)
+    message_id = (res.get("data") or {}).get("messageId") if res.get("ok") else None
+    if message_id:
+        try:
+            delivery.record_sent(phone, message_id, key=key)
+        except Exception:
+            pass
+    return res
+
+def send_text(phone: str, text: str, key: str = "") -> dict:
+    """key = guard do envio (ex.: "paid:123"), gravado no rastreamento de entrega."""
+    if not OUTBOUND_QUEUE:
+        return _send_inline(phone, text, key)
+    try:
+        return {"ok": True, "queued": outbox.push(make_job("text", phone, text=text, key=key))}
+    except Exception as e:
+        # Redis fora: melhor enviar inline do que perder a mensagem
+        return _send_inline(phone, text, key) | {"queue_error": str(e)}
+
+def _record_sent(job: dict, res: dict):
+    # on_sent dos planos sem fila: mesmo rastreamento do dispatcher.delivery_recorder
+    message_id = (res.get("data") or {}).get("messageId")
+    if message_id:
+        delivery.record_sent(job["phone"], message_id, key=(job.get("payload") or {}).get("key", ""),
+                             job_id=job["id"], kind=job["kind"])
+
+plan_runner = PlanRunner({"text": zapi_send_text, "image": zapi_send_image, "file": zapi_send_file},
+                         on_sent=_record_sent)
+
+def send_plan(phone: str, steps) -> dict:
+    """
+    Mensagens em sequência para um telefone (plans.py). Com fila: um job "plan" (ordem garantida
+    mesmo com vários dispatchers); sem fila: PlanRunner, em paralelo com outros telefones.
+    """
+    steps = [s for s in steps if s]
+    if not steps:
+        return {"ok": True, "steps": 0}
+    if len(steps) == 1 and steps[0]["kind"] == "text":
+        return send_text(phone, steps[0]["text"], key=steps[0].get("key", ""))
+    if not OUTBOUND_QUEUE:
+        return {"ok": True, "plan": plan_runner.submit(phone, steps)}
     try:
-        resp = retry_post(url, headers=_zapi_headers(), json_body=payload)
-        data = resp.json() if "application/json" in resp.headers.get("content-type", "") else {"text": resp.text}
-        return {"ok": resp.status_code < 300, "status": resp.status_code, "data": data}
+        return {"ok": True, "queued": outbox.push(make_job("plan", phone, steps=steps))}
     except Exception as e:
-        return {"ok": False, "error": str(e)}
+        return {"ok": True, "plan": plan_runner.submit(phone, steps), "queue_error": str(e)}
 
 # -------------------------
 # App & helpers
 # -------------------------
-app = Flask(__name__)
-
-def greet_name_for(phone: str) -> str:
-    u = get_user(phone)
-    nm = first_nonempty(u.get("name"), "cliente").split()[0]
-    return nm
+# Fallback com LLM (opcional; só com OPENAI_API_KEY)
+_PROMPT_BASE = SYSTEM_PROMPT_TEMPLATE.format(greeting="{saud}", name="{nome}")
+_prompt_cache = (None, "")
+
+def llm_system_prompt() -> str:
+    """Prompt com a lista de produtos; remontado só quando o catálogo recarrega."""
+    global _prompt_cache
+    products = catalog.products()
+    if _prompt_cache[0] is not products:
+        prods = "\n".join(f"- {p.get('name', '')}: {p.get('description', '')} Checkout: {p.get('checkout', '')}"
+                          for p in products)
+        _prompt_cache = (products, _PROMPT_BASE + ("\nProdutos:\n" + prods if prods else ""))
+    return _prompt_cache[1]
+
+llm = LLMFallback(r, _openai_client if OPENAI_API_KEY else None, OPENAI_MODEL, llm_system_prompt)
+debouncer = Debouncer(r)
+
+def new_user_context(phone: str, guards=(), load: bool = True) -> UserContext:
+    return UserContext(r, phone, guards=guards, guard_ttl_min=SENT_TTL_MIN, load=load,
+                       upsell_cooldown_hours=UPSELL_COOLDOWN_HOURS)
+
+def user_context(phone: str, guards=(), load: bool = True) -> UserContext:
+    """UserContext da requisição atual; gravado em um pipeline no after_request."""
+    ctx = new_user_context(phone, guards, load)
+    g.setdefault("user_ctxs", []).append(ctx)
+    return ctx
+
+@app.before_request
+def _reset_round_trips():
+    reset_round_trips()
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def _flush_user_ctx(resp):
+    for ctx in g.pop("user_ctxs", []):
+        ctx.flush()
+    resp.headers["X-Redis-Round-Trips"] = str(round_trips())
+    if request.url_rule is not None:
+        metrics.observe_handler(request.url_rule.rule, time.perf_counter() - g.t0)
+    return resp
+
+def ingest_abandoned_carts(carts, batch_size: int = ABANDONED_BATCH_SIZE) -> dict:
+    """Grava perfis/últimos carrinhos em pipelines de batch_size (1 round trip por lote)."""
+    count = 0
+    batch_ms = []
+    p = r.pipeline(transaction=False)
+    pending = 0
+    t0 = time.perf_counter()
+    for c in carts:
+        row = cart_row(c)
+        if row is None:
+            continue
+        phone, name, cart_url = row
+        keyschema.queue_profile(p, phone, {"name": name, "last_cart": cart_url})
+        count += 1
+        pending += 1
+        if pending >= batch_size:
+            p.execute()
+            batch_ms.append(round((time.perf_counter() - t0) * 1000, 1))
+            pending = 0
+            t0 = time.perf_counter()
+    if pending:
+        p.execute()
+        batch_ms.append(round((time.perf_counter() - t0) * 1000, 1))
+    return {"count": count, "batches": len(batch_ms), "batch_ms": batch_ms}
 
 # -------------------------
 # Cartpanda Webhook
 # -------------------------
 @app.post("/webhook/cartpanda")
 def webhook_cartpanda():
-    raw = request.get_data() or b""
-    sig = request.headers.get(CARTPANDA_SIG_HEADER, "")
-    if not verify_cartpanda_hmac(raw, sig):
+    body = read_body(CARTPANDA_HMAC_SECRET)
+    if not body.hmac_ok(request.headers.get(CARTPANDA_SIG_HEADER, "")):
         abort(401)
+    raw = body.raw
+
+    # Lista grande: itera os carrinhos direto dos bytes, sem montar o JSON inteiro
+    if ABANDONED_STREAM and ijson and len(raw) >= ABANDONED_STREAM_MIN_BYTES and b'"abandoned_carts"' in raw[:4096]:
+        if idempotent_event_seen(body.sha256[:40]):
+            metrics.count_duplicate("cartpanda")
+            return jsonify({"ok": True, "dup": True})
+        res = ingest_abandoned_carts(ijson.items(raw, "abandoned_carts.data.item"))
+        return jsonify({"ok": True, "mode": "abandoned_list", "stream": True, **res})
 
-    data = request.get_json(silent=True) or {}
+    data = body.json()
     event = data.get("event") or data.get("type") or ""
     # idempotência
-    evt_id = str(
-        data.get("id")
-        or (data.get("webhook") or {}).get("id")
-        or (data.get("order") or {}).get("id")
-        or hashlib.sha256(raw).hexdigest()[:40]
-    )
-    if idempotent_event_seen(evt_id):
+    if idempotent_event_seen(event_id(data, body.sha256)):
+        metrics.count_duplicate("cartpanda")
         return jsonify({"ok": True, "dup": True})
 
     # ---- Lista de abandonados (payload grande)
     if isinstance((data.get("abandoned_carts") or {}).get("data"), list):
-        carts = data["abandoned_carts"]["data"]
-        count = 0
-        for c in carts:
-            cust = c.get("customer") or {}
-            phone = normalize_phone(first_nonempty(cust.get("phone"), cust.get("phone_ext")))
-            cart_token = c.get("cart_token") or ""
-            cart_url = c.get("cart_url") or ""
-            if not phone or not cart_token:
-                continue
-            name = first_nonempty(cust.get("first_name"), cust.get("full_name"), "cliente").split()[0]
-            set_user(phone, name=name, last_cart=cart_url)
-            r.set(f"last_cart_by_phone:{phone}", cart_url)
-            count += 1
-        return jsonify({"ok": True, "mode": "abandoned_list", "count": count})
+        res = ingest_abandoned_carts(data["abandoned_carts"]["data"])
+        return jsonify({"ok": True, "mode": "abandoned_list", **res})
 
     # ---- Eventos principais
-    if event in ("order.paid", "order.created"):
-        order = data.get("order", {}) or {}
-        phone = normalize_phone(first_nonempty(order.get("phone"), (order.get("customer") or {}).get("phone")))
-        name = first_nonempty((order.get("customer") or {}).get("first_name"),
-                              (order.get("customer") or {}).get("full_name"),
-                              "cliente").split()[0]
-        if phone:
-            set_user(phone, name=name)
-
-        # PIX pendente
-        if event == "order.created" and str(order.get("payment_status")) in ("1", "pending"):
-            link = order.get("checkout_link") or ""
-            px = (order.get("payment") or {}).get("pix_code") or order.get("pix_code") or ""
-            if phone:
-                set_user(phone, last_pix_link=link, last_pix_code=px)
-                key = f"pix:{order.get('order_number')}"
-                if rate_limit_ok(phone) and sent_guard(phone, key):
-                    msg = COPY_PIX.format(saud=saudacao(), nome=name, link=link, pix_code=px or "(código indisponível)")
-                    zapi_send_text(phone, msg)
+    if event in ORDER_EVENTS:
+        plan = order_plan(data, event, rules.current())
+        phone, kind, key = plan["phone"], plan["kind"], plan["key"]
+        # perfil + bloqueio de upsell + guard de envio num único round trip
+        ctx = user_context(phone, guards=[key] if kind else (), load=kind == "paid")
+        ctx.set(name=plan["name"])
+        if kind and phone:
+            ctx.set(**plan["profile"])
+            steps = []
+            if not rate_limit_ok(phone):
+                metrics.count_rate_limited("cartpanda")
+            elif ctx.guard(key) and not delivery.already_delivered(phone, key):
+                if kind == "pix":
+                    send_text(phone, plan["message"], key=key)
+                    reminders.schedule_pix(phone, key.split(":", 1)[1], plan["name"],
+                                           plan["profile"]["last_pix_link"], plan["profile"]["last_pix_code"])
+                else:
+                    steps += plan["steps"]
+            offer = None
+            if kind == "paid":
+                reminders.cancel(phone)
+                offer, bought = apply_order(rules.current(), plan["items"], ctx.user)
+                ctx.set(**{HISTORY_FIELD: bought})
+            # upsell: último passo do plano, depois da entrega
+            if offer and ctx.upsell_allowed:
+                ctx.block_upsell()
+                steps.append(text_step(render("COPY_UPSELL", oferta=offer["text"])))
+            send_plan(phone, steps)
+        if kind:
             return jsonify({"ok": True})
 
-        # Pago → entregar + upsell
-        if event == "order.paid" or str(order.get("payment_status")) in ("3", "paid"):
-            order_no = first_nonempty(order.get("public_id"), f"#{order.get('order_number')}")
-            digital = order.get("digital_attachment") or ""
-            if not digital:
-                # tenta por handle do produto com fallback
-                items = order.get("line_items", []) or []
-                for it in items:
-                    prod = it.get("product_images_info") or {}
-                    handle = prod.get("handle") or ""
-                    if handle and handle in DRIVE_FALLBACK:
-                        digital = DRIVE_FALLBACK[handle]
-                        break
-            if not digital:
-                digital = order.get("thank_you_page") or order.get("order_status_url") or ""
-            titles = []
-            for it in order.get("line_items", []) or []:
-                titles.append(first_nonempty(it.get("title"), (it.get("variant") or {}).get("title")))
-            if phone:
-                set_user(phone, last_order=order_no, last_digital=digital, last_products="|".join(titles))
-                key = f"paid:{order.get('id')}"
-                if rate_limit_ok(phone) and sent_guard(phone, key):
-                    msg = COPY_ENTREGA.format(saud=saudacao(), nome=name, order=order_no, digital=digital or "(link indisponível)")
-                    zapi_send_text(phone, msg)
-                # upsell
-                if upsell_allowed(phone):
-                    oferta = find_upsell_for_titles(titles) if titles else None
-                    if oferta:
-                        block_upsell(phone)
-                        zapi_send_text(phone, COPY_UPSELL.format(oferta=oferta))
-            return jsonify({"ok": True})
-
-    elif event in ("abandoned.created", "cart.abandoned", "abandoned"):
-        payload = data.get("data", {}) or data
-        cust = first_nonempty(payload.get("customer"), payload.get("customer_info")) or {}
-        phone = normalize_phone(first_nonempty(cust.get("phone"), cust.get("phone_ext")))
-        name = first_nonempty(cust.get("first_name"), (cust.get("full_name") or "cliente").split()[0])
-        cart_url = payload.get("cart_url") or ""
+    elif event in ABANDONED_EVENTS:
+        phone, name, cart_url = abandoned_info(data)
         if phone:
-            set_user(phone, name=name, last_cart=cart_url)
-            r.set(f"last_cart_by_phone:{phone}", cart_url)
-        # Não enviar proativamente (guardamos para "retomar")
+            ctx = user_context(phone, load=False)
+            ctx.set(name=name, last_cart=cart_url)
+            reminders.schedule_cart(phone, name, cart_url)
+        # Nada na hora (guardamos para "retomar"); lembretes agendados saem pelo reminders.py
         return jsonify({"ok": True})
 
     return jsonify({"ignored": True})
@@ -408,140 +514,161 @@ def webhook_zapi_inbound():
     if token != WEBHOOK_VERIFY_TOKEN:
         abort(403)
 
-    body = request.get_json(silent=True) or {}
-
-    phone = normalize_phone(
-        first_nonempty(
-            body.get("phone"),
-            (body.get("message") or {}).get("phone"),
-            ((body.get("data") or {}).get("message") or {}).get("from"),
-            (body.get("sender") or {}).get("phone"),
-            (body.get("payload") or {}).get("phone"),
-        )
-    )
-    text = first_nonempty(
-        body.get("messageText"),
-        (body.get("message") or {}).get("message"),
-        (body.get("message") or {}).get("text"),
-        (body.get("data") or {}).get("text"),
-        body.get("text"),
-        "",
-    ).strip()
-
+    body = read_body().json()
+    phone, text = parse_inbound(body)
     if not phone or not text:
         return jsonify({"ok": True, "note": "sem phone/text"})
 
+    # Rajadas: bufferiza e responde uma vez pelo poller do debounce
+    if debouncer.enabled:
+        debouncer.start(answer_inbound)  # no-op se o create_app() já subiu o poller neste processo
+        debouncer.push(phone, text)
+        return jsonify({"ok": True, "debounced": True})
+    return jsonify(answer_inbound(phone, text))
+
+def answer_inbound(phone: str, text: str) -> dict:
+    """
+    Responde uma mensagem (ou a rajada concatenada): rate limit, intenção, LLM, envio.
+    "ok" = a resposta foi enfileirada/enviada (o debounce só descarta a rajada nesse caso).
+    """
     if not rate_limit_ok(phone):
-        zapi_send_text(phone, "Recebi muitas mensagens. Vou responder por partes, combinado?")
-        return jsonify({"ok": True, "rate_limited": True})
-
-    user = get_user(phone)
-    name = first_nonempty(user.get("name"), "cliente").split()[0]
-    low = text.lower()
-
-    # Intenções chave
-    if any(k in low for k in ["retomar", "continuar", "não desisti", "nao desisti", "seguir", "finalizar"]):
-        link = first_nonempty(user.get("last_pix_link"), user.get("last_cart"))
-        msg = COPY_RETOMAR.format(saud=saudacao(), nome=name, link=link or "(link não encontrado)")
-        zapi_send_text(phone, msg)
-        return jsonify({"ok": True})
-
-    if any(k in low for k in ["pix", "pagar", "pendente"]):
-        link = user.get("last_pix_link")
-        px = user.get("last_pix_code") or ""
-        if link:
-            msg = COPY_PIX.format(saud=saudacao(), nome=name, link=link, pix_code=px or "(sem código)")
-        else:
-            msg = f"{saudacao()}, {name}. Não encontrei PIX pendente. Diga 'retomar' para recuperar o carrinho."
-        zapi_send_text(phone, msg)
-        return jsonify({"ok": True})
-
-    if any(k in low for k in ["não quero", "nao quero", "agora não", "agora nao"]):
-        block_upsell(phone)
-        zapi_send_text(phone, COPY_UPSELL_NAO_QUERO)
-        return jsonify({"ok": True})
-
-    if any(k in low for k in ["não recebi", "nao recebi", "não chegou", "nao chegou", "ebook", "produto", "acesso"]):
-        digital = user.get("last_digital")
-        if digital:
-            msg = COPY_ENTREGA.format(saud=saudacao(), nome=name, order=user.get("last_order", "#?"), digital=digital)
-        else:
-            msg = COPY_NAO_RECEBI_ASK.format(saud=saudacao(), nome=name)
-        zapi_send_text(phone, msg)
-        return jsonify({"ok": True})
-
-    # Frete/entrega/rastreio
-    if any(k in low for k in ["frete", "entrega", "prazo", "rastreio", "rastreamento", "correio", "correios", "endereço", "endereco"]):
-        zapi_send_text(phone, COPY_ENTREGA_DIGITAL)
-        return jsonify({"ok": True})
-
-    # Segurança
-    if any(k in low for k in ["segurança", "seguranca", "golpe", "fraude", "medo"]):
-        zapi_send_text(phone, COPY_SEGURANCA)
-        return jsonify({"ok": True})
-
-    # Pagamento travou
-    if any(k in low for k in ["travou", "não consegui pagar", "nao consegui pagar", "erro no pagamento", "cartão", "cartao", "boleto"]):
-        zapi_send_text(phone, COPY_PAGAMENTO_TRAVOU)
-        return jsonify({"ok": True})
-
-    # Instagram/engajamento
-    if any(k in low for k in ["instagram", "comentar", "comentário", "comentario", "seguir", "post", "@"]):
-        zapi_send_text(phone, COPY_INSTAGRAM)
-        return jsonify({"ok": True})
-
-    # Número do pedido (#12345)
-    m = re.search(r"#?\s*(\d{3,})", low)
-    if m:
-        digital = user.get("last_digital")
-        if digital:
-            msg = COPY_ENTREGA.format(saud=saudacao(), nome=name, order=f"#{m.group(1)}", digital=digital)
-        else:
-            msg = COPY_NAO_RECEBI_ASK.format(saud=saudacao(), nome=name)
-        zapi_send_text(phone, msg)
-        return jsonify({"ok": True})
-
-    # Saudações
-    if any(k in low for k in ["oi", "olá", "ola", "bom dia", "boa tarde", "boa noite", "oie", "oii"]):
-        zapi_send_text(phone, COPY_SAUDACAO.format(saud=saudacao(), nome=name))
-        return jsonify({"ok": True})
-
-    # Fallback curto
-    zapi_send_text(phone, COPY_FALLBACK.format(saud=saudacao(), nome=name))
-    return jsonify({"ok": True})
-
-# Status de mensagens da Z-API (opcional)
+        metrics.count_rate_limited("inbound")
+        res = send_text(phone, COPY_RATE_LIMITED)
+        return {"ok": bool(res.get("ok")), "rate_limited": True}
+
+    ctx = new_user_context(phone)
+    reply = inbound_reply(ctx.user, text, catalog)
+    metrics.count_intent(reply["intent"])
+    if reply["block_upsell"]:
+        ctx.block_upsell()
+
+    # Sem regra: LLM dentro do orçamento de latência, senão a copy curta
+    msg = reply["text"] or llm.answer(text, saudacao(), reply["name"]) or fallback_text(reply["name"])
+    res = send_text(phone, msg)
+    ctx.flush()
+    if reply.get("sku"):
+        return {"ok": bool(res.get("ok")), "sku": reply["sku"]}
+    return {"ok": bool(res.get("ok"))}
+
+# Status de mensagens da Z-API (SENT/RECEIVED/READ...) → delivery.py
 @app.post("/webhook/zapi/status")
 def webhook_zapi_status():
     token = request.args.get("t") or request.headers.get("X-Webhook-Token", "")
     if token != WEBHOOK_VERIFY_TOKEN:
         abort(403)
-    _ = request.get_json(silent=True) or {}
-    # apenas logar se quiser:
-    # print("ZAPI STATUS:", _)
-    return jsonify({"ok": True})
+    body = read_body().json()
+    events = parse_status(body, normalize_phone)
+    metrics.observe_delivery(delivery.record_statuses(events))
+    return jsonify({"ok": True, "updated": len(events)})
+
+# Tokens das APIs administrativas: só em cabeçalho (Authorization: Bearer ... ou X-*-Token)
+def bearer_token_ok(header_auth: str, header_token: str, expected: str) -> bool:
+    token = header_token or (header_auth[7:] if header_auth.startswith("Bearer ") else "")
+    return bool(expected) and hmac.compare_digest(token.encode(), expected.encode())
+
+def admin_token_ok(header_auth: str, header_token: str) -> bool:
+    return bearer_token_ok(header_auth, header_token, ADMIN_TOKEN)
+
+# Estado de entrega por telefone (últimas mensagens + guards já entregues)
+@app.get("/delivery/<phone>")
+def delivery_state(phone):
+    if not admin_token_ok(request.headers.get("Authorization", ""), request.headers.get("X-Admin-Token", "")):
+        abort(403)
+    limit = min(request.args.get("limit", 20, type=int), 100)
+    return delivery.phone_state(normalize_phone(phone), limit)
+
+# Campanhas (broadcast.py): criadas aqui, enviadas pelo worker "python broadcast.py"
+def broadcast_token_ok(header_auth: str, header_token: str) -> bool:
+    return bearer_token_ok(header_auth, header_token, BROADCAST_TOKEN)
+
+def _require_broadcast_token():
+    if not broadcast_token_ok(request.headers.get("Authorization", ""), request.headers.get("X-Broadcast-Token", "")):
+        abort(403)
+
+@app.post("/broadcast")
+def broadcast_create():
+    _require_broadcast_token()
+    data = read_body().json()
+    try:
+        c = broadcasts.create(data.get("template") or "", data.get("filters"), data.get("vars"),
+                              data.get("rate") or BROADCAST_RATE_PER_SECOND, data.get("name") or "",
+                              data.get("skip_blocked", True) is not False)
+    except (TypeError, ValueError) as e:
+        return {"ok": False, "error": str(e)}, 400
+    return {"ok": True, "campaign": c}, 201
+
+@app.get("/broadcast")
+def broadcast_list():
+    _require_broadcast_token()
+    return {"campaigns": broadcasts.list(min(request.args.get("limit", 50, type=int), 200))}
+
+@app.get("/broadcast/<cid>")
+def broadcast_get(cid):
+    _require_broadcast_token()
+    c = broadcasts.get(cid)
+    if c is None:
+        return {"ok": False, "error": "campanha não encontrada"}, 404
+    return {"ok": True, "campaign": c}
+
+@app.post("/broadcast/<cid>/<action>")
+def broadcast_action(cid, action):
+    _require_broadcast_token()
+    res = broadcasts.apply(cid, action)
+    return res, 200 if res["ok"] else (404 if "error" in res else 409)
 
 # -------------------------
 # Health e root
 # -------------------------
 @app.get("/health")
 def health():
+    # liveness: só diz que o processo atende; nada de I/O (Redis fora não deve reiniciar o worker)
+    return {"ok": True, "time": now().isoformat()}
+
+@app.get("/ready")
+def ready():
+    # readiness: Redis respondendo e catálogo carregado
     try:
         r.ping()
-        return {"ok": True, "time": now().isoformat()}
     except Exception as e:
-        return {"ok": False, "error": str(e)}, 500
+        return {"ok": False, "error": f"redis: {e}"}, 503
+    n = len(catalog.products())
+    if not n:
+        return {"ok": False, "error": "catálogo vazio"}, 503
+    return {"ok": True, "products": n}
+
+@app.get("/metrics")
+def metrics_endpoint():
+    body, ctype = metrics.render()
+    return Response(body, content_type=ctype)
 
 @app.get("/")
 def index():
     return {"service": "paginatto-agent",
-            "docs": ["/health", "/webhook/cartpanda", "/webhook/zapi/inbound", "/webhook/zapi/status"]}
+            "docs": ["/health", "/ready", "/metrics", "/webhook/cartpanda", "/webhook/zapi/inbound", "/webhook/zapi/status",
+                     "/delivery/<phone>", "/broadcast"]}
+
+# -------------------------
+# App factory
+# -------------------------
+def warm_up():
+    """Valida a config e aquece o que é só CPU/disco; conexões ficam para o 1º uso."""
+    check_config()
+    catalog.products()
+    llm_system_prompt()
+
+def create_app() -> Flask:
+    """Entrada do gunicorn (um app por worker, depois do fork)."""
+    warm_up()
+    if debouncer.enabled:
+        # rajadas que ficaram no Redis (restart/deploy) saem sem esperar nova mensagem
+        debouncer.start(answer_inbound)
+    return app
 
 # -------------------------
 # Main
 # -------------------------
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=PORT)
+    create_app().run(host="0.0.0.0", port=PORT)
 
 
 
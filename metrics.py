@@ -0,0 +1,106 @@
+# metrics.py
+#
+# Métricas Prometheus dos caminhos quentes (exportadas em /metrics).
+# - Desligadas com METRICS_ENABLED=false ou se prometheus_client não estiver instalado:
+#   as funções abaixo viram no-op (um if por chamada).
+# - gunicorn com vários workers: defina PROMETHEUS_MULTIPROC_DIR (diretório vazio e gravável)
+#   para somar as métricas de todos os processos.
+#
+import os
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+
+try:
+    import prometheus_client as prom
+except ImportError:
+    prom = None
+
+ENABLED = METRICS_ENABLED and prom is not None
+
+_FAST = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+_SLOW = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+if ENABLED:
+    HANDLER_SECONDS = prom.Histogram("webhook_handler_seconds", "Tempo do handler por rota", ["route"], buckets=_FAST + (2.5, 5, 10))
+    REDIS_SECONDS = prom.Histogram("redis_command_seconds", "Latência de comandos/pipelines Redis", ["command"], buckets=_FAST)
+    ZAPI_SECONDS = prom.Histogram("zapi_send_seconds", "Latência de envio à Z-API", ["kind", "outcome"], buckets=_SLOW)
+    ZAPI_RETRIES = prom.Counter("zapi_retries_total", "Retries de envio à Z-API", ["stage"])
+    INTENTS = prom.Counter("inbound_intent_total", "Intenções reconhecidas no inbound", ["intent"])
+    RATE_LIMITED = prom.Counter("rate_limited_total", "Mensagens barradas pelo rate limit", ["source"])
+    DUPLICATES = prom.Counter("idempotency_duplicates_total", "Webhooks repetidos descartados", ["source"])
+    ZAPI_FAILOVERS = prom.Counter("zapi_failover_total", "Instâncias Z-API tiradas do anel por falhas", ["instance"])
+    REMINDERS = prom.Counter("reminders_total", "Lembretes agendados processados", ["kind", "outcome"])
+    BROADCAST = prom.Counter("broadcast_total", "Destinatários de campanhas processados", ["outcome"])
+    DEBOUNCE = prom.Counter("debounce_bursts_total", "Rajadas do debounce respondidas/falhas/descartadas", ["outcome"])
+    DELIVERY_SECONDS = prom.Histogram("delivery_latency_seconds", "Envio → status (RECEIVED, READ...)", ["status"],
+                                      buckets=(1, 2, 5, 10, 30, 60, 300, 900, 3600, 6 * 3600, 24 * 3600))
+
+
+def observe_handler(route: str, seconds: float):
+    if ENABLED:
+        HANDLER_SECONDS.labels(route).observe(seconds)
+
+def observe_redis(command: str, seconds: float):
+    if ENABLED:
+        REDIS_SECONDS.labels(command).observe(seconds)
+
+def observe_zapi(kind: str, res: dict, seconds: float):
+    if ENABLED:
+        outcome = "ok" if res.get("ok") else ("error" if "status" not in res else str(res["status"])[0] + "xx")
+        ZAPI_SECONDS.labels(kind, outcome).observe(seconds)
+
+def count_retries(stage: str, n: int = 1):
+    if ENABLED and n:
+        ZAPI_RETRIES.labels(stage).inc(n)
+
+def count_failover(instance: str):
+    if ENABLED:
+        ZAPI_FAILOVERS.labels(instance).inc()
+
+def count_intent(intent):
+    if ENABLED:
+        INTENTS.labels(intent or "none").inc()
+
+def count_rate_limited(source: str):
+    if ENABLED:
+        RATE_LIMITED.labels(source).inc()
+
+def count_duplicate(source: str):
+    if ENABLED:
+        DUPLICATES.labels(source).inc()
+
+def count_reminder(kind: str, outcome: str):
+    if ENABLED:
+        REMINDERS.labels(kind, outcome).inc()
+
+def count_broadcast(outcome: str, n: int = 1):
+    if ENABLED and n:
+        BROADCAST.labels(outcome).inc(n)
+
+def count_debounce(outcome: str, n: int = 1):
+    if ENABLED and n:
+        DEBOUNCE.labels(outcome).inc(n)
+
+def observe_delivery(latencies):
+    if ENABLED:
+        for status, seconds in latencies:
+            DELIVERY_SECONDS.labels(status).observe(seconds)
+
+
+def render():
+    """(corpo, content-type) para a rota /metrics."""
+    if not ENABLED:
+        return b"# metrics disabled\n", "text/plain; charset=utf-8"
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = prom.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return prom.generate_latest(registry), prom.CONTENT_TYPE_LATEST
+    return prom.generate_latest(), prom.CONTENT_TYPE_LATEST
+
+
+def serve(port: int):
+    """Exporter HTTP próprio (processos sem Flask, ex.: dispatcher)."""
+    if ENABLED and port:
+        prom.start_http_server(port)
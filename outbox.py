@@ -0,0 +1,219 @@
+# outbox.py
+#
+# Fila durável de envios para a Z-API.
+# Os webhooks apenas enfileiram e respondem; o dispatcher.py drena a fila,
+# envia com retries e move falhas definitivas para a dead-letter.
+#
+# Chaves Redis (prefixo padrão "outbox"):
+#   outbox:q             lista de jobs prontos (LPUSH → BRPOPLPUSH)
+#   outbox:proc:{id}     jobs em processamento por um worker
+#   outbox:hb:{id}       heartbeat do worker (TTL de OUTBOX_WORKER_TTL segundos)
+#   outbox:retry         zset de jobs aguardando retry (score = epoch de liberação)
+#   outbox:dead          dead-letter (limitada a OUTBOX_DEAD_MAX itens)
+#
+# Recuperação: no start o worker devolve à fila o próprio proc; e todo worker, periodicamente,
+# devolve os proc:{id} cujo heartbeat venceu (worker morto ou que não volta mais: em container
+# o DISPATCHER_ID padrão é o hostname, que muda a cada deploy).
+# Retries vencidos voltam à fila num script Lua (ZRANGEBYSCORE + ZREM + LPUSH atômicos).
+#
+# MemoryOutbox tem a mesma interface e serve para testes/execução local sem Redis.
+#
+import os
+import json
+import time
+import uuid
+import threading
+from collections import deque
+
+OUTBOX_PREFIX = os.getenv("OUTBOX_PREFIX", "outbox")
+OUTBOX_DEAD_MAX = int(os.getenv("OUTBOX_DEAD_MAX", "5000"))
+OUTBOX_WORKER_TTL = int(os.getenv("OUTBOX_WORKER_TTL", "60"))
+
+# KEYS[1] = retry, KEYS[2] = q; ARGV: agora, limite
+_PROMOTE = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, raw in ipairs(due) do
+  redis.call('ZREM', KEYS[1], raw)
+  redis.call('LPUSH', KEYS[2], raw)
+end
+return #due
+"""
+
+# KEYS[1] = proc:{id} órfão, KEYS[2] = hb:{id}, KEYS[3] = q
+_RECLAIM = """
+if redis.call('EXISTS', KEYS[2]) == 1 then return 0 end
+local n = 0
+while redis.call('RPOPLPUSH', KEYS[1], KEYS[3]) do n = n + 1 end
+return n
+"""
+
+
+def make_job(kind: str, phone: str, **payload) -> dict:
+    return {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "phone": phone,
+        "payload": payload,
+        "attempts": 0,
+        "created": time.time(),
+    }
+
+
+def _dumps(job: dict) -> str:
+    return json.dumps(job, ensure_ascii=False, separators=(",", ":"))
+
+
+class RedisOutbox:
+    def __init__(self, r, prefix: str = OUTBOX_PREFIX, worker_id: str = "default"):
+        self.r = r
+        self.prefix = prefix
+        self.worker_id = worker_id
+        self.q = f"{prefix}:q"
+        self.proc = f"{prefix}:proc:{worker_id}"
+        self.hb = f"{prefix}:hb:{worker_id}"
+        self.retry = f"{prefix}:retry"
+        self.dead = f"{prefix}:dead"
+        self._promote = r.register_script(_PROMOTE)
+        self._reclaim = r.register_script(_RECLAIM)
+
+    def push(self, job: dict) -> str:
+        self.r.lpush(self.q, _dumps(job))
+        return job["id"]
+
+    def pop(self, timeout: int = 1):
+        """Retorna (raw, job) ou None. O job fica em proc até ack/retry/dead."""
+        raw = self.r.brpoplpush(self.q, self.proc, timeout=timeout)
+        if not raw:
+            return None
+        return raw, json.loads(raw)
+
+    def ack(self, raw: str):
+        self.r.lrem(self.proc, 1, raw)
+
+    def schedule_retry(self, raw: str, job: dict, delay: float):
+        p = self.r.pipeline()
+        p.lrem(self.proc, 1, raw)
+        p.zadd(self.retry, {_dumps(job): time.time() + delay})
+        p.execute()
+
+    def dead_letter(self, raw: str, job: dict, error: str = ""):
+        job = dict(job, error=error, dead_at=time.time())
+        p = self.r.pipeline()
+        p.lrem(self.proc, 1, raw)
+        p.lpush(self.dead, _dumps(job))
+        p.ltrim(self.dead, 0, OUTBOX_DEAD_MAX - 1)
+        p.execute()
+
+    def promote_due(self, limit: int = 100) -> int:
+        """Move retries vencidos de volta para a fila (atômico: nenhum job se perde num crash)."""
+        return int(self._promote(keys=[self.retry, self.q], args=[time.time(), limit]))
+
+    def recover(self) -> int:
+        """Devolve à fila jobs que ficaram no próprio proc (worker caiu no meio do envio)."""
+        moved = 0
+        while self.r.rpoplpush(self.proc, self.q):
+            moved += 1
+        return moved
+
+    def heartbeat(self):
+        self.r.set(self.hb, int(time.time()), ex=OUTBOX_WORKER_TTL)
+
+    def recover_orphans(self) -> int:
+        """Devolve à fila os proc de outros workers sem heartbeat."""
+        moved = 0
+        pfx = f"{self.prefix}:proc:"
+        for key in self.r.scan_iter(match=pfx + "*", count=100):
+            if key != self.proc:
+                hb = f"{self.prefix}:hb:{key[len(pfx):]}"
+                moved += int(self._reclaim(keys=[key, hb, self.q]))
+        return moved
+
+    def stats(self) -> dict:
+        p = self.r.pipeline()
+        p.llen(self.q)
+        p.llen(self.proc)
+        p.zcard(self.retry)
+        p.llen(self.dead)
+        q, proc, retry, dead = p.execute()
+        return {"queued": q, "processing": proc, "retry": retry, "dead": dead}
+
+
+class MemoryOutbox:
+    """Fake em memória (thread-safe) com a mesma interface do RedisOutbox."""
+
+    def __init__(self):
+        self._cv = threading.Condition()
+        self.q = deque()
+        self.proc = []
+        self.retry = []  # (due, raw)
+        self.dead = deque(maxlen=OUTBOX_DEAD_MAX)
+
+    def push(self, job: dict) -> str:
+        with self._cv:
+            self.q.appendleft(_dumps(job))
+            self._cv.notify()
+        return job["id"]
+
+    def pop(self, timeout: int = 1):
+        with self._cv:
+            if not self.q:
+                self._cv.wait(timeout)
+            if not self.q:
+                return None
+            raw = self.q.pop()
+            self.proc.append(raw)
+        return raw, json.loads(raw)
+
+    def ack(self, raw: str):
+        with self._cv:
+            if raw in self.proc:
+                self.proc.remove(raw)
+
+    def schedule_retry(self, raw: str, job: dict, delay: float):
+        with self._cv:
+            if raw in self.proc:
+                self.proc.remove(raw)
+            self.retry.append((time.time() + delay, _dumps(job)))
+
+    def dead_letter(self, raw: str, job: dict, error: str = ""):
+        with self._cv:
+            if raw in self.proc:
+                self.proc.remove(raw)
+            self.dead.appendleft(_dumps(dict(job, error=error, dead_at=time.time())))
+
+    def promote_due(self, limit: int = 100) -> int:
+        now = time.time()
+        with self._cv:
+            due = [it for it in self.retry if it[0] <= now][:limit]
+            for it in due:
+                self.retry.remove(it)
+                self.q.appendleft(it[1])
+            if due:
+                self._cv.notify_all()
+        return len(due)
+
+    def recover(self) -> int:
+        with self._cv:
+            moved = len(self.proc)
+            while self.proc:
+                self.q.append(self.proc.pop(0))
+        return moved
+
+    def heartbeat(self):
+        pass
+
+    def recover_orphans(self) -> int:
+        return 0  # um processo só: não há proc de outro worker
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {"queued": len(self.q), "processing": len(self.proc),
+                    "retry": len(self.retry), "dead": len(self.dead)}
+
+
+class AsyncRedisOutbox(RedisOutbox):
+    """Produtor para redis.asyncio (app ASGI); o consumo continua no dispatcher.py."""
+
+    async def push(self, job: dict) -> str:
+        await self.r.lpush(self.q, _dumps(job))
+        return job["id"]
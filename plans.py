@@ -0,0 +1,224 @@
+# plans.py
+#
+# Planos de conversa: sequência ordenada de mensagens para um telefone
+# (ex.: order.paid = texto de entrega → arquivo do e-book → upsell).
+#
+# Passos:
+#   {"kind": "text", "text": ..., "key": ...}
+#   {"kind": "file" | "image", "url": ..., "caption": ..., "key": ...}
+# key (opcional) = guard do envio, gravado no rastreamento de entrega (delivery.py).
+#
+# - Com fila (OUTBOUND_QUEUE): o plano é um job "plan" do outbox. O dispatcher envia os passos
+#   um logo após o outro, sem voltar à fila entre eles. Falha retentável num passo reagenda o
+#   job a partir daquele passo (os seguintes esperam: nada sai fora de ordem); falha definitiva
+#   é anotada e o plano segue para o próximo passo
+# - Sem fila: PlanRunner (threads) e AsyncPlanRunner (tasks do event loop). Planos do mesmo
+#   telefone saem na ordem de chegada; telefones diferentes em paralelo (PLAN_WORKERS). As
+#   retentativas ficam por conta do adapter HTTP (main.retry_post) / transporte do httpx
+#
+import os
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dispatcher import is_retryable
+
+PLAN_WORKERS = int(os.getenv("PLAN_WORKERS", "8"))
+
+
+def text_step(text: str, key: str = "") -> dict:
+    return {"kind": "text", "text": text, "key": key}
+
+
+def file_step(url: str, caption: str = "", key: str = "") -> dict:
+    return {"kind": "file", "url": url, "caption": caption, "key": key}
+
+
+def image_step(url: str, caption: str = "", key: str = "") -> dict:
+    return {"kind": "image", "url": url, "caption": caption, "key": key}
+
+
+def step_job(plan_id: str, phone: str, i: int, step: dict) -> dict:
+    """Passo no formato de job do outbox (para on_sent/delivery_recorder)."""
+    return {"id": f"{plan_id}:{i}", "kind": step["kind"], "phone": phone, "payload": step}
+
+
+def _args(phone: str, step: dict):
+    if step["kind"] == "text":
+        return phone, step.get("text", "")
+    return phone, step.get("url", ""), step.get("caption", "")
+
+
+def _call(senders: dict, phone: str, step: dict) -> dict:
+    fn = senders.get(step.get("kind"))
+    if fn is None:
+        return {"ok": False, "status": 400, "error": f"unknown_kind:{step.get('kind')}"}
+    try:
+        return fn(*_args(phone, step))
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+def run_steps(phone: str, steps, senders: dict, start: int = 0, on_sent=None, on_failed=None):
+    """
+    Envia steps[start:] em ordem. on_sent(i, step, res) a cada envio aceito; on_failed(i, step, res)
+    em falha definitiva (o plano segue). Para na primeira falha retentável.
+    Retorna (índice onde parou = len(steps) se terminou, último resultado).
+    """
+    res = {"ok": True}
+    for i in range(start, len(steps)):
+        res = _call(senders, phone, steps[i])
+        if res.get("ok"):
+            if on_sent is not None:
+                on_sent(i, steps[i], res)
+        elif is_retryable(res):
+            return i, res
+        elif on_failed is not None:
+            on_failed(i, steps[i], res)
+    return len(steps), res
+
+
+async def _acall(senders: dict, phone: str, step: dict) -> dict:
+    fn = senders.get(step.get("kind"))
+    if fn is None:
+        return {"ok": False, "status": 400, "error": f"unknown_kind:{step.get('kind')}"}
+    try:
+        return await fn(*_args(phone, step))
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+async def arun_steps(phone: str, steps, senders: dict, start: int = 0, on_sent=None, on_failed=None):
+    """run_steps() com senders assíncronos; on_sent/on_failed podem ser corrotinas."""
+    res = {"ok": True}
+    for i in range(start, len(steps)):
+        res = await _acall(senders, phone, steps[i])
+        if res.get("ok"):
+            cb = on_sent
+        elif is_retryable(res):
+            return i, res
+        else:
+            cb = on_failed
+        if cb is not None:
+            out = cb(i, steps[i], res)
+            if asyncio.iscoroutine(out):
+                await out
+    return len(steps), res
+
+
+class PlanRunner:
+    """Planos sem fila: em ordem por telefone, em paralelo entre telefones (pool de threads)."""
+
+    def __init__(self, senders: dict, on_sent=None, workers: int = PLAN_WORKERS):
+        self.senders = senders
+        self.on_sent = on_sent  # on_sent(step_job, res), mesmo contrato do dispatcher
+        self.workers = workers
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._seq = 0
+        self._pool = None
+        self._pool_pid = None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="plan")
+            self._pool_pid = os.getpid()
+            self._queues = {}
+        return self._pool
+
+    def submit(self, phone: str, steps) -> str:
+        """Enfileira o plano do telefone; devolve o id do plano."""
+        with self._lock:
+            pool = self._executor()
+            self._seq += 1
+            plan_id = f"plan-{os.getpid()}-{self._seq}"
+            q = self._queues.get(phone)
+            if q is not None:
+                q.append((plan_id, list(steps)))  # o telefone já tem um dreno rodando
+                return plan_id
+            self._queues[phone] = deque([(plan_id, list(steps))])
+        pool.submit(self._drain, phone)
+        return plan_id
+
+    def _drain(self, phone: str):
+        while True:
+            with self._lock:
+                q = self._queues.get(phone)
+                if not q:
+                    self._queues.pop(phone, None)
+                    self._idle.notify_all()
+                    return
+                plan_id, steps = q.popleft()
+            try:
+                run_steps(phone, steps, self.senders, on_sent=self._sent_cb(plan_id, phone))
+            except Exception:
+                pass  # um plano com erro não pode travar os próximos do telefone
+
+    def _sent_cb(self, plan_id: str, phone: str):
+        if self.on_sent is None:
+            return None
+
+        def cb(i, step, res):
+            try:
+                self.on_sent(step_job(plan_id, phone, i, step), res)
+            except Exception:
+                pass
+        return cb
+
+    def join(self, timeout: float = None) -> bool:
+        """Espera todos os planos pendentes (benchmarks/testes/shutdown)."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._queues, timeout)
+
+
+class AsyncPlanRunner:
+    """PlanRunner para o app ASGI: uma task por telefone com planos pendentes."""
+
+    def __init__(self, senders: dict, on_sent=None):
+        self.senders = senders
+        self.on_sent = on_sent  # corrotina on_sent(step_job, res)
+        self._queues = {}
+        self._tasks = set()
+        self._seq = 0
+
+    def submit(self, phone: str, steps) -> str:
+        self._seq += 1
+        plan_id = f"plan-{os.getpid()}-{self._seq}"
+        q = self._queues.get(phone)
+        if q is not None:
+            q.append((plan_id, list(steps)))
+            return plan_id
+        self._queues[phone] = deque([(plan_id, list(steps))])
+        t = asyncio.ensure_future(self._drain(phone))
+        self._tasks.add(t)
+        t.add_done_callback(self._tasks.discard)
+        return plan_id
+
+    async def _drain(self, phone: str):
+        while True:
+            q = self._queues.get(phone)
+            if not q:
+                self._queues.pop(phone, None)
+                return
+            plan_id, steps = q.popleft()
+            try:
+                await arun_steps(phone, steps, self.senders, on_sent=self._sent_cb(plan_id, phone))
+            except Exception:
+                pass
+
+    def _sent_cb(self, plan_id: str, phone: str):
+        if self.on_sent is None:
+            return None
+
+        async def cb(i, step, res):
+            try:
+                await self.on_sent(step_job(plan_id, phone, i, step), res)
+            except Exception:
+                pass
+        return cb
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
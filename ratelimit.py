@@ -0,0 +1,108 @@
+# ratelimit.py
+#
+# Rate limit por telefone com janela deslizante (minuto + hora) em 1 round trip.
+#
+# Um hash por telefone ("rl:{phone}") guarda, para cada janela, o índice da janela
+# atual e as contagens da janela atual e da anterior. A estimativa deslizante é
+#   anterior * (fração restante da janela) + atual
+# e o script Lua checa as duas janelas e só incrementa se ambas permitirem.
+#
+# Pré-checagem local: quando o Redis responde com folga grande, o processo recebe
+# uma "cota" de alguns hits por poucos segundos e não consulta o Redis para eles.
+# Os hits consumidos localmente são somados no próximo round trip.
+#
+import os
+import time
+import threading
+
+RL_LEASE_SECONDS = float(os.getenv("RL_LEASE_SECONDS", "5"))
+RL_LEASE_DIV = int(os.getenv("RL_LEASE_DIV", "4"))  # ~nº de processos; 0 desliga a cota local
+RL_LEASE_MAX_PHONES = int(os.getenv("RL_LEASE_MAX_PHONES", "10000"))
+
+_LUA = """
+local now = tonumber(ARGV[1])
+local carry = tonumber(ARGV[2])
+local function load(pfx, win)
+  local cur = math.floor(now / win)
+  local w = tonumber(redis.call('HGET', KEYS[1], pfx .. 'w') or '-1')
+  local c = tonumber(redis.call('HGET', KEYS[1], pfx .. 'c') or '0')
+  local p = tonumber(redis.call('HGET', KEYS[1], pfx .. 'p') or '0')
+  if w == cur - 1 then p = c; c = 0 elseif w ~= cur then p = 0; c = 0 end
+  local est = p * (1 - (now % win) / win) + c
+  return cur, c, p, est
+end
+local mw, mc, mp, mest = load('m', 60)
+local hw, hc, hp, hest = load('h', 3600)
+local lim_m = tonumber(ARGV[3])
+local lim_h = tonumber(ARGV[4])
+mc = mc + carry; hc = hc + carry
+mest = mest + carry; hest = hest + carry
+local ok = 0
+if mest + 1 <= lim_m and hest + 1 <= lim_h then
+  ok = 1; mc = mc + 1; hc = hc + 1; mest = mest + 1; hest = hest + 1
+end
+redis.call('HSET', KEYS[1], 'mw', mw, 'mc', mc, 'mp', mp, 'hw', hw, 'hc', hc, 'hp', hp)
+redis.call('EXPIRE', KEYS[1], 7200)
+return {ok, math.floor(lim_m - mest), math.floor(lim_h - hest)}
+"""
+
+
+class RateLimiter:
+    def __init__(self, r, per_min: int, per_hour: int, prefix: str = "rl"):
+        self.r = r
+        self.per_min = per_min
+        self.per_hour = per_hour
+        self.prefix = prefix
+        self._script = r.register_script(_LUA)
+        self._lease = {}  # phone -> [expira_em, hits_livres, hits_a_somar]
+        self._lock = threading.Lock()
+
+    def _take_local(self, phone: str) -> bool:
+        with self._lock:
+            ent = self._lease.get(phone)
+            if ent and ent[0] > time.monotonic() and ent[1] > 0:
+                ent[1] -= 1
+                ent[2] += 1
+                return True
+        return False
+
+    def _carry(self, phone: str) -> int:
+        with self._lock:
+            ent = self._lease.pop(phone, None)
+        return ent[2] if ent else 0
+
+    def _settle(self, phone: str, res) -> bool:
+        ok, rem_m, rem_h = res
+        tokens = min(rem_m, rem_h) // RL_LEASE_DIV if RL_LEASE_DIV > 0 else 0
+        if ok and tokens > 0:
+            with self._lock:
+                if len(self._lease) >= RL_LEASE_MAX_PHONES:
+                    self._prune()
+                self._lease[phone] = [time.monotonic() + RL_LEASE_SECONDS, tokens, 0]
+        return bool(ok)
+
+    def _args(self, phone: str, carry: int):
+        return [f"{self.prefix}:{phone}"], [time.time(), carry, self.per_min, self.per_hour]
+
+    def allow(self, phone: str) -> bool:
+        if self._take_local(phone):
+            return True
+        keys, args = self._args(phone, self._carry(phone))
+        return self._settle(phone, self._script(keys=keys, args=args))
+
+    def _prune(self):
+        t = time.monotonic()
+        for k in [k for k, v in self._lease.items() if v[0] <= t]:
+            del self._lease[k]
+        if len(self._lease) >= RL_LEASE_MAX_PHONES:
+            self._lease.clear()
+
+
+class AsyncRateLimiter(RateLimiter):
+    """Mesmo limitador para redis.asyncio (app ASGI)."""
+
+    async def allow(self, phone: str) -> bool:
+        if self._take_local(phone):
+            return True
+        keys, args = self._args(phone, self._carry(phone))
+        return self._settle(phone, await self._script(keys=keys, args=args))
@@ -0,0 +1,238 @@
+# reminders.py
+#
+# Lembretes agendados: carrinho abandonado e PIX pendente.
+# Roda como processo separado do web (como o dispatcher):
+#
+#   reminders: python reminders.py
+#
+# Chaves Redis:
+#   rem:due            zset  id do lembrete → epoch em que vence
+#   rem:job            hash  id → payload (json)
+#   rem:phone:{phone}  set   ids pendentes do telefone (cancelamento no order.paid)
+#   rem:tps:{segundo}  contador global de envios no segundo (teto REMINDER_MAX_PER_SECOND)
+#
+# ids: cart:{phone}:{etapa} (novo abandono substitui o anterior) e pix:{phone}:{pedido}:{etapa}.
+# O worker retira os vencidos em lotes com um EVALSHA que já desconta o teto de envios por
+# segundo (somado entre workers), não retira nada no horário de silêncio (TZ do flows.py) e
+# respeita rate limit e sent_guard antes de enfileirar no outbox.
+#
+import os
+import json
+import time
+import signal
+
+import metrics
+from flows import now, saudacao
+from templates import render
+
+REMINDER_CART_MINUTES = os.getenv("REMINDER_CART_MINUTES", "60,1440")  # vazio = desligado
+REMINDER_PIX_MINUTES = os.getenv("REMINDER_PIX_MINUTES", "30,240")
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", "50"))
+REMINDER_MAX_PER_SECOND = int(os.getenv("REMINDER_MAX_PER_SECOND", "5"))  # 0 = sem teto
+REMINDER_QUIET_START = int(os.getenv("REMINDER_QUIET_START", "21"))  # hora local (TZ)
+REMINDER_QUIET_END = int(os.getenv("REMINDER_QUIET_END", "8"))
+REMINDER_RETRY_SECONDS = int(os.getenv("REMINDER_RETRY_SECONDS", "300"))  # barrado pelo rate limit
+REMINDER_TTL_HOURS = int(os.getenv("REMINDER_TTL_HOURS", "72"))
+REMINDER_PREFIX = "rem"
+
+
+def _minutes(raw: str):
+    return [int(x) for x in raw.replace(" ", "").split(",") if x]
+
+
+CART_DELAYS = _minutes(REMINDER_CART_MINUTES)
+PIX_DELAYS = _minutes(REMINDER_PIX_MINUTES)
+
+# ARGV: agora, limite do lote, teto por segundo (0 = sem teto)
+# Retorno: {restante_no_segundo, id1, payload1, id2, payload2, ...}
+_CLAIM = """
+local pfx = ARGV[1]
+local now = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local mps = tonumber(ARGV[4])
+local tk = pfx .. ':tps:' .. math.floor(now)
+local left = limit
+if mps > 0 then
+  left = math.min(limit, mps - tonumber(redis.call('GET', tk) or '0'))
+  if left <= 0 then return {0} end
+end
+local ids = redis.call('ZRANGEBYSCORE', pfx .. ':due', '-inf', now, 'LIMIT', 0, left)
+local out = {left - #ids}
+for _, id in ipairs(ids) do
+  redis.call('ZREM', pfx .. ':due', id)
+  local job = redis.call('HGET', pfx .. ':job', id)
+  redis.call('HDEL', pfx .. ':job', id)
+  if job then
+    table.insert(out, id)
+    table.insert(out, job)
+  end
+end
+if mps > 0 and #ids > 0 then
+  redis.call('INCRBY', tk, #ids)
+  redis.call('EXPIRE', tk, 2)
+end
+return out
+"""
+
+_CANCEL = """
+local pfx = ARGV[1]
+local pk = pfx .. ':phone:' .. ARGV[2]
+local ids = redis.call('SMEMBERS', pk)
+for _, id in ipairs(ids) do
+  if ARGV[3] == '' or string.sub(id, 1, #ARGV[3]) == ARGV[3] then
+    redis.call('ZREM', pfx .. ':due', id)
+    redis.call('HDEL', pfx .. ':job', id)
+    redis.call('SREM', pk, id)
+  end
+end
+return #ids
+"""
+
+
+def in_quiet_hours(dt=None) -> bool:
+    h = (dt or now()).hour
+    if REMINDER_QUIET_START == REMINDER_QUIET_END:
+        return False
+    if REMINDER_QUIET_START < REMINDER_QUIET_END:
+        return REMINDER_QUIET_START <= h < REMINDER_QUIET_END
+    return h >= REMINDER_QUIET_START or h < REMINDER_QUIET_END
+
+
+def reminder_text(job: dict) -> str:
+    if job["kind"] == "pix":
+        return render("COPY_LEMBRETE_PIX", saud=saudacao(), nome=job.get("name") or "cliente", link=job.get("link", ""),
+                      pix_code=job.get("pix_code") or "(código indisponível)")
+    return render("COPY_LEMBRETE_CARRINHO", saud=saudacao(), nome=job.get("name") or "cliente", link=job.get("link", ""))
+
+
+def _queue_schedule(p, phone: str, kind: str, ref: str, delays, payload: dict, t0: float):
+    ttl = REMINDER_TTL_HOURS * 3600
+    pk = f"{REMINDER_PREFIX}:phone:{phone}"
+    for step, minutes in enumerate(delays, 1):
+        rid = f"{kind}:{phone}:{ref}:{step}" if ref else f"{kind}:{phone}:{step}"
+        job = dict(payload, kind=kind, phone=phone, ref=ref, step=step)
+        p.zadd(f"{REMINDER_PREFIX}:due", {rid: t0 + minutes * 60})
+        p.hset(f"{REMINDER_PREFIX}:job", rid, json.dumps(job, ensure_ascii=False, separators=(",", ":")))
+        p.sadd(pk, rid)
+    p.expire(pk, ttl)
+
+
+class ReminderStore:
+    def __init__(self, r):
+        self.r = r
+        self._claim = r.register_script(_CLAIM)
+        self._cancel = r.register_script(_CANCEL)
+
+    def _schedule(self, phone, kind, ref, delays, payload):
+        if not (phone and delays):
+            return None
+        p = self.r.pipeline(transaction=False)
+        _queue_schedule(p, phone, kind, ref, delays, payload, time.time())
+        return p
+
+    def schedule_cart(self, phone: str, name: str, link: str):
+        p = self._schedule(phone, "cart", "", CART_DELAYS if link else (), {"name": name, "link": link})
+        if p is not None:
+            p.execute()
+
+    def schedule_pix(self, phone: str, order_no, name: str, link: str, pix_code: str):
+        p = self._schedule(phone, "pix", str(order_no or ""), PIX_DELAYS,
+                           {"name": name, "link": link, "pix_code": pix_code})
+        if p is not None:
+            p.execute()
+
+    def cancel(self, phone: str, kind: str = "") -> int:
+        """Remove os lembretes pendentes do telefone (todos, ou só os de um tipo)."""
+        if not phone:
+            return 0
+        return self._cancel(keys=[], args=[REMINDER_PREFIX, phone, f"{kind}:" if kind else ""])
+
+    def claim(self, limit: int = REMINDER_BATCH, max_per_second: int = REMINDER_MAX_PER_SECOND):
+        """(restante_no_segundo, [(id, job)]) — retira os vencidos dentro do teto de envios."""
+        out = self._claim(keys=[], args=[REMINDER_PREFIX, time.time(), limit, max_per_second])
+        left = int(out[0])
+        return left, [(out[i], json.loads(out[i + 1])) for i in range(1, len(out), 2)]
+
+    def reschedule(self, rid: str, job: dict, delay: float):
+        p = self.r.pipeline(transaction=False)
+        p.zadd(f"{REMINDER_PREFIX}:due", {rid: time.time() + delay})
+        p.hset(f"{REMINDER_PREFIX}:job", rid, json.dumps(job, ensure_ascii=False, separators=(",", ":")))
+        p.sadd(f"{REMINDER_PREFIX}:phone:{job['phone']}", rid)
+        p.execute()
+
+    def forget(self, items):
+        p = self.r.pipeline(transaction=False)
+        for rid, job in items:
+            p.srem(f"{REMINDER_PREFIX}:phone:{job['phone']}", rid)
+        p.execute()
+
+    def stats(self) -> dict:
+        p = self.r.pipeline(transaction=False)
+        p.zcard(f"{REMINDER_PREFIX}:due")
+        p.zcount(f"{REMINDER_PREFIX}:due", "-inf", time.time())
+        pending, due = p.execute()
+        return {"pending": pending, "due": due}
+
+
+class AsyncReminderStore(ReminderStore):
+    """Agendamento/cancelamento para redis.asyncio (app ASGI); o worker é síncrono."""
+
+    async def schedule_cart(self, phone: str, name: str, link: str):
+        p = self._schedule(phone, "cart", "", CART_DELAYS if link else (), {"name": name, "link": link})
+        if p is not None:
+            await p.execute()
+
+    async def schedule_pix(self, phone: str, order_no, name: str, link: str, pix_code: str):
+        p = self._schedule(phone, "pix", str(order_no or ""), PIX_DELAYS,
+                           {"name": name, "link": link, "pix_code": pix_code})
+        if p is not None:
+            await p.execute()
+
+    async def cancel(self, phone: str, kind: str = "") -> int:
+        if not phone:
+            return 0
+        return await self._cancel(keys=[], args=[REMINDER_PREFIX, phone, f"{kind}:" if kind else ""])
+
+
+def process_due(store, send, allow, guard) -> int:
+    """Envia um lote de lembretes vencidos. Retorna quantos foram retirados (-1 = teto do segundo)."""
+    left, items = store.claim()
+    done = []
+    for rid, job in items:
+        phone = job["phone"]
+        if not allow(phone):
+            store.reschedule(rid, job, REMINDER_RETRY_SECONDS)
+            metrics.count_reminder(job["kind"], "rate_limited")
+            continue
+        done.append((rid, job))
+        if not guard(phone, f"rem:{job['kind']}:{job.get('ref', '')}:{job['step']}"):
+            metrics.count_reminder(job["kind"], "dup")
+            continue
+        send(phone, reminder_text(job))
+        metrics.count_reminder(job["kind"], "sent")
+    if done:
+        store.forget(done)
+    if not items and left <= 0 and REMINDER_MAX_PER_SECOND > 0:
+        return -1
+    return len(items)
+
+
+def run(store, send, allow, guard, stop=lambda: False, poll: float = 1.0):
+    while not stop():
+        if in_quiet_hours():
+            time.sleep(min(poll * 30, 60))
+            continue
+        n = process_due(store, send, allow, guard)
+        if n < 0:
+            time.sleep(1 - time.time() % 1)  # teto do segundo atingido
+        elif n == 0:
+            time.sleep(poll)
+
+
+if __name__ == "__main__":
+    from main import r, send_text, rate_limit_ok, sent_guard
+
+    _stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: _stopping.append(1))
+    signal.signal(signal.SIGINT, lambda *_: _stopping.append(1))
+    run(ReminderStore(r), send_text, rate_limit_ok, sent_guard, stop=lambda: bool(_stopping))
@@ -0,0 +1,356 @@
+# rules.py
+#
+# Regras de upsell e de link de entrega (fallback), recarregadas sem reiniciar o processo.
+#
+# Fonte (a primeira que existir):
+#   1. Redis: rules:doc (JSON) + rules:ver (inteiro, incrementado a cada publicação)
+#        python rules.py publish regras.json   # valida e publica (doc + versão numa transação)
+#        python rules.py show | clear
+#   2. Arquivo RULES_JSON_PATH (recarrega quando o mtime muda, como o catálogo)
+#   3. DEFAULT_RULES (abaixo) + DRIVE_FALLBACK_JSON
+# Cada processo guarda o conjunto compilado e confere a versão no máximo a cada
+# RULES_CHECK_SECONDS (um GET de rules:ver). Documento inválido é ignorado: fica a versão anterior.
+#
+# Documento:
+#   {"upsell": [{"id": "v1-v2", "when": ["TABIB_V1"], "offer": "TABIB_V2"},
+#               {"when": ["TABIB_V1", "TABIB_V2"], "offer": "TABIB_FULL", "priority": 10},
+#               {"when": ["TABIB_V4"], "after": ["KURIMA"], "within_days": 30, "offer": "BALSAMO",
+#                "text": "Bálsamo com 30% off: https://..."}],
+#    "fallback": {"TABIB_V1": "https://drive.google.com/...", "tabib-volume-1": "https://..."},
+#    "skip_owned_days": 365}
+#   - Itens e regras são chaves de produto: SKU, handle ou título exato (sem diferenciar
+#     maiúsculas). Cada item do pedido vira SKU do catálogo (por SKU, handle ou título) +
+#     SKU/handle/título do próprio pedido; o título cobre produtos que não estão no catálogo
+#   - when: todos precisam estar no pedido (regra multi-item); after + within_days: o cliente
+#     comprou um deles nos últimos N dias (histórico no perfil, campo "bought")
+#   - Vence a regra de maior priority, depois a com mais itens, depois a declarada antes. Oferta
+#     que está no pedido ou foi comprada há menos de skip_owned_days é pulada (vale a próxima)
+#   - Texto da oferta: "text" da regra, ou nome + checkout do produto no catálogo
+# As regras ficam indexadas por chave: achar a oferta custa O(itens do pedido × regras que citam
+# cada item), independente do total de regras (bench/bench_rules.py).
+#
+import os
+import sys
+import json
+import time
+import threading
+
+RULES_JSON_PATH = os.getenv("RULES_JSON_PATH", "")
+RULES_CHECK_SECONDS = float(os.getenv("RULES_CHECK_SECONDS", "5"))
+RULES_HISTORY_MAX = int(os.getenv("RULES_HISTORY_MAX", "20"))
+RULES_DOC_KEY = "rules:doc"
+RULES_VER_KEY = "rules:ver"
+HISTORY_FIELD = "bought"  # campo do perfil (v2:u:{phone}): "SKU:epoch|SKU:epoch"
+
+DEFAULT_RULES = {
+    "upsell": [
+        {"id": "tabib-v1", "when": ["TABIB_V1"], "offer": "TABIB_V2"},
+        {"id": "tabib-v2", "when": ["TABIB_V2"], "offer": "TABIB_V3"},
+        {"id": "tabib-v3", "when": ["TABIB_V3"], "offer": "TABIB_V4"},
+        {"id": "tabib-v4", "when": ["TABIB_V4"], "offer": "BALSAMO"},
+        {"id": "tabib-kids", "when": ["*TABIB KIDS"], "offer": "BALSAMO"},  # fora do catálogo: pelo título
+    ],
+    "fallback": {},
+    "skip_owned_days": 365,
+}
+
+
+def _key(value) -> str:
+    return str(value or "").strip().lower()
+
+
+def _keys(value, field: str) -> tuple:
+    if isinstance(value, str):
+        value = [value]
+    if not value or not isinstance(value, list) or not all(isinstance(v, str) and v.strip() for v in value):
+        raise ValueError(f"{field} deve ser uma chave ou lista de chaves")
+    return tuple(dict.fromkeys(_key(v) for v in value))
+
+
+class Rule:
+    __slots__ = ("id", "when", "offer", "priority", "after", "within", "text", "order")
+
+    def __init__(self, spec: dict, order: int):
+        if not isinstance(spec, dict):
+            raise ValueError(f"regra {order}: deve ser um objeto")
+        self.id = str(spec.get("id") or order)
+        self.when = _keys(spec.get("when"), f"regra {self.id}: when")
+        offer = spec.get("offer")
+        if not isinstance(offer, str) or not offer.strip():
+            raise ValueError(f"regra {self.id}: offer obrigatório")
+        self.offer = _key(offer)
+        self.after = _keys(spec["after"], f"regra {self.id}: after") if spec.get("after") else ()
+        try:
+            self.priority = int(spec.get("priority") or 0)
+            self.within = float(spec.get("within_days") or 0) * 86400
+        except (TypeError, ValueError):
+            raise ValueError(f"regra {self.id}: priority/within_days devem ser números") from None
+        self.text = str(spec.get("text") or "")
+        self.order = order
+
+    def rank(self):
+        return -self.priority, -len(self.when), self.order
+
+    def recent_ok(self, history: dict, now: float) -> bool:
+        if not self.after:
+            return True
+        since = now - self.within if self.within else 0
+        return any(history.get(k, -1) >= since for k in self.after)
+
+
+class RuleSet:
+    """Conjunto compilado (imutável) de uma versão das regras."""
+
+    def __init__(self, doc: dict, version: str = "default", catalog=None):
+        if not isinstance(doc, dict):
+            raise ValueError("documento de regras deve ser um objeto")
+        rules = doc.get("upsell") or []
+        if not isinstance(rules, list):
+            raise ValueError("upsell deve ser uma lista")
+        fallback = doc.get("fallback") or {}
+        if not isinstance(fallback, dict) or not all(isinstance(v, str) for v in fallback.values()):
+            raise ValueError("fallback deve mapear chave → link")
+        try:
+            self.skip_owned = float(doc.get("skip_owned_days", 365)) * 86400
+        except (TypeError, ValueError):
+            raise ValueError("skip_owned_days deve ser um número") from None
+        self.version = version
+        self.catalog = catalog
+        self.rules = [Rule(spec, i) for i, spec in enumerate(rules)]
+        self.index = {}  # chave → regras em que ela aparece no when
+        for rule in self.rules:
+            for k in rule.when:
+                self.index.setdefault(k, []).append(rule)
+        self.fallback = {_key(k): v for k, v in fallback.items() if v}
+
+    def item_keys(self, item: dict) -> tuple:
+        """Chaves de um line item: SKU do catálogo primeiro, depois SKU/handle/título do pedido."""
+        variant = item.get("variant") or {}
+        sku = _key(item.get("sku") or variant.get("sku"))
+        handle = _key((item.get("product_images_info") or {}).get("handle") or item.get("handle"))
+        title = item.get("title") or variant.get("title") or ""
+        keys = []
+        cat = self.catalog
+        if cat is not None:
+            prod = (sku and cat.by_sku(sku)) or (handle and cat.by_handle(handle))
+            if not prod and title:
+                prod = cat.find_in_text(title)
+            if prod and prod.get("sku"):
+                keys.append(_key(prod["sku"]))
+        keys += [sku, handle, _key(title.replace("|", " "))]  # "|" separa o histórico
+        return tuple(k for k in dict.fromkeys(keys) if k)
+
+    def drive_link(self, items) -> str:
+        """Link de entrega do primeiro item com fallback cadastrado ("" se nenhum)."""
+        for keys in items:
+            for k in keys:
+                link = self.fallback.get(k)
+                if link:
+                    return link
+        return ""
+
+    def upsell(self, items, history: dict = None, now: float = None):
+        """
+        Melhor oferta para os itens do pedido (lista de item_keys) e o histórico do cliente
+        ({chave: epoch}, parse_history). Retorna {"rule", "offer", "text"} ou None.
+        """
+        now = time.time() if now is None else now
+        history = history or {}
+        in_order = set()
+        hits = {}  # id(regra) → chaves do when presentes no pedido
+        for keys in items:
+            in_order.update(keys)
+            for k in keys:
+                for rule in self.index.get(k, ()):
+                    hits.setdefault(id(rule), (rule, set()))[1].add(k)
+        candidates = sorted((rule for rule, got in hits.values() if len(got) == len(rule.when)),
+                            key=Rule.rank)
+        owned_since = now - self.skip_owned
+        for rule in candidates:
+            if rule.offer in in_order or history.get(rule.offer, -1) >= owned_since:
+                continue
+            if not rule.recent_ok(history, now):
+                continue
+            text = rule.text or self.offer_text(rule.offer)
+            if text:
+                return {"rule": rule.id, "offer": rule.offer, "text": text}
+        return None
+
+    def offer_text(self, key: str) -> str:
+        cat = self.catalog
+        prod = cat and (cat.by_sku(key) or cat.by_handle(key))
+        if not prod:
+            return ""
+        name, link = prod.get("name") or "", prod.get("checkout") or ""
+        return f"{name}: {link}" if link else name
+
+
+def parse_history(value) -> dict:
+    """Campo "bought" do perfil → {chave: epoch da compra mais recente}."""
+    out = {}
+    for part in (value or "").split("|"):
+        k, _, ts = part.rpartition(":")
+        if k:
+            try:
+                out[k] = max(out.get(k, 0), float(ts))
+            except ValueError:
+                continue
+    return out
+
+
+def format_history(history: dict, items, now: float = None, limit: int = RULES_HISTORY_MAX) -> str:
+    """Histórico + itens do pedido (primeira chave de cada item), mantendo os `limit` mais recentes."""
+    now = int(time.time() if now is None else now)
+    merged = dict(history)
+    for keys in items:
+        if keys:
+            merged[keys[0]] = now
+    recent = sorted(merged.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+    return "|".join(f"{k}:{int(ts)}" for k, ts in recent)
+
+
+def apply_order(rules: RuleSet, items, profile: dict, now: float = None):
+    """Pedido pago: (oferta ou None, novo valor do campo "bought" do perfil)."""
+    history = parse_history((profile or {}).get(HISTORY_FIELD))
+    return rules.upsell(items, history, now), format_history(history, items, now)
+
+
+def _default_doc() -> dict:
+    doc = dict(DEFAULT_RULES)
+    try:
+        env = json.loads(os.getenv("DRIVE_FALLBACK_JSON", "{}"))
+    except ValueError:
+        env = {}
+    doc["fallback"] = {**(env if isinstance(env, dict) else {}), **DEFAULT_RULES["fallback"]}
+    return doc
+
+
+class RuleStore:
+    """Cache versionado das regras: Redis → arquivo → padrão."""
+
+    def __init__(self, r, catalog=None, path: str = RULES_JSON_PATH):
+        self.r = r
+        self.catalog = catalog
+        self.path = path
+        self._lock = threading.Lock()
+        self._checked = None
+        self._source = None  # ("redis", ver) | ("file", mtime) | ("default", None)
+        self._set = None
+
+    def _stale(self) -> bool:
+        return self._set is None or time.monotonic() - self._checked >= RULES_CHECK_SECONDS
+
+    def _compile(self, source, raw):
+        if source == self._source and self._set is not None:
+            return
+        try:
+            doc = _default_doc() if raw is None else json.loads(raw)
+            version = ":".join(str(x) for x in source if x is not None)
+            self._set = RuleSet(doc, version, self.catalog)
+            self._source = source
+        except ValueError:
+            if self._set is None:  # nada válido ainda: padrão
+                self._set = RuleSet(_default_doc(), "default", self.catalog)
+                self._source = ("default", None)
+
+    def _from_file(self):
+        if self.path:
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if ("file", mtime) == self._source:
+                    return self._source, None
+                with open(self.path, encoding="utf-8") as f:
+                    return ("file", mtime), f.read()
+            except OSError:
+                pass
+        return ("default", None), None
+
+    def _refresh(self, ver, fetch_doc):
+        """ver = rules:ver lido do Redis (None = sem publicação); fetch_doc() lê rules:doc."""
+        if ver is not None:
+            source = ("redis", int(ver))
+            if source != self._source:
+                raw = fetch_doc()
+                if raw is not None:
+                    self._compile(source, raw)
+                    return
+            else:
+                return
+        source, raw = self._from_file()
+        if source != self._source:
+            self._compile(source, raw)
+
+    def current(self) -> RuleSet:
+        if not self._stale():
+            return self._set
+        with self._lock:
+            if self._stale():
+                try:
+                    ver = self.r.get(RULES_VER_KEY)
+                except Exception:
+                    ver = self._source[1] if self._source and self._source[0] == "redis" else None
+                self._refresh(ver, lambda: self.r.get(RULES_DOC_KEY))
+                self._checked = time.monotonic()
+        return self._set
+
+    async def acurrent(self, ar) -> RuleSet:
+        """current() com o cliente Redis assíncrono (asgi.py)."""
+        if not self._stale():
+            return self._set
+        try:
+            ver = await ar.get(RULES_VER_KEY)
+            raw = await ar.get(RULES_DOC_KEY) if ver is not None and ("redis", int(ver)) != self._source else None
+        except Exception:
+            ver, raw = (self._source[1] if self._source and self._source[0] == "redis" else None), None
+        with self._lock:
+            self._refresh(ver, lambda: raw)
+            self._checked = time.monotonic()
+        return self._set
+
+    def publish(self, doc: dict) -> int:
+        """Valida e publica um documento; devolve a nova versão."""
+        RuleSet(doc, catalog=self.catalog)  # ValueError se inválido
+        p = self.r.pipeline(transaction=True)
+        p.set(RULES_DOC_KEY, json.dumps(doc, ensure_ascii=False))
+        p.incr(RULES_VER_KEY)
+        return int(p.execute()[1])
+
+    def clear(self):
+        """Remove a publicação do Redis (volta para arquivo/padrão)."""
+        self.r.delete(RULES_DOC_KEY, RULES_VER_KEY)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import redis
+
+    from catalog import Catalog
+
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    pb = sub.add_parser("publish")
+    pb.add_argument("file")
+    sub.add_parser("show")
+    sub.add_parser("clear")
+    a = ap.parse_args()
+
+    url = os.getenv("REDIS_URL")
+    if not url:
+        sys.exit("REDIS_URL não definido")
+    store = RuleStore(redis.Redis.from_url(url, decode_responses=True), Catalog())
+    if a.cmd == "publish":
+        with open(a.file, encoding="utf-8") as f:
+            try:
+                print(f"publicado: versão {store.publish(json.load(f))}")
+            except ValueError as e:
+                sys.exit(f"regras inválidas: {e}")
+    elif a.cmd == "clear":
+        store.clear()
+        print("publicação removida")
+    else:
+        rs = store.current()
+        print(f"versão {rs.version}: {len(rs.rules)} regras, {len(rs.fallback)} links de fallback")
+        for rule in sorted(rs.rules, key=Rule.rank):
+            extra = f" após {','.join(rule.after)} ({rule.within / 86400:g}d)" if rule.after else ""
+            print(f"  [{rule.priority}] {rule.id}: {'+'.join(rule.when)}{extra} → {rule.offer}")
@@ -0,0 +1,81 @@
+# templates.py
+#
+# Copys pré-compiladas.
+# - Cada COPY_* de copys.py vira um Template: o texto é analisado uma vez e renderizado por
+#   interpolação % (mais barata que str.format a cada envio). Campos com formatação
+#   ({x:>3}, {x!r}) caem no str.format_map
+# - Copy própria de produto: campo "copy" no produtos_paginatto.json (mesmos campos do
+#   COPY_PRODUTO); compilada na primeira vez que aparece e reaproveitada
+#
+# Sem I/O e sem regras: a saudação (cacheada por hora) e o render em lote para campanhas
+# (render_many) ficam em flows.py.
+#
+import string
+import functools
+
+import copys
+
+_FORMATTER = string.Formatter()
+
+
+class Template:
+    __slots__ = ("text", "fields", "_fmt", "_plain")
+
+    def __init__(self, text: str):
+        self.text = text
+        parts, literals, fields, simple = [], [], [], True
+        for literal, field, spec, conv in _FORMATTER.parse(text):
+            literals.append(literal)
+            parts.append(literal.replace("%", "%%"))
+            if field is None:
+                continue
+            if spec or conv or not field.isidentifier():
+                simple = False
+            fields.append(field)
+            parts.append(f"%({field})s")
+        self.fields = tuple(dict.fromkeys(fields))
+        # sem campos: o texto já sem os escapes ({{ → {), como o str.format devolveria
+        self._plain = None if fields else "".join(literals)
+        self._fmt = "".join(parts) if simple else None
+
+    @property
+    def fmt(self):
+        """Formato % equivalente (None se algum campo precisa do str.format)."""
+        return self._fmt
+
+    def render_map(self, values: dict) -> str:
+        if self._plain is not None:
+            return self._plain
+        if self._fmt is None:
+            return self.text.format_map(values)
+        return self._fmt % values
+
+    def render(self, **fields) -> str:
+        return self.render_map(fields)
+
+    def __repr__(self):
+        return f"Template({self.text!r})"
+
+
+TEMPLATES = {k: Template(v) for k, v in vars(copys).items() if k.startswith("COPY_") and isinstance(v, str)}
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(text: str) -> Template:
+    return Template(text)
+
+
+def template(name_or_text: str) -> Template:
+    """Template de um COPY_* pelo nome, ou de um texto avulso (cacheado)."""
+    t = TEMPLATES.get(name_or_text)
+    return t if t is not None else compile_template(name_or_text)
+
+
+def render(name: str, **fields) -> str:
+    return TEMPLATES[name].render_map(fields)
+
+
+def product_template(prod: dict) -> Template:
+    own = prod.get("copy")
+    return compile_template(own) if own else TEMPLATES["COPY_PRODUTO"]
+
@@ -0,0 +1,25 @@
+# conftest.py
+#
+# Testes com Redis em memória (fakeredis, com Lua via lupa) e servidores HTTP locais:
+#   pip install -r requirements.txt -r requirements-dev.txt
+#   python -m pytest -q
+#
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# config mínima para importar main.py (nenhum teste fala com Redis/Z-API de verdade)
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+os.environ.setdefault("WEBHOOK_VERIFY_TOKEN", "test-token")
+os.environ.setdefault("ZAPI_BASE_URL", "http://127.0.0.1:9/instances/t/token/t")
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+import pytest  # noqa: E402
+import fakeredis  # noqa: E402
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
@@ -0,0 +1,102 @@
+import asyncio
+import functools
+import hashlib
+import hmac
+import io
+
+import pytest
+
+import body
+from body import BodyTooLarge, WebhookBody, read_async, read_stream
+
+PAYLOAD = b'{"event": "order.paid", "order": {"id": 1}}'
+
+
+def _sig(secret, raw):
+    return hmac.new(secret.encode(), raw, hashlib.sha256).hexdigest()
+
+
+class Stream(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, n=-1):
+        self.reads += 1
+        return super().read(n)
+
+
+def test_content_length_over_the_limit_is_rejected_before_reading():
+    stream = Stream(b"x" * 100)
+    with pytest.raises(BodyTooLarge):
+        read_stream(stream, content_length=100, max_bytes=10)
+    assert stream.reads == 0
+
+
+def test_body_without_content_length_is_cut_while_reading(monkeypatch):
+    monkeypatch.setattr(body, "BODY_CHUNK_BYTES", 4)
+    stream = Stream(b"x" * 100)
+    with pytest.raises(BodyTooLarge):
+        read_stream(stream, max_bytes=10)
+    assert stream.reads == 3  # parou no bloco que passou do limite
+
+
+def test_hmac_and_sha256_in_one_pass(monkeypatch):
+    monkeypatch.setattr(body, "BODY_CHUNK_BYTES", 7)
+    b = read_stream(io.BytesIO(PAYLOAD), secret="s3cret")
+    assert b.hmac_ok(_sig("s3cret", PAYLOAD))
+    assert not b.hmac_ok(_sig("other", PAYLOAD))
+    assert not b.hmac_ok("")
+    assert not b.hmac_ok("não-hex-ç")  # compare_digest recusa não-ASCII
+    assert b.sha256 == hashlib.sha256(PAYLOAD).hexdigest()
+    assert read_stream(io.BytesIO(PAYLOAD)).hmac_ok("")  # sem segredo, aceita
+
+
+def test_raw_and_json_are_built_once():
+    b = WebhookBody()
+    for i in range(0, len(PAYLOAD), 5):
+        b.feed(PAYLOAD[i:i + 5])
+    raw = b.raw
+    assert raw == PAYLOAD and b.raw is raw
+    data = b.json()
+    assert data["order"] == {"id": 1} and b.json() is data
+
+
+@pytest.mark.parametrize("raw", [b"", b"[1, 2]", b"{", b'"x"'])
+def test_json_is_an_empty_dict_when_not_an_object(raw):
+    b = WebhookBody()
+    b.feed(raw)
+    assert b.json() == {}
+
+
+def test_read_async_matches_read_stream():
+    async def chunks():
+        for i in range(0, len(PAYLOAD), 3):
+            yield PAYLOAD[i:i + 3]
+
+    b = asyncio.run(read_async(chunks(), secret="s3cret"))
+    assert b.raw == PAYLOAD and b.hmac_ok(_sig("s3cret", PAYLOAD))
+    with pytest.raises(BodyTooLarge):
+        asyncio.run(read_async(chunks(), content_length=len(PAYLOAD), max_bytes=8))
+
+
+# ---- main.py: 413 e 401 no webhook da Cartpanda
+@pytest.fixture
+def main(r, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main.r, "_client", r)
+    monkeypatch.setattr(main, "CARTPANDA_HMAC_SECRET", "s3cret")
+    monkeypatch.setattr(main, "read_stream", functools.partial(read_stream, max_bytes=len(PAYLOAD)))
+    return main
+
+
+def test_webhook_rejects_large_body_and_bad_signature(main):
+    client = main.app.test_client()
+    big = PAYLOAD + b" "
+    res = client.post("/webhook/cartpanda", data=big, headers={main.CARTPANDA_SIG_HEADER: _sig("s3cret", big)})
+    assert res.status_code == 413
+    res = client.post("/webhook/cartpanda", data=PAYLOAD, headers={main.CARTPANDA_SIG_HEADER: _sig("x", PAYLOAD)})
+    assert res.status_code == 401
+    res = client.post("/webhook/cartpanda", data=PAYLOAD, headers={main.CARTPANDA_SIG_HEADER: _sig("s3cret", PAYLOAD)})
+    assert res.status_code == 200
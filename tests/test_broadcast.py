@@ -0,0 +1,163 @@
+import threading
+import time
+
+import pytest
+
+import broadcast
+from broadcast import BroadcastStore, run_campaign
+from keyschema import user_key, UPSELL_FIELD
+from userctx import UserContext
+
+
+@pytest.fixture(autouse=True)
+def daytime_small_batches(monkeypatch):
+    monkeypatch.setattr(broadcast, "in_quiet_hours", lambda: False)
+    scan = broadcast.iter_profiles
+    monkeypatch.setattr(broadcast, "iter_profiles", lambda r, cursor=0: scan(r, cursor, count=5))
+
+
+@pytest.fixture
+def store(r):
+    for i in range(12):
+        fields = {"name": f"Cliente{i} Silva", "last_products": "Tabib - Volume 1" if i % 2 else "Outro"}
+        if i == 3:
+            fields[UPSELL_FIELD] = int(time.time()) + 3600  # pediu para não receber ofertas
+        r.hset(user_key(f"55119999900{i:02d}"), mapping=fields)
+    return BroadcastStore(r)
+
+
+class Sender:
+    def __init__(self, fail=()):
+        self.sent, self.fail, self.lock = [], set(fail), threading.Lock()
+
+    def __call__(self, phone, text, key):
+        with self.lock:
+            self.sent.append((phone, text))
+        return {"ok": phone not in self.fail}
+
+
+def guard_for(r):
+    def guard(phone, key, ttl_min):
+        return UserContext(r, phone, guards=[key], guard_ttl_min=ttl_min, load=False).guard(key)
+    return guard
+
+
+@pytest.mark.parametrize("template, filters, vars, error", [
+    ("", {"name": ""}, {}, "template vazio"),
+    ("Oi {nome}", None, {}, "filters vazio"),
+    ("Oi {nome}", {}, {}, "filters vazio"),
+    ("Oi {nome}", ["name"], {}, "filters deve ser"),
+    ("Oi {0}", {"name": ""}, {}, "campos nomeados"),
+    ("Oi {nome", {"name": ""}, {}, "template inválido"),
+    ("Oi {x:d}", {"name": ""}, {}, "template inválido"),
+    ("Oi {nome}", {"name": ""}, {"rows": "x"}, "nome inválido"),
+    ("Oi {nome}", {"name": ""}, {"cupom": ["x"]}, "vars deve ser"),
+])
+def test_create_rejects_invalid_campaigns(store, template, filters, vars, error):
+    with pytest.raises(ValueError, match=error):
+        store.create(template, filters, vars)
+
+
+def test_campaign_sends_to_matching_segment_once(store, r):
+    c = store.create("{saud}, {nome}! Cupom {cupom} para {last_products}", {"last_products": "tabib"},
+                     {"cupom": "TABIB10"}, rate=50)
+    send = Sender(fail={"5511999990005"})
+    assert run_campaign(store, c["id"], send, guard_for(r)) == "done"
+    phones = sorted(p for p, _ in send.sent)
+    assert phones == [f"55119999900{i:02d}" for i in (1, 5, 7, 9, 11)]  # 3 bloqueado
+    assert all(text.endswith("! Cupom TABIB10 para Tabib - Volume 1") for _, text in send.sent)
+    assert dict(send.sent)["5511999990001"].split(", ", 1)[1].startswith("Cliente1!")
+    done = store.get(c["id"])
+    assert (done["status"], done["scanned"], done["matched"], done["skipped"]) == ("done", 12, 6, 1)
+    assert (done["sent"], done["failed"]) == (4, 1)
+    assert c["id"] not in store.running()
+
+    # relançar a mesma campanha não reenvia (guard por cliente e campanha); só quem falhou é tentado
+    r.hset(broadcast._campaign_key(c["id"]), mapping={"status": "running", "cursor": 0})
+    assert run_campaign(store, c["id"], send, guard_for(r)) == "done"
+    assert send.sent[5:] == [("5511999990005", send.sent[5][1])] and store.get(c["id"])["dup"] == 4
+
+
+def test_pause_and_resume_continue_from_cursor(store, r):
+    c = store.create("Oi {nome}", {"name": ""}, rate=50, skip_blocked=False)
+    send = Sender()
+    store.apply(c["id"], "pause")
+    assert run_campaign(store, c["id"], send, guard_for(r)) == "paused"
+    assert store.apply(c["id"], "pause") == {"ok": False, "status": "paused"}
+    assert store.apply(c["id"], "resume") == {"ok": True, "status": "running"}
+
+    calls = [0]
+
+    def stop():  # para no meio (depois do primeiro lote do SCAN)
+        calls[0] += 1
+        return len(send.sent) >= 1 and calls[0] > 1
+
+    assert run_campaign(store, c["id"], send, guard_for(r), stop=stop) == "stopped"
+    assert 0 < len(send.sent) < 12
+    assert run_campaign(store, c["id"], send, guard_for(r)) == "done"
+    assert sorted(p for p, _ in send.sent) == [f"55119999900{i:02d}" for i in range(12)]
+    assert store.get(c["id"])["sent"] == 12
+
+
+def test_cancel_stops_the_campaign(store, r):
+    c = store.create("Oi {nome}", {"name": ""}, rate=50)
+    assert store.apply(c["id"], "cancel") == {"ok": True, "status": "cancelled"}
+    assert store.apply(c["id"], "resume") == {"ok": False, "status": "cancelled"}
+    assert store.apply("nope", "pause") == {"ok": False, "error": "campanha não encontrada"}
+    send = Sender()
+    assert run_campaign(store, c["id"], send, guard_for(r)) == "cancelled"
+    assert send.sent == [] and store.running() == []
+
+
+def test_broken_campaign_is_failed_and_others_still_go(store, r):
+    good = store.create("Oi {nome}", {"last_products": "tabib"}, rate=50)
+    bad = store.create("Oi {nome}", {"name": ""}, rate=50)
+    r.hset(broadcast._campaign_key(bad["id"]), "template", "Oi {0}")  # corrompida depois de criada
+    send = Sender()
+    cycles = [0]
+
+    def stop():
+        cycles[0] += 1
+        return cycles[0] > 10
+
+    broadcast.run(store, send, guard_for(r), stop=stop, poll=0.01)
+    failed = store.get(bad["id"])
+    assert failed["status"] == "failed" and failed["error"]
+    assert store.get(good["id"])["status"] == "done"
+    assert len(send.sent) == 5 and store.running() == []
+
+
+def test_lease_gives_each_campaign_one_worker(store):
+    c = store.create("Oi {nome}", {"name": ""}, rate=50)
+    assert store.acquire(c["id"], "w1")
+    assert not store.acquire(c["id"], "w2")
+    assert not store.renew(c["id"], "w2")
+    store.release(c["id"], "w1")
+    assert store.acquire(c["id"], "w2")
+
+
+def test_failed_send_is_retried_on_resume(store, r):
+    c = store.create("Oi {nome}", {"last_products": "tabib"}, rate=50)
+    send = Sender(fail={"5511999990005", "5511999990007"})
+    assert run_campaign(store, c["id"], send, guard_for(r)) == "done"
+    assert store.get(c["id"])["failed"] == 2
+    assert not r.hexists(user_key("5511999990005"), f"g:bc:{c['id']}")  # guard desfeito
+
+    # Z-API de volta: relançada do início, só quem falhou recebe
+    send.fail.clear()
+    r.hset(broadcast._campaign_key(c["id"]), mapping={"status": "running", "cursor": 0})
+    assert run_campaign(store, c["id"], send, guard_for(r)) == "done"
+    phones = [p for p, _ in send.sent]
+    assert sorted(phones[5:]) == ["5511999990005", "5511999990007"]
+    assert store.get(c["id"])["sent"] == 5
+
+
+def test_send_exception_releases_the_guard(store, r):
+    c = store.create("Oi {nome}", {"last_products": "tabib"}, rate=50)
+
+    def boom(phone, text, key):
+        raise ConnectionError("Z-API fora")
+
+    assert run_campaign(store, c["id"], boom, guard_for(r)) == "done"
+    assert store.get(c["id"])["failed"] == 5
+    assert not any(k.startswith("g:") for k in r.hgetall(user_key("5511999990001")))
@@ -0,0 +1,71 @@
+import json
+import os
+
+import pytest
+
+import catalog
+import flows
+from catalog import Catalog
+
+
+@pytest.fixture
+def products_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CATALOG_CHECK_SECONDS", 0)
+    path = tmp_path / "produtos.json"
+
+    def write(products, mtime=None):
+        path.write_text(json.dumps(products), encoding="utf-8")
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+    write([
+        {"sku": "TABIB_V1", "name": "Tabib Volume 1: Dores", "aliases": ["tabib 1", "volume 1"]},
+        {"sku": "TABIB_FULL", "name": "Tabib completo", "aliases": ["tabib"], "handle": "tabib-completo"},
+    ], mtime=1_000)
+    return str(path), write
+
+
+def test_longest_phrase_wins_on_word_boundaries(products_file):
+    c = Catalog(products_file[0])
+    assert c.find_in_text("quero o Tabib 1 por favor")["sku"] == "TABIB_V1"
+    assert c.find_in_text("quero o tabib")["sku"] == "TABIB_FULL"
+    assert c.find_in_text("tabibs") is None  # palavra inteira
+    assert c.find_in_text("") is None
+    assert c.match_in_text("o VOLUME 1 já saiu?") == (c.by_sku("tabib_v1"), ("volume", "1"))
+    assert c.match_in_text("nada") == (None, ())
+
+
+def test_indexes(products_file):
+    c = Catalog(products_file[0])
+    assert c.by_sku(" tabib_full ")["name"] == "Tabib completo"
+    assert c.by_handle("tabib-completo")["sku"] == "TABIB_FULL"
+    assert c.by_handle("tabib-volume-1-dores")["sku"] == "TABIB_V1"  # handle gerado do nome
+    assert c.by_sku("NOPE") is None
+
+
+def test_hot_reload_and_broken_file_keeps_previous(products_file):
+    path, write = products_file
+    c = Catalog(path)
+    assert c.by_sku("TABIB_V1")
+    write([{"sku": "KURIMA", "name": "Kurimã - Óleos", "aliases": ["kurima"]}], mtime=2_000)
+    assert c.find_in_text("tem kurima?")["sku"] == "KURIMA" and c.by_sku("TABIB_V1") is None
+    with open(path, "w") as f:
+        f.write("[{")  # arquivo em edição
+    os.utime(path, (3_000, 3_000))
+    assert c.by_sku("KURIMA")
+
+
+@pytest.mark.parametrize("text, sku", [
+    ("quero o tabib 2025", "TABIB_24_25_BUNDLE"),
+    ("quero as 300 receitas airfryer", "AIRFRYER_300"),
+    ("quero o tabib 2", "TABIB_V2"),
+])
+def test_product_with_digits_is_not_an_order_number(text, sku):
+    reply = flows.inbound_reply({"name": "Ana"}, text, Catalog())
+    assert (reply["intent"], reply.get("sku")) == (None, sku)
+    assert Catalog().by_sku(sku)["checkout"] in reply["text"]
+
+
+def test_order_number_next_to_a_product_is_still_an_order():
+    reply = flows.inbound_reply({"name": "Ana", "last_digital": "https://x/ebook"},
+                                "comprei o tabib 2025, pedido 55555", Catalog())
+    assert reply["intent"] == "pedido" and "#55555" in reply["text"]
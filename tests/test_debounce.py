@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+import debounce
+from debounce import Debouncer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    t = [1_700_000_000_000]
+    monkeypatch.setattr(debounce, "_now_ms", lambda: t[0])
+    return t
+
+
+@pytest.fixture(autouse=True)
+def lease(monkeypatch):
+    monkeypatch.setattr(debounce, "DEBOUNCE_LEASE_MS", 1000)
+    monkeypatch.setattr(debounce, "DEBOUNCE_MAX_TRIES", 2)
+
+
+def test_burst_is_joined_after_window(r, clock):
+    d = Debouncer(r, window_ms=500, max_ms=5000)
+    assert d.push("5511999990001", "oi") == 1
+    clock[0] += 300
+    assert d.push("5511999990001", "quero") == 2
+    clock[0] += 300
+    assert d.claim_due() == []  # a segunda mensagem empurrou o vencimento
+    clock[0] += 200
+    [(token, phone, text)] = d.claim_due()
+    assert (phone, text) == ("5511999990001", "oi\nquero")
+    assert d.claim_due() == []
+
+
+def test_max_wait_caps_a_nonstop_sender(r, clock):
+    d = Debouncer(r, window_ms=500, max_ms=1000)
+    due = []
+
+    def answer():
+        for token, phone, text in d.claim_due():
+            d.ack(token)
+            due.append((token, phone, text))
+
+    for i in range(8):
+        d.push("5511999990001", str(i))
+        clock[0] += 200
+        answer()
+    clock[0] += 500
+    answer()
+    assert [text for _, _, text in due] == ["0\n1\n2\n3\n4", "5\n6\n7"]
+
+
+def test_each_burst_goes_to_one_poller(r, clock):
+    a, b = Debouncer(r, window_ms=100), Debouncer(r, window_ms=100)
+    for i in range(10):
+        a.push(f"55119999900{i:02d}", "oi")
+    clock[0] += 100
+    got = a.claim_due(limit=4) + b.claim_due(limit=50) + a.claim_due()
+    assert sorted(phone for _, phone, _ in got) == [f"55119999900{i:02d}" for i in range(10)]
+
+
+def test_unacked_burst_returns_after_lease_until_max_tries(r, clock):
+    d = Debouncer(r, window_ms=100)
+    d.push("5511999990001", "oi")
+    clock[0] += 100
+    [(token, _, _)] = d.claim_due()
+    clock[0] += 999
+    assert d.claim_due() == []  # lease ainda vale
+    clock[0] += 1
+    assert d.claim_due() == [(token, "5511999990001", "oi")]  # 2ª tentativa
+    clock[0] += 1000
+    assert d.claim_due() == []  # passou de DEBOUNCE_MAX_TRIES: descartada
+    assert not list(r.scan_iter("deb:proc:*")) and not r.zcard("deb:inflight")
+
+
+def test_ack_removes_the_burst(r, clock):
+    d = Debouncer(r, window_ms=100)
+    d.push("5511999990001", "oi")
+    clock[0] += 100
+    [(token, _, _)] = d.claim_due()
+    d.ack(token)
+    clock[0] += 5000
+    assert d.claim_due() == []
+    assert not list(r.scan_iter("deb:*:*")) and not r.hgetall("deb:tries")
+    d.push("5511999990001", "de novo")  # nova rajada, novo token
+    clock[0] += 100
+    [(token2, _, text)] = d.claim_due()
+    assert token2 != token and text == "de novo"
+
+
+def test_poller_retries_failed_answers(r, monkeypatch):
+    monkeypatch.setattr(debounce, "DEBOUNCE_LEASE_MS", 100)
+    monkeypatch.setattr(debounce, "DEBOUNCE_MAX_TRIES", 3)
+    monkeypatch.setattr(debounce, "DEBOUNCE_POLL_MS", 10)
+    d = Debouncer(r, window_ms=20)
+    calls = []
+
+    def handler(phone, text):
+        calls.append((phone, text))
+        if len(calls) == 1:
+            raise RuntimeError("Z-API fora")
+        return {"ok": len(calls) > 2}
+
+    d.push("5511999990001", "oi")
+    d.push("5511999990001", "tudo bem?")
+    stop = threading.Event()
+    t = threading.Thread(target=d.run, args=(handler,), kwargs={"stop": stop.is_set})
+    t.start()
+    deadline = time.monotonic() + 5
+    while len(calls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.3)
+    stop.set()
+    t.join()
+    assert calls == [("5511999990001", "oi\ntudo bem?")] * 3
+    assert not list(r.scan_iter("deb:proc:*")) and not r.zcard("deb:inflight")
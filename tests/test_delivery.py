@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+import delivery
+from delivery import DeliveryStore, parse_status
+
+PHONE = "5511999990001"
+
+
+def _status(store, mid, status, ts, phone=PHONE):
+    return store.record_statuses([(mid, status, ts, phone)])
+
+
+@pytest.fixture
+def store(r):
+    return DeliveryStore(r)
+
+
+def test_statuses_out_of_order_never_lower_the_rank(store, monkeypatch):
+    monkeypatch.setattr(delivery, "now_ms", lambda: 1_000)
+    store.record_sent(PHONE, "m1", key="paid:1")
+    assert _status(store, "m1", "READ", 5_000) == [("READ", 4.0)]
+    assert _status(store, "m1", "RECEIVED", 3_000) == [("RECEIVED", 2.0)]  # chegou atrasado
+    assert _status(store, "m1", "READ", 9_000) == []  # repetido: só a primeira ocorrência vale
+
+    msg = store.phone_state(PHONE)["messages"][0]
+    assert (msg["status"], msg["delivered"]) == ("READ", True)
+    assert msg["statuses"] == {"READ": 5_000, "RECEIVED": 3_000}
+    assert store.r.hget("dlv:msg:m1", "r") == "3"
+    assert store.r.hget(f"dlv:phone:{PHONE}", "paid:1") == "3"
+
+
+def test_guard_is_delivered_from_received_on(store):
+    store.record_sent(PHONE, "m1", key="paid:1")
+    assert not store.already_delivered(PHONE, "paid:1")
+    _status(store, "m1", "SENT", 2_000)
+    assert not store.already_delivered(PHONE, "paid:1")
+    _status(store, "m1", "DELIVERED", 3_000)
+    assert store.already_delivered(PHONE, "paid:1")
+    assert store.phone_state(PHONE)["delivered_keys"] == ["paid:1"]
+
+
+def test_status_before_record_sent_uses_the_payload_phone(store):
+    assert _status(store, "m9", "RECEIVED", 2_000) == []  # sem envio registrado, sem latência
+    assert [m["id"] for m in store.phone_state(PHONE)["messages"]] == ["m9"]
+
+
+@pytest.mark.parametrize("body, ids", [
+    ({"status": "read", "ids": ["a", "b"]}, ["a", "b"]),
+    ({"status": "READ", "ids": "3EB0C4"}, ["3EB0C4"]),
+    ({"status": "READ", "messageId": "a"}, ["a"]),
+    ({"status": "READ", "id": "a"}, ["a"]),
+    ({"status": "READ", "ids": ["a", ""]}, ["a"]),
+    ({"ids": ["a"]}, []),
+])
+def test_parse_status_ids(body, ids):
+    events = parse_status(dict(body, phone="11 99999-0001", momment=7), lambda p: p.replace(" ", ""))
+    assert [e[0] for e in events] == ids
+    assert all(e[1:] == ("READ", 7, "1199999-0001") for e in events)
+
+
+# ---- main.py: entrega paga e /delivery/<phone>
+@pytest.fixture
+def app(r, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main.r, "_client", r)
+    monkeypatch.setattr(main, "OUTBOUND_QUEUE", True)
+    monkeypatch.setattr(main, "CARTPANDA_HMAC_SECRET", "")
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "admin-secret")
+    return main
+
+
+def _paid(order_id):
+    return {"event": "order.paid", "order": {
+        "id": order_id, "order_number": order_id, "payment_status": "3", "phone": PHONE,
+        "customer": {"first_name": "Ana"}, "digital_attachment": "https://x/ebook",
+        "line_items": [{"title": "Produto sem upsell"}],
+    }}
+
+
+def _queued(main):
+    jobs = [json.loads(main.r.lindex(main.outbox.q, i)) for i in range(main.r.llen(main.outbox.q))]
+    return [j for j in jobs if j["phone"] == PHONE]
+
+
+def test_paid_order_already_delivered_is_not_resent(app):
+    client = app.app.test_client()
+    app.delivery.record_sent(PHONE, "m1", key="paid:700")
+    app.delivery.record_statuses([("m1", "RECEIVED", 2_000, PHONE)])
+    assert client.post("/webhook/cartpanda", json=_paid(700)).get_json() == {"ok": True}
+    assert _queued(app) == []  # guard novo (expirou?), mas a Z-API já confirmou a entrega
+
+    assert client.post("/webhook/cartpanda", json=_paid(701)).get_json() == {"ok": True}
+    assert [j["payload"].get("key") for j in _queued(app)] == ["paid:701"]
+
+
+def test_delivery_endpoint_requires_admin_token(app):
+    client = app.app.test_client()
+    app.delivery.record_sent(PHONE, "m1", key="paid:1")
+    assert client.get(f"/delivery/{PHONE}").status_code == 403
+    assert client.get(f"/delivery/{PHONE}", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    res = client.get(f"/delivery/{PHONE}", headers={"Authorization": "Bearer admin-secret"})
+    assert res.status_code == 200 and [m["id"] for m in res.get_json()["messages"]] == ["m1"]
+
+
+def test_delivery_endpoint_is_off_without_admin_token(app, monkeypatch):
+    monkeypatch.setattr(app, "ADMIN_TOKEN", "")
+    res = app.app.test_client().get(f"/delivery/{PHONE}", headers={"Authorization": "Bearer "})
+    assert res.status_code == 403
@@ -0,0 +1,189 @@
+import json
+import threading
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+import dispatcher
+from outbox import MemoryOutbox, RedisOutbox, make_job
+from plans import text_step
+
+
+@pytest.fixture(params=["memory", "redis"])
+def outbox(request, r):
+    return MemoryOutbox() if request.param == "memory" else RedisOutbox(r, worker_id="t")
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(dispatcher, "backoff", lambda attempts: 0)
+    monkeypatch.setattr(dispatcher, "OUTBOX_MAX_ATTEMPTS", 3)
+
+
+class Senders(dict):
+    """senders do dispatcher que devolvem os resultados da fila `results` (o último se repete)."""
+
+    def __init__(self, *results):
+        super().__init__(text=self._send, file=self._send, image=self._send)
+        self.results = list(results) or [{"ok": True}]
+        self.calls = []
+
+    def _send(self, phone, *args):
+        self.calls.append((phone,) + args)
+        return self.results.pop(0) if len(self.results) > 1 else self.results[0]
+
+
+def drain(outbox, senders, on_sent=None):
+    """Processa até a fila e os retries vencidos acabarem (timeout=0 no BRPOPLPUSH bloquearia)."""
+    while outbox.promote_due() or outbox.stats()["queued"]:
+        assert dispatcher.process_one(outbox, senders, timeout=1, on_sent=on_sent)
+
+
+def dead(outbox):
+    items = outbox.dead if isinstance(outbox, MemoryOutbox) else outbox.r.lrange(outbox.dead, 0, -1)
+    return [json.loads(raw) for raw in items]
+
+
+def test_success_is_acked_and_recorded(outbox):
+    senders, sent = Senders({"ok": True, "data": {"messageId": "m1"}}), []
+    job = make_job("text", "5511999990001", text="oi")
+    outbox.push(job)
+    drain(outbox, senders, on_sent=lambda j, res: sent.append((j["id"], res["data"]["messageId"])))
+    assert senders.calls == [("5511999990001", "oi")]
+    assert sent == [(job["id"], "m1")]
+    assert outbox.stats() == {"queued": 0, "processing": 0, "retry": 0, "dead": 0}
+
+
+def test_retryable_error_is_retried_until_it_succeeds(outbox):
+    senders = Senders({"ok": False, "status": 503}, {"ok": False, "error": "connection reset"}, {"ok": True})
+    outbox.push(make_job("text", "5511999990001", text="oi"))
+    drain(outbox, senders)
+    assert len(senders.calls) == 3
+    assert outbox.stats()["dead"] == 0
+
+
+def test_attempts_exhausted_go_to_dead_letter(outbox):
+    senders = Senders({"ok": False, "status": 429})
+    outbox.push(make_job("text", "5511999990001", text="oi"))
+    drain(outbox, senders)
+    assert len(senders.calls) == 3
+    [job] = dead(outbox)
+    assert job["attempts"] == 3 and job["error"] == "status 429"
+
+
+@pytest.mark.parametrize("res", [
+    {"ok": False, "status": 400, "error": "bad phone"},
+    {"ok": False, "error": "invalid_file_url"},
+])
+def test_permanent_error_is_dead_lettered_without_retry(outbox, res):
+    senders = Senders(res)
+    outbox.push(make_job("text", "5511999990001", text="oi"))
+    drain(outbox, senders)
+    assert len(senders.calls) == 1
+    assert [j["error"] for j in dead(outbox)] == [res["error"]]
+
+
+def test_uncertain_send_is_not_resent(outbox):
+    # timeout de leitura: a Z-API pode ter entregue, reenviar duplicaria a mensagem
+    senders = Senders({"ok": False, "error": "read timeout", "uncertain": True})
+    outbox.push(make_job("text", "5511999990001", text="oi"))
+    drain(outbox, senders)
+    assert len(senders.calls) == 1
+    assert len(dead(outbox)) == 1
+
+
+def test_recover_requeues_only_unacked_jobs(outbox):
+    senders = Senders()
+    outbox.push(make_job("text", "5511999990001", text="um"))
+    outbox.push(make_job("text", "5511999990001", text="dois"))
+    assert dispatcher.process_one(outbox, senders)  # "um" enviado e ack
+    assert outbox.pop() is not None  # "dois" retirado; worker "cai" antes do envio
+    assert outbox.recover() == 1
+    drain(outbox, senders)
+    assert [c[1] for c in senders.calls] == ["um", "dois"]  # "um" não sai de novo
+
+
+def test_plan_retry_resumes_at_failed_step(outbox):
+    senders = Senders({"ok": True}, {"ok": False, "status": 502}, {"ok": True})
+    outbox.push(make_job("plan", "5511999990001", steps=[text_step("a"), text_step("b"), text_step("c")]))
+    drain(outbox, senders)
+    assert [c[1] for c in senders.calls] == ["a", "b", "b", "c"]
+    assert outbox.stats()["dead"] == 0
+
+
+def test_plan_dead_letter_keeps_only_failed_steps(outbox):
+    senders = Senders({"ok": True}, {"ok": False, "status": 400, "error": "bad"}, {"ok": True})
+    outbox.push(make_job("plan", "5511999990001", steps=[text_step("a"), text_step("b"), text_step("c")]))
+    drain(outbox, senders)
+    assert [c[1] for c in senders.calls] == ["a", "b", "c"]
+    [job] = dead(outbox)
+    assert [s["text"] for s in job["payload"]["steps"]] == ["b"]
+
+
+def test_run_keeps_per_phone_order_across_threads():
+    outbox, senders = MemoryOutbox(), Senders()
+    for i in range(20):
+        for phone in ("5511999990001", "5511999990002", "5511999990003"):
+            outbox.push(make_job("text", phone, text=str(i)))
+    done = threading.Event()
+
+    def stop():
+        if outbox.stats() == {"queued": 0, "processing": 0, "retry": 0, "dead": 0}:
+            done.set()
+        return done.is_set()
+
+    dispatcher.run(outbox, senders, stop=stop, threads=3)
+    for phone in ("5511999990001", "5511999990002", "5511999990003"):
+        assert [c[1] for c in senders.calls if c[0] == phone] == [str(i) for i in range(20)]
+
+
+def test_run_survives_redis_errors(monkeypatch):
+    outbox, senders = MemoryOutbox(), Senders()
+    outbox.push(make_job("text", "5511999990001", text="oi"))
+    monkeypatch.setattr(dispatcher, "DISPATCHER_ERROR_BACKOFF_CAP", 0.01)
+    failures = {"recover": 1, "pop": 3}
+
+    def flaky(name, fn):
+        def call(*args, **kwargs):
+            if failures[name]:
+                failures[name] -= 1
+                raise RedisConnectionError("Connection refused")
+            return fn(*args, **kwargs)
+        return call
+
+    monkeypatch.setattr(outbox, "recover", flaky("recover", outbox.recover))
+    monkeypatch.setattr(outbox, "pop", flaky("pop", outbox.pop))
+    dispatcher.run(outbox, senders, stop=lambda: bool(senders.calls), threads=1)
+    assert failures == {"recover": 0, "pop": 0}
+    assert senders.calls == [("5511999990001", "oi")]
+
+
+def test_promote_due_moves_only_due_retries(r):
+    outbox = RedisOutbox(r, worker_id="w1")
+    outbox.push(make_job("text", "5511999990001", text="agora"))
+    raw, job = outbox.pop()
+    outbox.schedule_retry(raw, job, -1)
+    outbox.schedule_retry(raw.replace("agora", "depois"), dict(job, payload={"text": "depois"}), 60)
+    assert outbox.promote_due() == 1
+    assert outbox.stats() == {"queued": 1, "processing": 0, "retry": 1, "dead": 0}
+    assert outbox.pop()[1]["payload"]["text"] == "agora"
+
+
+def test_orphaned_proc_lists_are_reclaimed(r):
+    old, new = RedisOutbox(r, worker_id="host-antigo"), RedisOutbox(r, worker_id="host-novo")
+    old.push(make_job("text", "5511999990001", text="oi"))
+    old.heartbeat()
+    assert old.pop() is not None  # em voo no worker antigo
+    assert new.recover_orphans() == 0  # heartbeat vivo: não mexe
+    r.delete(old.hb)  # worker antigo morreu no deploy; o heartbeat venceu
+    assert new.recover_orphans() == 1
+    assert r.llen(old.proc) == 0 and new.stats()["queued"] == 1
+
+
+def test_run_reclaims_jobs_left_by_a_dead_worker(r):
+    RedisOutbox(r, worker_id="host-antigo").push(make_job("text", "5511999990001", text="oi"))
+    assert RedisOutbox(r, worker_id="host-antigo").pop() is not None
+    outbox, senders = RedisOutbox(r, worker_id="host-novo"), Senders()
+    dispatcher.run(outbox, senders, stop=lambda: bool(senders.calls), threads=1)
+    assert senders.calls == [("5511999990001", "oi")]
+    assert r.exists(outbox.hb) and not r.exists("outbox:proc:host-antigo")
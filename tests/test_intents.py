@@ -0,0 +1,47 @@
+import pytest
+
+from intents import classify, normalize
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("oi", "saudacao"),
+    ("Olá, tudo bem?", "saudacao"),
+    ("boa noite", "saudacao"),
+    ("noite", None),  # "oi" dentro de "noite"
+    ("consegui", None),
+    ("conseguir abrir", None),  # "seguir" dentro de "conseguir"
+    ("vou seguir vocês", "retomar"),  # "seguir" é de retomar e instagram: vence a prioridade
+    ("vi na postagem", None),  # "post" dentro de "postagem"
+    ("vi no post", "instagram"),
+    ("vi nos posts", "instagram"),  # plural simples
+    ("me chama no @", "instagram"),
+    ("quero pagar", "pix"),
+    ("não consegui pagar", "pix"),  # contém "pagar", que tem prioridade maior
+    ("NÃO RECEBI o e-book", "nao_recebi"),
+    ("nao recebi", "nao_recebi"),  # sem acento
+    ("qual o prazo de entrega?", "entrega"),
+    ("é golpe?", "seguranca"),
+    ("o cartão travou", "pagamento_travou"),
+    ("agora não, obrigado", "nao_quero"),
+    ("", None),
+])
+def test_classify(text, intent):
+    assert classify(text)[0] == intent
+
+
+def test_order_number_is_the_last_resort():
+    assert classify("meu pedido é #12345") == ("pedido", "12345")
+    assert classify("pedido 987") == ("pedido", "987")
+    assert classify("oi, pedido 4567") == ("pedido", "4567")  # pedido vem antes da saudação
+    assert classify("não recebi o 12345") == ("nao_recebi", "")
+    assert classify("tenho 2 dúvidas") == (None, "")  # menos de 3 dígitos
+
+
+def test_not_orders_skips_numbers_that_belong_to_something_else():
+    assert classify("quero o tabib 2025", not_orders=("tabib", "2025")) == (None, "")
+    assert classify("tabib 2025, pedido 55555", not_orders=("tabib", "2025")) == ("pedido", "55555")
+
+
+def test_normalize():
+    assert normalize("  Não   RECEBI  ") == "nao recebi"
+    assert normalize(None) == ""
@@ -0,0 +1,76 @@
+import time
+
+import keyschema
+from keyschema import user_key, guard_field, UPSELL_FIELD
+from userctx import UserContext
+
+
+def _v1(r):
+    r.hset("user:5511999990001", mapping={"name": "Ana Souza", "last_cart": "c1"})
+    r.hset("user:5511999990002", mapping={"name": "Rui"})
+    r.set("last_cart_by_phone:5511999990001", "c1")
+    r.set("upsell_block:5511999990001", 1, ex=3600)
+    r.set("sent:5511999990002:paid:42", 1, ex=600)
+    r.set("evt:order-1", 1, ex=20 * 3600)
+
+
+def test_migrate_moves_v1_keys(r):
+    _v1(r)
+    # v2 já existente ganha da cópia v1
+    r.hset(user_key("5511999990002"), "name", "Rui Lima")
+    stats = keyschema.migrate(r, delete=True, log=lambda *_: None)
+    assert stats == {"user": 2, "upsell_block": 1, "sent": 1, "evt": 1, "last_cart_by_phone": 1}
+
+    ana = r.hgetall(user_key("5511999990001"))
+    assert ana["name"] == "Ana Souza" and ana["last_cart"] == "c1"
+    assert time.time() + 3500 < float(ana[UPSELL_FIELD]) <= time.time() + 3600
+    rui = r.hgetall(user_key("5511999990002"))
+    assert rui["name"] == "Rui Lima"
+    assert float(rui[guard_field("paid:42")]) > time.time() + 500
+    assert 0 < r.ttl(user_key("5511999990001")) <= keyschema.PROFILE_TTL
+
+    assert all(k.startswith("v2:") for k in r.scan_iter("*"))  # v1 removido
+
+
+def test_migrated_state_is_honoured(r):
+    _v1(r)
+    keyschema.migrate(r, delete=True, log=lambda *_: None)
+    ana = UserContext(r, "5511999990001")
+    assert ana.get("name") == "Ana Souza" and not ana.upsell_allowed
+    assert not UserContext(r, "5511999990002", guards=["paid:42"], load=False).guard("paid:42")
+    assert UserContext(r, "5511999990002", guards=["paid:43"], load=False).guard("paid:43")
+    # evento visto em v1 continua repetido em v2
+    p = r.pipeline(transaction=False)
+    keyschema.queue_event_seen(p, "order-1")
+    assert keyschema.event_seen(p.execute())
+
+
+def test_migrate_dry_run_and_keep(r):
+    _v1(r)
+    before = sorted(r.scan_iter("*"))
+    keyschema.migrate(r, dry_run=True, log=lambda *_: None)
+    assert sorted(r.scan_iter("*")) == before
+    keyschema.migrate(r, log=lambda *_: None)  # sem --delete: v1 fica
+    assert r.exists("user:5511999990001") and r.exists(user_key("5511999990001"))
+
+
+def test_migrate_batches(r):
+    for i in range(25):
+        r.hset(f"user:55119999{i:05d}", "name", f"C {i}")
+    assert keyschema.migrate(r, delete=True, batch=7, log=lambda *_: None)["user"] == 25
+    assert len(list(r.scan_iter("user:*"))) == 0
+    assert len(list(r.scan_iter(user_key("*")))) == 25
+
+
+def test_event_seen_window(r):
+    now = time.time()
+
+    def seen(evt_id, at):
+        p = r.pipeline(transaction=False)
+        keyschema.queue_event_seen(p, evt_id, at)
+        return keyschema.event_seen(p.execute())
+
+    assert not seen("e1", now)
+    assert seen("e1", now)
+    assert seen("e1", now + keyschema.IDEMPOTENCY_HOURS * 3600)  # ainda na janela
+    assert not seen("e2", now)
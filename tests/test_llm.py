@@ -0,0 +1,143 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm
+from llm import LLMFallback, question_key
+
+
+class _FakeOpenAI(BaseHTTPRequestHandler):
+    """/v1/chat/completions compatível com a OpenAI; "lento" na pergunta atrasa, "erro" responde 500."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        question = body["messages"][-1]["content"]
+        with self.server.lock:
+            self.server.calls.append(question)
+        if "lento" in question:
+            time.sleep(self.server.delay)
+        if "erro" in question:
+            status, out = 500, {"error": {"message": "boom", "type": "server_error"}}
+        else:
+            status, out = 200, {
+                "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "{saud}, {nome}! Sobre: " + question}}],
+            }
+        raw = json.dumps(out).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+
+@pytest.fixture
+def fake_openai():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _FakeOpenAI)
+    srv.daemon_threads = True
+    srv.calls, srv.lock, srv.delay = [], threading.Lock(), 1.5
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def make_llm(r, fake_openai, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_BUDGET_SECONDS", 1.0)
+    monkeypatch.setattr(llm, "LLM_CALL_TIMEOUT", 5)
+
+    def make(**limits):
+        for name, value in limits.items():
+            monkeypatch.setattr(llm, name, value)
+
+        def client():
+            from openai import OpenAI
+            return OpenAI(api_key="test", base_url=f"http://127.0.0.1:{fake_openai.server_address[1]}/v1",
+                          max_retries=0)
+        return LLMFallback(r, client, "test-model", "prompt")
+    return make
+
+
+def _wait(cond, timeout=3.0):
+    end = time.monotonic() + timeout
+    while not cond() and time.monotonic() < end:
+        time.sleep(0.02)
+    return cond()
+
+
+def test_answer_fills_placeholders_and_is_cached(make_llm, fake_openai, r):
+    fb = make_llm()
+    assert fb.answer("vocês entregam no Japão?", "Bom dia", "Ana") == "Bom dia, Ana! Sobre: vocês entregam no Japão?"
+    # mesma pergunta (normalizada) para outro cliente: cache, sem nova chamada
+    assert fb.answer("Vocês entregam no JAPÃO", "Boa noite", "Rui") == "Boa noite, Rui! Sobre: vocês entregam no Japão?"
+    assert len(fake_openai.calls) == 1
+    assert r.get(f"llm:cache:{question_key('vocês entregam no Japão?')}")
+
+
+def test_over_budget_returns_none_and_caches_late_answer(make_llm, fake_openai):
+    fb = make_llm()
+    t0 = time.monotonic()
+    assert fb.answer("pergunta lento", "Oi", "Ana") is None
+    assert time.monotonic() - t0 < 1.4
+    assert _wait(lambda: fb._lru.get(question_key("pergunta lento")) is not None)
+    assert fb.answer("pergunta lento", "Oi", "Ana") == "Oi, Ana! Sobre: pergunta lento"
+    assert len(fake_openai.calls) == 1
+
+
+def test_server_error_falls_back_to_none(make_llm, fake_openai, r):
+    fb = make_llm()
+    assert fb.answer("erro aqui", "Oi", "Ana") is None
+    assert r.get(f"llm:cache:{question_key('erro aqui')}") is None
+
+
+def test_identical_questions_in_flight_share_one_call(make_llm, fake_openai, monkeypatch):
+    fb = make_llm(LLM_BUDGET_SECONDS=3)
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(fb.answer("mesma lento", "Oi", "Ana"))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert out == ["Oi, Ana! Sobre: mesma lento"] * 5
+    assert len(fake_openai.calls) == 1
+
+
+def test_full_pool_answers_none_without_queueing(make_llm, fake_openai):
+    fb = make_llm(LLM_MAX_CONCURRENCY=1, LLM_MAX_QUEUE=0)
+    assert fb.answer("primeira lento", "Oi", "Ana") is None  # ainda rodando em background
+    t0 = time.monotonic()
+    assert fb.answer("segunda", "Oi", "Ana") is None
+    assert time.monotonic() - t0 < 0.1  # nem esperou o orçamento
+    assert _wait(lambda: fb._pending == 0)
+    assert fake_openai.calls == ["primeira lento"]
+
+
+def test_queued_call_past_budget_is_dropped(make_llm, fake_openai):
+    fake_openai.delay = 2.5  # a primeira ocupa a vaga além do orçamento da segunda
+    fb = make_llm(LLM_MAX_CONCURRENCY=1, LLM_MAX_QUEUE=1)
+    assert fb.answer("primeira lento", "Oi", "Ana") is None
+    assert fb.answer("segunda", "Oi", "Ana") is None  # na fila atrás da primeira
+    assert _wait(lambda: fb._pending == 0, timeout=5)
+    assert fake_openai.calls == ["primeira lento"]  # a segunda venceu na fila e não foi à API
+    # com vaga, a mesma pergunta é respondida normalmente
+    assert fb.answer("segunda", "Oi", "Ana") == "Oi, Ana! Sobre: segunda"
+
+
+def test_disabled_without_client(r):
+    assert LLMFallback(r, None, "m", "p").answer("qualquer coisa", "Oi", "Ana") is None
+
+
+def test_main_client_uses_openai_base_url(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "OPENAI_BASE_URL", "http://127.0.0.1:1/v1")
+    monkeypatch.setattr(main, "OPENAI_API_KEY", "test")
+    assert str(main._openai_client().base_url).startswith("http://127.0.0.1:1/v1")
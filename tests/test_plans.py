@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+
+from plans import PlanRunner, AsyncPlanRunner, run_steps, text_step, file_step
+
+
+def _recorder(fail=None, delay=0.0):
+    calls, lock = [], threading.Lock()
+
+    def send(phone, *args):
+        time.sleep(delay)
+        with lock:
+            calls.append((phone, args[0]))
+        return (fail or {}).get(args[0], {"ok": True, "data": {"messageId": f"m-{args[0]}"}})
+    return calls, {"text": send, "file": send, "image": send}
+
+
+def test_run_steps_stops_at_retryable_and_skips_permanent():
+    calls, senders = _recorder(fail={"b": {"ok": False, "status": 400, "error": "x"}, "c": {"ok": False, "status": 503}})
+    failed = []
+    steps = [text_step("a"), text_step("b"), text_step("c"), text_step("d")]
+    i, res = run_steps("5511999990001", steps, senders, on_failed=lambda i, s, res: failed.append(i))
+    assert (i, res["status"]) == (2, 503)
+    assert [c[1] for c in calls] == ["a", "b", "c"]
+    assert failed == [1]
+
+
+def test_runner_keeps_order_per_phone_and_parallel_across_phones():
+    calls, senders = _recorder(delay=0.02)
+    sent = []
+    runner = PlanRunner(senders, on_sent=lambda job, res: sent.append((job["id"], res["data"]["messageId"])), workers=4)
+    phones = [f"55119999900{i:02d}" for i in range(4)]
+    t0 = time.monotonic()
+    for phone in phones:
+        runner.submit(phone, [text_step(f"{phone}-1"), file_step(f"{phone}-2")])
+        runner.submit(phone, [text_step(f"{phone}-3")])
+    assert runner.join(timeout=5)
+    assert time.monotonic() - t0 < 0.02 * 12 * 0.75  # 12 envios de 20ms, 4 telefones em paralelo
+    for phone in phones:
+        assert [c[1] for c in calls if c[0] == phone] == [f"{phone}-1", f"{phone}-2", f"{phone}-3"]
+    assert len(sent) == 12 and all(job_id.startswith("plan-") for job_id, _ in sent)
+
+
+def test_runner_survives_sender_exceptions():
+    def boom(phone, text):
+        raise RuntimeError("boom")
+    runner = PlanRunner({"text": boom})
+    runner.submit("5511999990001", [text_step("a")])
+    assert runner.join(timeout=5)
+    calls, senders = _recorder()
+    runner.senders = senders
+    runner.submit("5511999990001", [text_step("b")])
+    assert runner.join(timeout=5)
+    assert calls == [("5511999990001", "b")]
+
+
+def test_async_runner_order_per_phone():
+    calls = []
+
+    async def send(phone, text):
+        await asyncio.sleep(0.01)
+        calls.append((phone, text))
+        return {"ok": True}
+
+    async def main():
+        runner = AsyncPlanRunner({"text": send})
+        for phone in ("5511999990001", "5511999990002"):
+            runner.submit(phone, [text_step("1"), text_step("2")])
+            runner.submit(phone, [text_step("3")])
+        await runner.join()
+
+    asyncio.run(main())
+    for phone in ("5511999990001", "5511999990002"):
+        assert [t for p, t in calls if p == phone] == ["1", "2", "3"]
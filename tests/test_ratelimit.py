@@ -0,0 +1,63 @@
+import pytest
+
+import ratelimit
+from ratelimit import RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time() do ratelimit sob controle do teste (a janela deslizante depende dele)."""
+    t = [1_700_000_080.0]  # 40s dentro do minuto
+    monkeypatch.setattr(ratelimit.time, "time", lambda: t[0])
+    return t
+
+
+@pytest.fixture
+def no_lease(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RL_LEASE_DIV", 0)
+
+
+def test_per_minute_limit(r, clock, no_lease):
+    rl = RateLimiter(r, per_min=5, per_hour=100)
+    assert [rl.allow("5511999990001") for _ in range(7)] == [True] * 5 + [False] * 2
+    assert rl.allow("5511999990002")  # outro telefone, outra cota
+
+
+def test_per_hour_limit(r, clock, no_lease):
+    rl = RateLimiter(r, per_min=100, per_hour=3)
+    assert [rl.allow("5511999990001") for _ in range(4)] == [True] * 3 + [False]
+    clock[0] += 120  # janela do minuto já virou; a da hora não
+    assert not rl.allow("5511999990001")
+
+
+def test_window_slides(r, clock, no_lease):
+    rl = RateLimiter(r, per_min=4, per_hour=100)
+    assert all(rl.allow("5511999990001") for _ in range(4))
+    clock[0] += 30  # 10s no minuto seguinte: 4 * (50/60) da janela anterior ainda pesam
+    assert not rl.allow("5511999990001")
+    clock[0] += 45  # 55s no minuto seguinte: 4 * (5/60) + 0
+    assert [rl.allow("5511999990001") for _ in range(4)] == [True] * 3 + [False]
+
+
+def test_rejected_hits_are_not_counted(r, clock, no_lease):
+    rl = RateLimiter(r, per_min=2, per_hour=100)
+    for _ in range(10):
+        rl.allow("5511999990001")
+    assert r.hget("rl:5511999990001", "mc") == "2"
+
+
+def test_local_lease_skips_redis_and_carries_hits(r, clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, "RL_LEASE_DIV", 4)
+    rl = RateLimiter(r, per_min=40, per_hour=1000)
+    assert rl.allow("5511999990001")  # Redis: 39 livres → cota local de 9
+    assert r.hget("rl:5511999990001", "mc") == "1"
+    assert all(rl.allow("5511999990001") for _ in range(9))
+    assert r.hget("rl:5511999990001", "mc") == "1"  # sem round trip
+    assert rl.allow("5511999990001")  # cota acabou: os 9 locais são somados
+    assert r.hget("rl:5511999990001", "mc") == "11"
+
+
+def test_lease_never_exceeds_limit(r, clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, "RL_LEASE_DIV", 1)  # um processo: a cota é toda a folga
+    rl = RateLimiter(r, per_min=10, per_hour=1000)
+    assert sum(rl.allow("5511999990001") for _ in range(30)) == 10
@@ -0,0 +1,160 @@
+from datetime import datetime
+
+import pytest
+
+import reminders
+from reminders import ReminderStore, in_quiet_hours, process_due, run
+from userctx import UserContext
+
+PHONE = "5511999990001"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    t = [1_700_000_000.5]
+    monkeypatch.setattr(reminders.time, "time", lambda: t[0])
+    return t
+
+
+@pytest.fixture(autouse=True)
+def delays(monkeypatch):
+    monkeypatch.setattr(reminders, "CART_DELAYS", [60, 1440])
+    monkeypatch.setattr(reminders, "PIX_DELAYS", [30])
+    monkeypatch.setattr(reminders, "REMINDER_RETRY_SECONDS", 300)
+    monkeypatch.setattr(reminders, "REMINDER_QUIET_START", 21)
+    monkeypatch.setattr(reminders, "REMINDER_QUIET_END", 8)
+
+
+@pytest.fixture
+def store(r):
+    return ReminderStore(r)
+
+
+class Sender:
+    def __init__(self):
+        self.sent = []
+
+    def __call__(self, phone, text):
+        self.sent.append((phone, text))
+        return {"ok": True}
+
+
+def guard_for(r):
+    def guard(phone, key):
+        return UserContext(r, phone, guards=[key], load=False).guard(key)
+    return guard
+
+
+def allow_all(phone):
+    return True
+
+
+def test_due_reminders_are_sent_once(store, r, clock):
+    store.schedule_cart(PHONE, "Ana", "https://loja/cart/1")
+    send = Sender()
+    assert process_due(store, send, allow_all, guard_for(r)) == 0  # ainda não venceu
+    clock[0] += 60 * 60
+    assert process_due(store, send, allow_all, guard_for(r)) == 1
+    assert send.sent[0][0] == PHONE and "https://loja/cart/1" in send.sent[0][1]
+    assert process_due(store, send, allow_all, guard_for(r)) == 0
+    assert store.stats() == {"pending": 1, "due": 0}  # a etapa de 24h continua agendada
+    assert r.smembers(f"rem:phone:{PHONE}") == {f"cart:{PHONE}:2"}
+
+
+def test_new_abandonment_replaces_the_previous_one(store, r, clock):
+    store.schedule_cart(PHONE, "Ana", "https://loja/cart/1")
+    store.schedule_cart(PHONE, "Ana", "https://loja/cart/2")
+    clock[0] += 60 * 60
+    send = Sender()
+    process_due(store, send, allow_all, guard_for(r))
+    assert len(send.sent) == 1 and "https://loja/cart/2" in send.sent[0][1]
+
+
+def test_sent_guard_skips_a_reminder_already_sent(store, r, clock):
+    store.schedule_pix(PHONE, 123, "Ana", "https://pix/1", "000201")
+    guard = guard_for(r)
+    assert guard(PHONE, "rem:pix:123:1")  # outro worker já enviou (ou job reposto)
+    clock[0] += 30 * 60
+    send = Sender()
+    assert process_due(store, send, allow_all, guard) == 1
+    assert send.sent == [] and store.stats()["pending"] == 0
+    assert not r.exists(f"rem:phone:{PHONE}")
+
+
+def test_rate_limited_reminder_is_rescheduled(store, r, clock):
+    store.schedule_pix(PHONE, 123, "Ana", "https://pix/1", "000201")
+    clock[0] += 30 * 60
+    send = Sender()
+    assert process_due(store, send, lambda phone: False, guard_for(r)) == 1
+    assert send.sent == []
+    assert r.zscore("rem:due", f"pix:{PHONE}:123:1") == clock[0] + 300
+    assert r.sismember(f"rem:phone:{PHONE}", f"pix:{PHONE}:123:1")  # ainda cancelável
+
+    clock[0] += 299
+    assert process_due(store, send, allow_all, guard_for(r)) == 0
+    clock[0] += 1
+    assert process_due(store, send, allow_all, guard_for(r)) == 1
+    assert len(send.sent) == 1 and "000201" in send.sent[0][1]
+
+
+def test_per_second_cap_is_shared_between_workers(store, r, clock):
+    for i in range(7):
+        store.schedule_pix(f"55119999900{i:02d}", i, "Ana", "https://pix/1", "")
+    clock[0] += 30 * 60
+    send = Sender()
+    assert store.claim(limit=2, max_per_second=5)[1] != []  # outro worker, no mesmo segundo
+    assert process_due(store, send, allow_all, guard_for(r)) == 3  # sobraram 3 do teto de 5
+    assert process_due(store, send, allow_all, guard_for(r)) == -1
+    clock[0] += 1
+    assert process_due(store, send, allow_all, guard_for(r)) == 2
+
+
+def test_cancel_removes_pending_reminders(store, r, clock):
+    store.schedule_cart(PHONE, "Ana", "https://loja/cart/1")
+    store.schedule_pix(PHONE, 123, "Ana", "https://pix/1", "")
+    assert store.cancel(PHONE, "cart") == 3
+    assert sorted(r.zrange("rem:due", 0, -1)) == [f"pix:{PHONE}:123:1"]
+    store.cancel(PHONE)
+    clock[0] += 2 * 86400
+    send = Sender()
+    assert process_due(store, send, allow_all, guard_for(r)) == 0 and send.sent == []
+
+
+def test_order_paid_cancels_the_reminders(r, clock, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main.r, "_client", r)
+    monkeypatch.setattr(main, "CARTPANDA_HMAC_SECRET", "")
+    main.reminders.schedule_cart(PHONE, "Ana", "https://loja/cart/1")
+    main.reminders.schedule_pix(PHONE, 77, "Ana", "https://pix/1", "")
+    paid = {"event": "order.paid", "order": {
+        "id": 77, "order_number": 77, "payment_status": "3", "phone": PHONE,
+        "customer": {"first_name": "Ana"}, "digital_attachment": "https://x/ebook",
+    }}
+    assert main.app.test_client().post("/webhook/cartpanda", json=paid).get_json() == {"ok": True}
+    assert main.reminders.stats()["pending"] == 0
+    assert not r.exists(f"rem:phone:{PHONE}")
+
+
+@pytest.mark.parametrize("hour, quiet", [(20, False), (21, True), (23, True), (0, True), (7, True), (8, False)])
+def test_quiet_hours_wrap_midnight(hour, quiet):
+    assert in_quiet_hours(datetime(2024, 1, 1, hour, 30)) is quiet
+
+
+def test_quiet_hours_defer_reminders_until_morning(store, r, clock, monkeypatch):
+    store.schedule_cart(PHONE, "Ana", "https://loja/cart/1")
+    clock[0] += 60 * 60
+    quiet, sleeps = [True], []
+    monkeypatch.setattr(reminders, "in_quiet_hours", lambda: quiet[0])
+    monkeypatch.setattr(reminders.time, "sleep", sleeps.append)
+    send = Sender()
+
+    def stop_after(n):
+        return lambda: len(sleeps) >= n
+
+    run(store, send, allow_all, guard_for(r), stop=stop_after(3), poll=0.01)
+    assert send.sent == [] and store.stats()["due"] == 1  # nada retirado durante a noite
+
+    quiet[0] = False
+    run(store, send, allow_all, guard_for(r), stop=stop_after(4), poll=0.01)
+    assert [p for p, _ in send.sent] == [PHONE] and store.stats()["due"] == 0
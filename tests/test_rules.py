@@ -0,0 +1,150 @@
+import json
+import os
+
+import pytest
+
+import rules
+from catalog import Catalog
+from rules import RuleSet, RuleStore, apply_order, format_history, parse_history
+
+NOW = 1_700_000_000
+DAY = 86400
+
+
+def _set(*specs, **doc):
+    return RuleSet({"upsell": list(specs), **doc})
+
+
+def _items(*skus):
+    return [(s.lower(),) for s in skus]
+
+
+def test_multi_item_rule_needs_every_item():
+    rs = _set({"id": "v1", "when": "TABIB_V1", "offer": "TABIB_V2", "text": "v2"},
+              {"id": "combo", "when": ["TABIB_V1", "TABIB_V3"], "offer": "TABIB_FULL", "text": "full"})
+    assert rs.upsell(_items("TABIB_V1"))["rule"] == "v1"
+    assert rs.upsell(_items("TABIB_V3")) is None
+    assert rs.upsell(_items("TABIB_V3", "TABIB_V1"))["rule"] == "combo"  # mais itens vence o empate
+
+
+def test_priority_then_size_then_declaration_order():
+    specs = [{"id": "a", "when": ["X"], "offer": "A", "text": "a"},
+             {"id": "b", "when": ["X"], "offer": "B", "text": "b"},
+             {"id": "c", "when": ["X", "Y"], "offer": "C", "text": "c"}]
+    rs = _set(*specs)
+    assert rs.upsell(_items("X"))["rule"] == "a"
+    assert rs.upsell(_items("X", "Y"))["rule"] == "c"
+    rs = _set(*specs, {"id": "d", "when": ["X"], "offer": "D", "text": "d", "priority": 5})
+    assert rs.upsell(_items("X", "Y"))["rule"] == "d"
+
+
+def test_after_within_days_needs_a_recent_purchase():
+    rs = _set({"id": "recent", "when": ["TABIB_V4"], "after": ["KURIMA", "ANTIDOTO"], "within_days": 30,
+               "offer": "BALSAMO", "text": "balsamo", "priority": 1},
+              {"id": "any", "when": ["TABIB_V4"], "after": "KURIMA", "offer": "TABIB_KIDS", "text": "kids"})
+    v4 = _items("TABIB_V4")
+    assert rs.upsell(v4, {}, NOW) is None
+    assert rs.upsell(v4, {"antidoto": NOW - 10 * DAY}, NOW)["rule"] == "recent"
+    assert rs.upsell(v4, {"kurima": NOW - 31 * DAY}, NOW)["rule"] == "any"  # sem within_days: qualquer data
+
+
+def test_offer_already_owned_falls_to_the_next_rule():
+    rs = _set({"id": "v2", "when": ["TABIB_V1"], "offer": "TABIB_V2", "text": "v2", "priority": 1},
+              {"id": "full", "when": ["TABIB_V1"], "offer": "TABIB_FULL", "text": "full"},
+              skip_owned_days=90)
+    assert rs.upsell(_items("TABIB_V1"), {"tabib_v2": NOW - 10 * DAY}, NOW)["rule"] == "full"
+    assert rs.upsell(_items("TABIB_V1"), {"tabib_v2": NOW - 100 * DAY}, NOW)["rule"] == "v2"  # faz tempo
+    assert rs.upsell(_items("TABIB_V1", "TABIB_V2"), {}, NOW)["rule"] == "full"  # está no pedido
+    assert rs.upsell(_items("TABIB_V1"), {"tabib_v2": NOW, "tabib_full": NOW}, NOW) is None
+
+
+def test_history_round_trip():
+    history = parse_history("tabib_v1:100|kurima:300|tabib_v1:200|lixo|x:y")
+    assert history == {"tabib_v1": 200.0, "kurima": 300.0}
+    value = format_history(history, _items("BALSAMO"), now=400, limit=2)
+    assert value == "balsamo:400|kurima:300"
+    offer, bought = apply_order(_set({"when": "BALSAMO", "offer": "KURIMA", "text": "k"}), _items("BALSAMO"),
+                                {"bought": value}, now=500)
+    assert offer is None and bought.startswith("balsamo:500|")  # Kurimã já é dele
+
+
+@pytest.mark.parametrize("spec, error", [
+    ({"offer": "X"}, "when"),
+    ({"when": [], "offer": "X"}, "when"),
+    ({"when": ["A", ""], "offer": "X"}, "when"),
+    ({"when": ["A"]}, "offer"),
+    ({"when": ["A"], "offer": "X", "priority": "alta"}, "priority"),
+    ({"when": ["A"], "offer": "X", "after": [1]}, "after"),
+])
+def test_invalid_rules(spec, error):
+    with pytest.raises(ValueError, match=error):
+        _set(spec)
+
+
+def test_default_rules_with_the_real_catalog():
+    rs = RuleSet(rules.DEFAULT_RULES, catalog=Catalog())
+    keys = [rs.item_keys({"title": "*Tabib - Volume 1", "sku": "cp-991"})]
+    assert keys == [("tabib_v1", "cp-991", "*tabib - volume 1")]
+    assert rs.upsell(keys, {}, NOW)["offer"] == "tabib_v2"
+    assert "checkout/166919682" in rs.upsell(keys, {}, NOW)["text"]
+
+
+def test_tabib_kids_buyers_still_get_the_balsamo_offer():
+    rs = RuleSet(rules.DEFAULT_RULES, catalog=Catalog())
+    keys = [rs.item_keys({"title": "*TABIB KIDS"})]
+    assert keys == [("*tabib kids",)]  # fora do catálogo: fica a chave do título
+    offer = rs.upsell(keys, {}, NOW)
+    assert offer["rule"] == "tabib-kids" and offer["text"].startswith("Bálsamo - Pomadas naturais: https://")
+    assert rs.upsell([rs.item_keys({"variant": {"title": "*Tabib Kids"}})], {}, NOW)["offer"] == "balsamo"
+
+
+# ---- RuleStore: Redis → arquivo → padrão
+@pytest.fixture
+def store(r, monkeypatch):
+    monkeypatch.setattr(rules, "RULES_CHECK_SECONDS", 0)
+    return RuleStore(r)
+
+
+DOC = {"upsell": [{"id": "v1", "when": "TABIB_V1", "offer": "TABIB_V2", "text": "v2"}],
+       "fallback": {"TABIB_V1": "https://drive/v1"}}
+
+
+def test_published_rules_replace_the_defaults(store):
+    assert store.current().version == "default"
+    assert store.publish(DOC) == 1
+    rs = store.current()
+    assert rs.version == "redis:1" and [r.id for r in rs.rules] == ["v1"]
+    assert rs.drive_link([("x",), ("tabib_v1",)]) == "https://drive/v1"
+    store.clear()
+    assert store.current().version == "default"
+
+
+def test_invalid_published_document_keeps_the_previous_version(store, r):
+    store.publish(DOC)
+    assert store.current().version == "redis:1"
+    with pytest.raises(ValueError):
+        store.publish({"upsell": [{"when": "X"}]})  # publish valida antes de gravar
+    assert r.get(rules.RULES_VER_KEY) == "1"
+
+    # gravado por fora (ou versão antiga do publish): ignorado, fica a versão 1
+    r.set(rules.RULES_DOC_KEY, json.dumps({"upsell": "nope"}))
+    r.incr(rules.RULES_VER_KEY)
+    assert store.current().version == "redis:1"
+    r.set(rules.RULES_DOC_KEY, "{")
+    r.incr(rules.RULES_VER_KEY)
+    assert store.current().version == "redis:1"
+
+    store.publish(dict(DOC, skip_owned_days=30))
+    assert store.current().version == "redis:4"
+
+
+def test_file_rules_reload_on_mtime(r, tmp_path, monkeypatch):
+    monkeypatch.setattr(rules, "RULES_CHECK_SECONDS", 0)
+    path = tmp_path / "regras.json"
+    path.write_text(json.dumps(DOC), encoding="utf-8")
+    store = RuleStore(r, path=str(path))
+    first = store.current()
+    assert first.version.startswith("file:") and store.current() is first
+    path.write_text("{", encoding="utf-8")  # em edição
+    os.utime(path, (NOW, NOW))
+    assert store.current() is first
@@ -0,0 +1,27 @@
+import flows
+from templates import Template
+
+
+def test_render_matches_str_format():
+    for text, fields in [
+        ("{saud}, {nome}! 100% garantido: {link}", {"saud": "Oi", "nome": "Ana", "link": "https://x"}),
+        ("Use {{code}}", {}),
+        ("{{literal}} e {nome}", {"nome": "Ana"}),
+        ("{nome:>6}|{n!r}", {"nome": "Ana", "n": "x"}),
+    ]:
+        assert Template(text).render_map(fields) == text.format_map(fields)
+
+
+def test_render_many_splits_names_and_uses_common():
+    rows = [{"nome": "  Ana Maria Souza", "link": "a"}, {"link": "b"}, {"nome": "   ", "link": "c"}]
+    out = flows.render_many("{nome}: {link} {cupom}", rows, {"nome": "Fulano de Tal", "cupom": "X10"})
+    assert out == ["Ana: a X10", "Fulano: b X10", "cliente: c X10"]
+
+
+def test_render_many_matches_single_render():
+    rows = [{"nome": f"Cliente {i} Silva", "link": f"https://loja/c/{i}", "pix_code": f"0002{i}"} for i in range(20)]
+    assert flows.render_many("COPY_LEMBRETE_PIX", rows) == [
+        flows.render("COPY_LEMBRETE_PIX", saud=flows.saudacao(), nome=flows.first_name(r["nome"]),
+                     link=r["link"], pix_code=r["pix_code"])
+        for r in rows
+    ]
@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+import pytest
+import requests
+
+import zapi_pool
+from zapi_pool import Instance, ZapiPool, TokenBucket, can_failover, error_result
+
+PHONES = [f"55119{i:08d}" for i in range(2000)]
+
+
+def _pool(*ids, **weights):
+    return ZapiPool([Instance(i, f"http://{i}", rate=0, weight=weights.get(i, 1)) for i in ids])
+
+
+class Post:
+    """post(instância) falso: resultado por id de instância (padrão ok), registrando as chamadas."""
+
+    def __init__(self, **results):
+        self.results, self.calls = results, []
+
+    def __call__(self, inst):
+        self.calls.append(inst.id)
+        return dict(self.results.get(inst.id, {"ok": True}))
+
+
+@pytest.fixture(autouse=True)
+def failover(monkeypatch):
+    monkeypatch.setattr(zapi_pool, "ZAPI_FAILOVER_ERRORS", 2)
+    monkeypatch.setattr(zapi_pool, "ZAPI_FAILOVER_COOLDOWN", 60)
+    monkeypatch.setattr(zapi_pool, "ZAPI_FAILOVER_TRIES", 2)
+
+
+def test_same_phone_same_instance():
+    a, b = _pool("n1", "n2", "n3"), _pool("n1", "n2", "n3")
+    owners = {p: a.instance_for(p).id for p in PHONES}
+    assert owners == {p: b.instance_for(p).id for p in PHONES}
+    share = {i: sum(1 for o in owners.values() if o == i) / len(PHONES) for i in ("n1", "n2", "n3")}
+    assert all(0.2 < s < 0.47 for s in share.values())
+
+
+def test_removing_an_instance_only_moves_its_phones():
+    before = {p: _pool("n1", "n2", "n3").instance_for(p).id for p in PHONES}
+    after_pool = _pool("n1", "n3")
+    moved = [p for p in PHONES if after_pool.instance_for(p).id != before[p]]
+    assert moved and all(before[p] == "n2" for p in moved)
+    assert len(moved) == sum(1 for o in before.values() if o == "n2")
+
+
+def test_weight_takes_a_bigger_share():
+    pool = _pool("n1", "n2", n2=3)
+    share = sum(1 for p in PHONES if pool.instance_for(p).id == "n2") / len(PHONES)
+    assert 0.6 < share < 0.9
+
+
+@pytest.mark.parametrize("res", [
+    error_result(ConnectionError("refused"), connect_failed=True),
+    {"ok": False, "status": 429},
+    {"ok": False, "status": 503},
+])
+def test_fails_over_when_the_message_surely_did_not_leave(res):
+    pool = _pool("n1", "n2")
+    phone = PHONES[0]
+    first, second = [i.id for i in pool.candidates(phone)]
+    post = Post(**{first: res})
+    out = pool.send(phone, post)
+    assert post.calls == [first, second]
+    assert out["ok"] and out["instance"] == second
+
+
+@pytest.mark.parametrize("res", [
+    error_result(requests.ReadTimeout("read timed out"), connect_failed=False),
+    {"ok": False, "status": 400, "error": "invalid phone"},
+])
+def test_no_failover_when_the_message_may_have_left_or_is_invalid(res):
+    pool = _pool("n1", "n2")
+    phone = PHONES[0]
+    first = pool.instance_for(phone).id
+    post = Post(**{first: res})
+    out = pool.send(phone, post)
+    assert post.calls == [first]
+    assert not out["ok"] and out["instance"] == first
+
+
+def test_can_failover():
+    assert can_failover({"ok": False, "connect": True, "error": "x"})
+    assert not can_failover({"ok": False, "uncertain": True, "error": "x"})
+    assert not can_failover({"ok": False, "uncertain": True, "status": 503})
+    assert not can_failover({"ok": True, "status": 200})
+    assert not can_failover({"ok": False, "status": 404})
+
+
+def test_main_classifies_read_timeout_as_uncertain():
+    import main
+
+    read = requests.ReadTimeout("read timed out")
+    connect = requests.ConnectTimeout("connect timed out")
+    assert not main._connect_failed(read) and main._connect_failed(connect)
+    assert error_result(read, main._connect_failed(read)).get("uncertain")
+
+
+def test_failing_instance_leaves_the_ring_until_cooldown(monkeypatch):
+    clock = [1_000.0]
+    monkeypatch.setattr(zapi_pool.time, "time", lambda: clock[0])
+    pool = _pool("n1", "n2")
+    phone = PHONES[0]
+    first, second = [i.id for i in pool.candidates(phone)]
+    down = Post(**{first: {"ok": False, "status": 502}})
+    pool.send(phone, down)
+    assert pool.instance_for(phone).id == first  # 1 falha de ZAPI_FAILOVER_ERRORS=2
+    pool.send(phone, down)
+    assert pool.instance_for(phone).id == second  # fora do anel
+    assert [s["healthy"] for s in pool.state() if s["id"] == first] == [False]
+
+    ok = Post()
+    assert pool.send(phone, ok)["instance"] == second and ok.calls == [second]
+    clock[0] += 61  # cooldown venceu: volta para o número de sempre
+    assert pool.instance_for(phone).id == first
+    assert pool.send(phone, ok)["instance"] == first
+
+
+def test_uncertain_results_count_as_instance_failures():
+    pool = _pool("n1", "n2")
+    phone = PHONES[0]
+    first = pool.instance_for(phone).id
+    post = Post(**{first: error_result(TimeoutError("read"), connect_failed=False)})
+    pool.send(phone, post)
+    pool.send(phone, post)
+    assert post.calls == [first, first]  # nunca reenviou por outra instância
+    assert pool.instance_for(phone).id != first  # mas a instância saiu do anel
+
+
+def test_success_resets_the_failure_count():
+    pool = _pool("n1", "n2")
+    phone = PHONES[0]
+    first = pool.instance_for(phone).id
+    pool.send(phone, Post(**{first: {"ok": False, "status": 500}}))
+    pool.send(phone, Post())
+    pool.send(phone, Post(**{first: {"ok": False, "status": 500}}))
+    assert pool.instance_for(phone).id == first
+
+
+def test_asend_fails_over_like_send():
+    pool = _pool("n1", "n2")
+    phone = PHONES[0]
+    first, second = [i.id for i in pool.candidates(phone)]
+    calls = []
+
+    async def post(inst):
+        calls.append(inst.id)
+        return {"ok": False, "status": 503} if inst.id == first else {"ok": True}
+
+    out = asyncio.run(pool.asend(phone, post))
+    assert calls == [first, second] and out["instance"] == second
+
+
+def test_token_bucket_paces_sends():
+    bucket = TokenBucket(rate=100, burst=2)
+    assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+    assert 0 < bucket.reserve() <= 0.011
+    time.sleep(0.03)
+    assert bucket.reserve() == 0.0
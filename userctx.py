@@ -0,0 +1,220 @@
+# userctx.py
+#
+# Contexto de usuário por requisição.
+# - Perfil, bloqueio de upsell e guards de envio moram num hash só (v2:u:{phone}, keyschema.py);
+#   carregar o perfil e adquirir os guards é um único EVALSHA
+# - Bufferiza escritas (perfil, bloqueio, chaves avulsas) e grava tudo num pipeline no flush
+# - Guards adquiridos e não usados (ex.: rate limit barrou o envio) são liberados no flush
+#
+# CountingRedis conta round trips por requisição (comando avulso = 1, pipeline = 1)
+# e, com métricas ligadas, mede a latência de cada um (metrics.py).
+# LazyRedis adia a criação do cliente (e do pool) para o primeiro comando.
+#
+import time
+import threading
+import contextvars
+
+from redis import Redis
+from redis.client import Pipeline
+
+import keyschema
+from metrics import ENABLED as METRICS_ENABLED, observe_redis
+
+_rt = contextvars.ContextVar("redis_round_trips", default=0)
+
+
+def reset_round_trips():
+    _rt.set(0)
+
+
+def round_trips() -> int:
+    return _rt.get()
+
+
+def _count():
+    _rt.set(_rt.get() + 1)
+
+
+class CountingPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        if self.command_stack:
+            _count()
+        if not METRICS_ENABLED:
+            return super().execute(raise_on_error)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            observe_redis("PIPELINE", time.perf_counter() - t0)
+
+
+class CountingRedis(Redis):
+    def execute_command(self, *args, **options):
+        _count()
+        if not METRICS_ENABLED:
+            return super().execute_command(*args, **options)
+        t0 = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            observe_redis(str(args[0]).upper(), time.perf_counter() - t0)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class _LazyScript:
+    """register_script() de um LazyRedis: registra no cliente real na primeira execução."""
+
+    def __init__(self, lazy, script):
+        self.registered_client = lazy
+        self.script = script
+        self._script = None
+
+    def __call__(self, keys=None, args=None, client=None):
+        real = self.registered_client.client
+        if self._script is None or self._script.registered_client is not real:
+            self._script = real.register_script(self.script)
+        return self._script(keys=keys, args=args, client=client)
+
+
+class LazyRedis:
+    """Proxy para um cliente criado por factory() no primeiro uso (import sem I/O nem config)."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    @property
+    def created(self) -> bool:
+        return self._client is not None
+
+    def register_script(self, script):
+        return _LazyScript(self, script)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+_scripts = {}
+
+
+def _load_script(r):
+    """Script de carga registrado uma vez por cliente Redis."""
+    s = _scripts.get(id(r))
+    if s is None or s.registered_client is not r:
+        s = _scripts[id(r)] = r.register_script(keyschema.LOAD_LUA)
+    return s
+
+
+class UserContext:
+    def __init__(self, r, phone: str, guards=(), guard_ttl_min: int = 90, load: bool = True,
+                 upsell_cooldown_hours: int = 24):
+        self._init(r, phone, guards, guard_ttl_min, load, upsell_cooldown_hours)
+        if self._should_load():
+            self._apply_load(_load_script(r)(keys=[self.key], args=self._load_args()))
+
+    def _init(self, r, phone, guards, guard_ttl_min, load, upsell_cooldown_hours):
+        self.r = r
+        self.phone = phone
+        self.key = keyschema.user_key(phone)
+        self.user = {}
+        self.upsell_allowed = True
+        self.upsell_cooldown_hours = upsell_cooldown_hours
+        self._load = load
+        self._guard_keys = list(guards)
+        self._guard_ttl_min = guard_ttl_min
+        self._guards = {}
+        self._used = set()
+        self._hset = {}
+        self._set = {}
+
+    def _should_load(self) -> bool:
+        return bool(self.phone) and (self._load or bool(self._guard_keys))
+
+    def _load_args(self):
+        return keyschema.load_args(self._guard_keys, self._guard_ttl_min * 60, self._load)
+
+    def _apply_load(self, res):
+        oks, h = keyschema.parse_load(res, len(self._guard_keys), self._load)
+        if h is not None:
+            self.user, self.upsell_allowed = keyschema.split_user(h)
+        self._guards = dict(zip(self._guard_keys, oks))
+
+    def get(self, field: str, default=None):
+        return self.user.get(field, default)
+
+    def set(self, **fields):
+        fields = {k: v for k, v in fields.items() if v is not None}
+        self.user.update(fields)
+        self._hset.update(fields)
+
+    def set_key(self, key: str, value: str):
+        self._set[key] = value
+
+    def guard(self, key: str) -> bool:
+        """Mesmo contrato do sent_guard: True só na primeira vez dentro do TTL."""
+        if key not in self._guards:
+            raise KeyError(f"guard não pré-carregado: {key}")
+        self._used.add(key)
+        return self._guards[key]
+
+    def block_upsell(self):
+        self.upsell_allowed = False
+        self._hset[keyschema.UPSELL_FIELD] = int(time.time()) + self.upsell_cooldown_hours * 3600
+
+    def _queue_flush(self):
+        """Pipeline com as escritas pendentes, ou None se não há nada a gravar."""
+        if not self.phone:
+            return None
+        released = [g for g, ok in self._guards.items() if ok and g not in self._used]
+        if not (self._hset or self._set or released):
+            return None
+        p = self.r.pipeline(transaction=False)
+        if self._hset:
+            keyschema.queue_profile(p, self.phone, self._hset)
+        for k, v in self._set.items():
+            p.set(k, v)
+        if released:
+            p.hdel(self.key, *(keyschema.guard_field(g) for g in released))
+        return p
+
+    def _after_flush(self):
+        self._hset, self._set = {}, {}
+        self._guards = {g: ok for g, ok in self._guards.items() if g in self._used}
+
+    def flush(self):
+        p = self._queue_flush()
+        if p is not None:
+            p.execute()
+            self._after_flush()
+
+
+class AsyncUserContext(UserContext):
+    """Versão para redis.asyncio: use `await AsyncUserContext.load(...)` e `await ctx.flush()`."""
+
+    def __init__(self, r, phone: str, guards=(), guard_ttl_min: int = 90, load: bool = True,
+                 upsell_cooldown_hours: int = 24):
+        self._init(r, phone, guards, guard_ttl_min, load, upsell_cooldown_hours)
+
+    @classmethod
+    async def load(cls, r, phone: str, **kw) -> "AsyncUserContext":
+        ctx = cls(r, phone, **kw)
+        if ctx._should_load():
+            ctx._apply_load(await _load_script(r)(keys=[ctx.key], args=ctx._load_args()))
+        return ctx
+
+    async def flush(self):
+        p = self._queue_flush()
+        if p is not None:
+            await p.execute()
+            self._after_flush()
@@ -0,0 +1,174 @@
+# zapi_pool.py
+#
+# Pool de instâncias Z-API (vários números de WhatsApp).
+#
+# ZAPI_INSTANCES_JSON='[{"id": "n1", "instance": "...", "token": "...", "client_token": "...", "rate": 5, "burst": 10},
+#                       {"id": "n2", "base_url": "https://...", "client_token": "...", "weight": 2}]'
+# Sem ZAPI_INSTANCES_JSON o pool tem uma instância só (ZAPI_INSTANCE/ZAPI_TOKEN ou ZAPI_BASE_URL).
+#
+# - Telefone → instância por hash consistente (anel com nós virtuais, "weight" multiplica os nós):
+#   o cliente fala sempre com o mesmo número, e incluir/remover uma instância só move os
+#   telefones dela
+# - Token bucket por instância ("rate" envios/s, "burst"), por processo: com N dispatchers,
+#   configure rate/N. O envio espera a vez em vez de estourar o limite da Z-API
+# - ZAPI_FAILOVER_ERRORS falhas seguidas (rede, timeout, 429, 5xx) tiram a instância do anel por
+#   ZAPI_FAILOVER_COOLDOWN segundos
+# - O envio que falhou só tenta a próxima instância se o pedido com certeza não foi aceito:
+#   erro de conexão, 429 ou 5xx. Timeout de leitura e outras falhas no meio do POST
+#   ("uncertain", ver error_result) são finais: a mensagem pode ter saído pelo número original
+#
+import os
+import json
+import time
+import bisect
+import asyncio
+import hashlib
+import threading
+
+import metrics
+from dispatcher import is_retryable
+
+ZAPI_VNODES = int(os.getenv("ZAPI_VNODES", "64"))
+ZAPI_RATE_PER_SECOND = float(os.getenv("ZAPI_RATE_PER_SECOND", "0"))  # padrão por instância; 0 = sem limite
+ZAPI_BURST = float(os.getenv("ZAPI_BURST", "10"))
+ZAPI_FAILOVER_ERRORS = int(os.getenv("ZAPI_FAILOVER_ERRORS", "3"))
+ZAPI_FAILOVER_COOLDOWN = float(os.getenv("ZAPI_FAILOVER_COOLDOWN", "60"))
+ZAPI_FAILOVER_TRIES = int(os.getenv("ZAPI_FAILOVER_TRIES", "2"))
+
+
+def error_result(e: Exception, connect_failed: bool) -> dict:
+    """Resultado de uma exceção no POST; connect_failed = o pedido não chegou a sair."""
+    if connect_failed:
+        return {"ok": False, "error": str(e), "connect": True}
+    return {"ok": False, "error": str(e), "uncertain": True}
+
+
+def can_failover(res: dict) -> bool:
+    """Falha em que reenviar por outra instância não duplica a mensagem."""
+    if res.get("ok") or res.get("uncertain"):
+        return False
+    if res.get("connect"):
+        return True
+    st = res.get("status") or 0
+    return st == 429 or st >= 500
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Reserva um envio; devolve quantos segundos esperar antes de fazê-lo."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._t) * self.rate)
+            self._t = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class Instance:
+    def __init__(self, id: str, base: str, client_token: str = "", rate: float = ZAPI_RATE_PER_SECOND,
+                 burst: float = ZAPI_BURST, weight: int = 1):
+        self.id = id
+        self.base = base.rstrip("/")
+        self.headers = {"Client-Token": client_token, "Content-Type": "application/json"}
+        self.bucket = TokenBucket(rate, burst)
+        self.weight = max(1, int(weight))
+        self.fails = 0
+        self.down_until = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return self.down_until <= now
+
+    def record(self, res: dict):
+        if res.get("ok") or not (is_retryable(res) or res.get("uncertain")):
+            self.fails = 0
+            return
+        self.fails += 1
+        if self.fails >= ZAPI_FAILOVER_ERRORS:
+            self.down_until = time.time() + ZAPI_FAILOVER_COOLDOWN
+            self.fails = 0
+            metrics.count_failover(self.id)
+
+
+def load_instances(raw: str, default_base: str, default_client_token: str = ""):
+    """Instâncias do ZAPI_INSTANCES_JSON, ou a instância única da configuração antiga."""
+    items = json.loads(raw) if raw and raw.strip() else []
+    out = []
+    for i, it in enumerate(items):
+        base = it.get("base_url") or f"https://api.z-api.io/instances/{it['instance']}/token/{it['token']}"
+        out.append(Instance(str(it.get("id") or i), base, it.get("client_token", default_client_token),
+                            float(it.get("rate", ZAPI_RATE_PER_SECOND)), float(it.get("burst", ZAPI_BURST)),
+                            int(it.get("weight", 1))))
+    return out or [Instance("default", default_base, default_client_token)]
+
+
+class ZapiPool:
+    def __init__(self, instances):
+        self.instances = list(instances)
+        ring = sorted((_hash(f"{inst.id}#{v}"), n) for n, inst in enumerate(self.instances)
+                      for v in range(ZAPI_VNODES * inst.weight))
+        self._points = [h for h, _ in ring]
+        self._owners = [n for _, n in ring]
+
+    def candidates(self, phone: str):
+        """Instâncias na ordem do anel a partir do telefone; as fora do ar vão para o fim."""
+        if len(self.instances) == 1:
+            return self.instances
+        start = bisect.bisect(self._points, _hash(phone)) % len(self._points)
+        order, seen = [], set()
+        for k in range(len(self._owners)):
+            n = self._owners[(start + k) % len(self._owners)]
+            if n not in seen:
+                seen.add(n)
+                order.append(self.instances[n])
+                if len(order) == len(self.instances):
+                    break
+        now = time.time()
+        return [i for i in order if i.healthy(now)] + [i for i in order if not i.healthy(now)]
+
+    def instance_for(self, phone: str) -> Instance:
+        return self.candidates(phone)[0]
+
+    def send(self, phone: str, post) -> dict:
+        """post(instância) → dict {"ok", "status"/"error", ...}; troca de instância só se can_failover()."""
+        res = {}
+        for inst in self.candidates(phone)[:max(1, ZAPI_FAILOVER_TRIES)]:
+            wait = inst.bucket.reserve()
+            if wait:
+                time.sleep(wait)
+            res = post(inst)
+            inst.record(res)
+            res["instance"] = inst.id
+            if not can_failover(res):
+                break
+        return res
+
+    async def asend(self, phone: str, post) -> dict:
+        """send() para o app ASGI: post(instância) é uma corrotina."""
+        res = {}
+        for inst in self.candidates(phone)[:max(1, ZAPI_FAILOVER_TRIES)]:
+            wait = inst.bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            res = await post(inst)
+            inst.record(res)
+            res["instance"] = inst.id
+            if not can_failover(res):
+                break
+        return res
+
+    def state(self) -> list:
+        now = time.time()
+        return [{"id": i.id, "healthy": i.healthy(now), "fails": i.fails} for i in self.instances]